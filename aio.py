@@ -0,0 +1,97 @@
+"""
+FastAPI event loop'unu bloklamadan PBS / rclone / host işlerini çalıştırma yardımcıları.
+
+Kısa süreli dış komutlar (rclone listremotes vb.) asyncio alt süreci olarak çalışır; zaman aşımında
+veya istek iptal edildiğinde süreç öldürülür. Senkron katman (katalog, gezgin, host kabuğu) sınırlı
+bir thread havuzunda çalışır; havuz dolarsa yeni işler kuyrukta bekler, event loop serbest kalır.
+run_blocking'in zaman aşımı worker thread'ine bir son tarih (deadline) olarak da verilir: host kabuğu komutları,
+katalog çağrısı ve klasör boyutu taraması bu süreyi aşmaz; süre dolunca çalışan host komutu öldürülür.
+"""
+import asyncio
+import functools
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# --- Constants ---
+API_WORKERS = int(os.environ.get("PBSYNC_API_WORKERS", "8"))
+PBS_TIMEOUT = int(os.environ.get("PBSYNC_PBS_TIMEOUT", "60"))
+RCLONE_TIMEOUT = int(os.environ.get("PBSYNC_RCLONE_TIMEOUT", "20"))
+EXPLORE_TIMEOUT = int(os.environ.get("PBSYNC_EXPLORE_TIMEOUT", "180"))
+
+class OperationTimeout(Exception):
+    pass
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="pbsync-api")
+_DEADLINE = threading.local()
+
+@contextmanager
+def deadline(seconds):
+    """Bu thread'de çalışan engelleyici işler için son tarih; iç içe kullanımda en yakın olanı geçerlidir"""
+    previous = getattr(_DEADLINE, "at", None)
+    at = time.monotonic() + seconds
+    _DEADLINE.at = at if previous is None else min(previous, at)
+    try:
+        yield
+    finally:
+        _DEADLINE.at = previous
+
+def time_left(default):
+    """default ile son tarihe kalan sürenin küçüğü (son tarih yoksa default)"""
+    at = getattr(_DEADLINE, "at", None)
+    if at is None: return default
+    return max(0.0, min(default, at - time.monotonic()))
+
+def deadline_passed():
+    at = getattr(_DEADLINE, "at", None)
+    return at is not None and time.monotonic() >= at
+
+def _with_deadline(fn, timeout):
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        with deadline(timeout):
+            return fn(*args, **kwargs)
+    return call
+
+async def run_blocking(fn, *args, timeout=None, **kwargs):
+    """
+    fn'i API thread havuzunda çalıştırır. Zaman aşımında OperationTimeout fırlatılır; henüz başlamamış iş
+    iptal edilir. Başlamış iş aynı son tarihi görür: host komutları öldürülür, sonraki host çağrıları
+    çalıştırılmadan başarısız olur ve worker serbest kalır.
+    """
+    loop = asyncio.get_running_loop()
+    if timeout is not None: fn = _with_deadline(fn, timeout)
+    future = loop.run_in_executor(_EXECUTOR, functools.partial(fn, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise OperationTimeout(f"{getattr(fn, '__name__', 'operation')} timed out after {timeout}s")
+
+async def run_command(args, timeout=RCLONE_TIMEOUT, env=None, input=None):
+    """Komutu asyncio alt süreci olarak çalıştırır; zaman aşımı / iptalde süreci öldürür"""
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(input), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        try: proc.kill()
+        except ProcessLookupError: pass
+        await proc.wait()
+        if isinstance(e, asyncio.TimeoutError): raise OperationTimeout(f"{args[0]} timed out after {timeout}s")
+        raise
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+
+async def check_command(args, timeout=RCLONE_TIMEOUT, env=None):
+    """run_command; sıfır olmayan çıkış kodunda stderr ile birlikte hata fırlatır, stdout'u metin döner"""
+    result = await run_command(args, timeout, env)
+    if result.returncode != 0:
+        raise Exception(result.stderr.decode(errors="replace").strip() or f"{args[0]} exited with {result.returncode}")
+    return result.stdout.decode(errors="replace")
+
+def shutdown():
+    _EXECUTOR.shutdown(wait=False, cancel_futures=True)
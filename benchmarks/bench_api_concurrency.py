@@ -0,0 +1,101 @@
+"""
+Uzun süren /explore ve /scan-vms istekleri sürerken log ve durum uçlarının yanıt süresini ölçer.
+
+Gezgin ve katalog, belirtilen süre boyunca bloklayan sahte fonksiyonlarla değiştirilir (host gerekmez);
+event loop bloklanırsa /stream-logs, /jobs ve /explore/sessions gecikmesi bu süreye yaklaşır.
+
+    pip install -r benchmarks/requirements.txt   # httpx
+    python benchmarks/bench_api_concurrency.py --delay 2 --explores 4
+Bloklanma istek süresinde değil, istekler arasında görünebilir; bu yüzden ardışık iki yoklama turu
+arasındaki en uzun boşluk (max_gap_ms) da ölçülür.
+Çıkış kodu: yük altındaki en uzun boşluk --max-latency'yi aşarsa 1.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import httpx  # noqa: E402
+with contextlib.redirect_stdout(sys.stderr):  # sonuç JSON'u stdout'ta tek başına kalsın
+    import main as app_main  # noqa: E402
+from config import Config  # noqa: E402
+
+FAST_ENDPOINTS = [("GET", "/stream-logs"), ("GET", "/jobs"), ("GET", "/explore/sessions")]
+
+def install_stubs(delay):
+    def slow_explore(config, snapshot, partition_id=None, path="", *args):
+        time.sleep(delay)
+        return {"status": "success", "type": "files", "items": []}
+    def slow_ensure(repository, env=None, refresh=False):
+        time.sleep(delay)
+        return app_main.CATALOG
+    app_main.list_files_or_partitions = slow_explore
+    app_main.CATALOG.ensure = slow_ensure
+    app_main.app.dependency_overrides[app_main.get_config] = lambda: Config({"pbs_host": "bench", "pbs_repo": "store"})
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else None
+
+async def probe(client, stop, latencies, gaps):
+    last = time.perf_counter()
+    while not stop.is_set():
+        for method, url in FAST_ENDPOINTS:
+            start = time.perf_counter()
+            await client.request(method, url)
+            latencies.setdefault(url, []).append(time.perf_counter() - start)
+        await asyncio.sleep(0.02)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+async def run(args):
+    install_stubs(args.delay)
+    transport = httpx.ASGITransport(app=app_main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.delay * 10) as client:
+        idle, idle_gaps = {}, []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, stop, idle, idle_gaps))
+        await asyncio.sleep(0.5)
+        stop.set()
+        await task
+
+        loaded, loaded_gaps = {}, []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, stop, loaded, loaded_gaps))
+        start = time.perf_counter()
+        slow = [client.post("/explore", data={"snapshot": "vm/100/2024-01-01T00:00:00Z"}) for _ in range(args.explores)]
+        slow.append(client.post("/scan-vms"))
+        responses = await asyncio.gather(*slow)
+        slow_elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+
+    results = {
+        "delay_s": args.delay,
+        "slow_requests": len(responses),
+        "slow_status": sorted({r.status_code for r in responses}),
+        "slow_elapsed_s": round(slow_elapsed, 3),
+        "idle": {url: {"n": len(v), "p95_ms": round(percentile(v, 95) * 1000, 2)} for url, v in idle.items()},
+        "under_load": {url: {"n": len(v), "p95_ms": round(percentile(v, 95) * 1000, 2),
+                             "max_ms": round(max(v) * 1000, 2)} for url, v in loaded.items()},
+    }
+    results["idle_max_gap_ms"] = round(max(idle_gaps, default=0) * 1000, 2)
+    results["max_gap_ms"] = round(max(loaded_gaps, default=0) * 1000, 2)
+    results["ok"] = max(loaded_gaps, default=0) <= args.max_latency
+    print(json.dumps(results, indent=2))
+    return 0 if results["ok"] else 1
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delay", type=float, default=2.0, help="sahte explore / katalog süresi (s)")
+    parser.add_argument("--explores", type=int, default=4)
+    parser.add_argument("--max-latency", type=float, default=0.25, help="yük altında izin verilen en uzun boşluk (s)")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Codec'lerin hız ve sıkıştırma oranını örnek veri üzerinde karşılaştırır.
+
+    python benchmarks/bench_compression.py                 # sentetik örnek (metin + rastgele + sıfır blokları)
+    python benchmarks/bench_compression.py --source /etc   # verilen klasörün tar akışı
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compression import get_codec  # noqa: E402
+
+# (codec, level, long_mode)
+DEFAULT_MATRIX = [
+    ("none", None, False),
+    ("pigz", 1, False),
+    ("pigz", 6, False),
+    ("zstd", 1, False),
+    ("zstd", 3, False),
+    ("zstd", 3, True),
+    ("zstd", 9, False),
+    ("lz4", 1, False),
+]
+
+def synthetic_sample(size_mb, seed=42):
+    """VM diskine benzer karışım: log/metin benzeri, sıkıştırılamaz ve boş bloklar"""
+    rnd = random.Random(seed)
+    words = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(3, 10))) for _ in range(2000)]
+    chunks, total, target = [], 0, size_mb * 1024 * 1024
+    while total < target:
+        kind = rnd.random()
+        if kind < 0.5:
+            block = (" ".join(rnd.choice(words) for _ in range(20000)) + "\n").encode()
+        elif kind < 0.8:
+            block = rnd.randbytes(1024 * 1024)
+        else:
+            block = bytes(1024 * 1024)
+        chunks.append(block)
+        total += len(block)
+    return b"".join(chunks)[:target]
+
+def tar_sample(source):
+    return subprocess.run(["tar", "-C", source, "-cf", "-", "."], capture_output=True, check=True).stdout
+
+def run_codec(data, codec):
+    cmd = codec.command()
+    if cmd is None:
+        return len(data), 0.0
+    if shutil.which(cmd[0]) is None:
+        return None, None
+    start = time.perf_counter()
+    res = subprocess.run(cmd, input=data, capture_output=True, check=True)
+    return len(res.stdout), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--source", help="örnek olarak tar'lanacak klasör")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    data = tar_sample(args.source) if args.source else synthetic_sample(args.size_mb)
+    results = []
+    for name, level, long_mode in DEFAULT_MATRIX:
+        codec = get_codec(name, level, args.threads, long_mode)
+        out_size, seconds = run_codec(data, codec)
+        if out_size is None:
+            results.append({"codec": name, "level": level, "long_mode": long_mode, "skipped": "not installed"})
+            continue
+        results.append({
+            "codec": name,
+            "level": codec.level,
+            "threads": codec.threads,
+            "long_mode": long_mode,
+            "input_bytes": len(data),
+            "output_bytes": out_size,
+            "ratio": round(out_size / len(data), 4),
+            "seconds": round(seconds, 3),
+            "throughput_mb_s": round(len(data) / seconds / 1024 / 1024, 1) if seconds else None,
+        })
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Kalıcı host kabuğu ile komut başına nsenter başlatmayı karşılaştırır.
+
+    python benchmarks/bench_host_shell.py            # host üzerinde (nsenter, yetki gerekir)
+    python benchmarks/bench_host_shell.py --local    # nsenter olmadan yerel bash ile
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hostshell import HostShell, HOST_SHELL_ARGV  # noqa: E402
+
+LOCAL_ARGV = ["bash", "--noprofile", "--norc"]
+
+def spawn(command, local):
+    if local:
+        return subprocess.run(["bash", "-c", command], capture_output=True, text=True)
+    return subprocess.run(HOST_SHELL_ARGV[:-2] + ["bash", "-c", command], capture_output=True, text=True)
+
+def timed(fn, n):
+    start = time.perf_counter()
+    for _ in range(n): fn()
+    return (time.perf_counter() - start) / n * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=5, help="cleanup() benzeri toplu çağrı boyutu")
+    parser.add_argument("--local", action="store_true")
+    args = parser.parse_args()
+
+    command = "echo ok"
+    shell = HostShell(LOCAL_ARGV if args.local else None)
+    shell.run(command)  # başlatma maliyetini ölçüme katmıyoruz
+
+    results = {
+        "spawn_ms": timed(lambda: spawn(command, args.local), args.n),
+        "channel_ms": timed(lambda: shell.run(command), args.n),
+        "spawn_batch_ms": timed(lambda: [spawn(command, args.local) for _ in range(args.batch)], args.n // args.batch or 1),
+        "channel_batch_ms": timed(lambda: shell.run_batch([command] * args.batch), args.n // args.batch or 1),
+    }
+    shell.close()
+    results["speedup"] = results["spawn_ms"] / results["channel_ms"]
+    results["batch_speedup"] = results["spawn_batch_ms"] / results["channel_batch_ms"]
+    print(json.dumps({k: round(v, 3) for k, v in results.items()}, indent=2))
+
+if __name__ == "__main__":
+    main()
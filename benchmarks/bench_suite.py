@@ -0,0 +1,410 @@
+"""
+Gerçek PBS host'u olmadan uçtan uca performans ölçümü.
+
+benchmarks/stubs altındaki nsenter, proxmox-backup-client, lsblk, kpartx ve rclone yerine geçen
+betikler PATH'in başına eklenir: snapshot'lar yerel bir ext4 test imajını salt okunur loop cihazına
+bağlar, rclone hedefi yerel bir dizindir. mount / losetup gerçek olduğu için root ve loop cihazı gerekir.
+
+Ölçülenler:
+  catalog  /scan-vms ve /scan-snapshots; büyük sentetik snapshot listesi ile yenileme (refresh) ve önbellekten
+  explore  /explore soğuk (map + mount) ve sıcak (açık oturum) istekler
+  stream   run_backup_process'in codec başına uçtan uca hızı ve aşama süreleri
+  retention  sahte saatle günlerce çalışan zamanlayıcı: jitter dağılımı, eşzamanlı iş sınırı, budama sonrası
+           tutulan setler ve rclone çağrı sayısı (iş yerine hedefe sahte arşiv yazılır)
+
+    pip install -r benchmarks/requirements.txt   # httpx
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --snapshots 50000 --codecs zstd,none --data-mb 512
+
+Sonuç tek bir JSON belgesidir (varsayılan stdout); zaman içinde karşılaştırılmak üzere saklanabilir.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+sys.path.insert(0, ROOT_DIR)
+from bench_compression import synthetic_sample  # noqa: E402
+
+RESULT_VERSION = 1
+REMOTE = "bench"
+
+def summarize(seconds):
+    values = sorted(seconds)
+    if not values: return {"n": 0}
+    pick = lambda pct: values[min(len(values) - 1, int(len(values) * pct / 100))]
+    return {
+        "n": len(values),
+        "min_ms": round(values[0] * 1000, 2),
+        "p50_ms": round(statistics.median(values) * 1000, 2),
+        "p95_ms": round(pick(95) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+def build_image(workspace, data_mb, dir_entries, small_files):
+    """
+    Sentetik bir dosya ağacından ext4 imajı üretir (mkfs.ext4 -d; mount gerekmez).
+    Büyük dosyalar metin / rastgele / sıfır karışımıdır; listing/ altında gezgin için çok girdili bir klasör vardır.
+    """
+    tree = os.path.join(workspace, "tree")
+    for sub in ("data", "etc", "listing"): os.makedirs(os.path.join(tree, sub), exist_ok=True)
+    sample = synthetic_sample(max(data_mb, 1))
+    chunk = 16 * 1024 * 1024
+    for i in range(0, len(sample), chunk):
+        with open(os.path.join(tree, "data", f"blob-{i // chunk:03d}.bin"), "wb") as f: f.write(sample[i:i + chunk])
+    for i in range(small_files):
+        with open(os.path.join(tree, "etc", f"conf-{i:05d}.conf"), "wb") as f:
+            f.write(sample[i * 4096:(i + 1) * 4096])
+    for i in range(dir_entries):
+        open(os.path.join(tree, "listing", f"entry-{i:06d}.txt"), "w").close()
+
+    images = os.path.join(workspace, "images")
+    os.makedirs(images, exist_ok=True)
+    image = os.path.join(images, "disk.img")
+    size_mb = int(data_mb * 1.3) + small_files * 8 // 1024 + dir_entries * 4 // 1024 + 64
+    subprocess.run(["truncate", "-s", f"{size_mb}M", image], check=True)
+    subprocess.run(["mkfs.ext4", "-q", "-F", "-L", "pbsync-bench", "-d", tree, image], check=True)
+    shutil.rmtree(tree)
+    return image, size_mb
+
+def detach_loops(image):
+    out = subprocess.run(["losetup", "-j", image], capture_output=True, text=True).stdout
+    for line in out.splitlines():
+        subprocess.run(["losetup", "-d", line.split(":")[0]], capture_output=True)
+
+def configure(workspace, args):
+    """Stub'ları ve iş / oturum / veri dizinlerini çalışma alanına yönlendirir; main'i içe aktarır"""
+    os.environ["PATH"] = STUBS_DIR + os.pathsep + os.environ.get("PATH", "")
+    os.environ["PBSYNC_BENCH_DIR"] = workspace
+    os.environ["PBSYNC_BENCH_SNAPSHOTS"] = str(args.snapshots)
+    os.environ["PBSYNC_BENCH_VMS"] = str(args.vms)
+    os.environ["PBSYNC_BENCH_LATENCY"] = str(args.latency)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        import main as app_main
+    import chunked
+    import core
+    import jobs
+    import sessions
+    from config import Config
+    from layout import LAYOUTS
+    from manifest import MANIFESTS
+    from mappings import MAPPINGS
+
+    data = os.path.join(workspace, "data")
+    os.makedirs(os.path.join(data, "jobs"), exist_ok=True)
+    jobs.JOBS_DIR = os.path.join(data, "jobs")
+    jobs.JOB_MOUNT_ROOT = os.path.join(workspace, "mnt", "jobs")
+    sessions.SESSION_ROOT = os.path.join(workspace, "mnt", "sessions")
+    chunked.UPLOAD_STATE_DIR = os.path.join(data, "uploads")
+    MANIFESTS.db_path = os.path.join(data, "manifests.db")
+    LAYOUTS.path = os.path.join(data, "layouts.json")
+    MAPPINGS.path = os.path.join(data, "mappings.json")
+
+    rclone_conf = os.path.join(data, "rclone.conf")
+    with open(rclone_conf, "w") as f: f.write(f"[{REMOTE}]\ntype = local\n")
+    config = Config({"pbs_host": "bench", "pbs_repo": "store"}, rclone_config=rclone_conf)
+    app_main.app.dependency_overrides[app_main.get_config] = lambda: config
+    return app_main, config
+
+async def bench_catalog(client, app_main, args):
+    async def timed_post(url, data=None):
+        start = time.perf_counter()
+        r = await client.post(url, data=data)
+        elapsed = time.perf_counter() - start
+        body = r.json()
+        if body.get("status") != "success": raise Exception(f"{url}: {body}")
+        return elapsed, body
+
+    results = {}
+    for name, url, data, key in (("scan_vms", "/scan-vms", None, "vms"),
+                                 ("scan_snapshots", "/scan-snapshots", {"vmid": "100"}, "snapshots")):
+        refresh, cached, count = [], [], 0
+        for _ in range(args.catalog_runs):
+            elapsed, body = await timed_post(f"{url}?refresh=true", data)
+            refresh.append(elapsed)
+            count = len(body[key])
+        for _ in range(args.catalog_runs * 5):
+            cached.append((await timed_post(url, data))[0])
+        results[name] = {"items": count, "refresh": summarize(refresh), "cached": summarize(cached)}
+    results["catalog_snapshots"] = args.snapshots
+    results["catalog_groups"] = len(app_main.CATALOG.groups())
+    return results
+
+async def bench_explore(client, app_main, snapshot, args):
+    async def explore(**data):
+        start = time.perf_counter()
+        r = await client.post("/explore", data={"snapshot": snapshot, **data})
+        elapsed = time.perf_counter() - start
+        body = r.json()
+        if body.get("status") != "success": raise Exception(f"/explore {data}: {body}")
+        return elapsed, body
+
+    cold_partitions, cold_files, warm_root, warm_listing, full_listing = [], [], [], [], []
+    listing_items, pages = 0, 0
+    for _ in range(args.explore_runs):
+        app_main.SESSIONS.close(snapshot)
+        cold_partitions.append((await explore())[0])
+        cold_files.append((await explore(partition_id="0"))[0])
+    for _ in range(args.explore_runs * 5):
+        warm_root.append((await explore(partition_id="0"))[0])
+        elapsed, body = await explore(partition_id="0", path="listing")
+        warm_listing.append(elapsed)
+        listing_items = body["total"]
+    # Büyük klasörün tamamı: cursor ile tüm sayfalar, boyut ve mtime dahil
+    for _ in range(args.explore_runs):
+        cursor, pages, start = None, 0, time.perf_counter()
+        while True:
+            _, body = await explore(partition_id="0", path="listing", details="true", **({"cursor": cursor} if cursor else {}))
+            pages += 1
+            cursor = body["next_cursor"]
+            if not cursor: break
+        full_listing.append(time.perf_counter() - start)
+    app_main.SESSIONS.close(snapshot)
+    return {
+        "cold_partitions": summarize(cold_partitions),
+        "cold_first_listing": summarize(cold_files),
+        "warm_root": summarize(warm_root),
+        "warm_large_dir_first_page": {**summarize(warm_listing), "entries": listing_items},
+        "warm_large_dir_all_pages": {**summarize(full_listing), "pages": pages},
+    }
+
+def bench_restore(job, archive):
+    """Aranabilir arşivden tek bir dosyanın geri yüklenmesi: indirilen byte arşivin küçük bir kısmı olmalı"""
+    import seekable
+    full_path = f"{REMOTE}:{job.target_folder}/{job.archive['name']}"
+    seekable._INDEXES.clear()
+    start = time.perf_counter()
+    index = seekable.load_index(full_path)
+    index_s = time.perf_counter() - start
+    entry = max((e for e in index["files"] if e[4] == "0"), key=lambda e: e[3])
+    start = time.perf_counter()
+    restored = sum(len(chunk) for chunk in seekable.iter_file(full_path, index, entry))
+    file_s = time.perf_counter() - start
+    frames = [f for f in index["frames"] if f[0] < entry[2] + entry[3] and f[0] + index["frame_size"] > entry[1]]
+    os.remove(archive + seekable.INDEX_SUFFIX)
+    return {"index_s": round(index_s, 4), "file_s": round(file_s, 4), "file_bytes": restored,
+            "frames_fetched": len(frames), "frames_total": len(index["frames"]),
+            "bytes_fetched": sum(f[2] for f in frames), "archive_bytes": os.path.getsize(archive)}
+
+def bench_stream(app_main, config, snapshot, workspace, args):
+    import core
+    from compression import get_codec
+    from jobs import BackupJob
+    from metrics import track
+
+    results = []
+    for name in args.codecs:
+        codec = get_codec(name)
+        command = codec.command()
+        if command and not shutil.which(command[0]):
+            results.append({"codec": name, "skipped": f"{command[0]} not installed"})
+            continue
+        runs = []
+        for i in range(args.stream_runs):
+            job = BackupJob(snapshot, REMOTE, target_folder=f"stream/{name}/{i}", codec=codec, mode="files")
+            job.timestamp = f"bench-{i}"
+            start = time.perf_counter()
+            with track(job.timings):
+                core.run_backup_process(config, job)
+            elapsed = time.perf_counter() - start
+            archive = os.path.join(workspace, "remote", REMOTE, "stream", name, str(i), job.archive["name"])
+            stored = os.path.getsize(archive)
+            read = job.progress.get("bytes_read") or 0
+            timings = job.timings.to_dict()
+            pipeline = timings["stages"].get("pipeline") or elapsed
+            run = {
+                "wall_s": round(elapsed, 3),
+                "bytes_read": read,
+                "bytes_stored": stored,
+                "ratio": round(stored / read, 4) if read else None,
+                "throughput_mb_s": round(read / pipeline / 1e6, 2) if pipeline else None,
+                "timings": timings,
+            }
+            if codec.seekable: run["restore"] = bench_restore(job, archive)
+            runs.append(run)
+            os.remove(archive)
+        best = max(runs, key=lambda r: r["throughput_mb_s"] or 0)
+        results.append({"codec": name, "level": codec.level, "runs": runs,
+                        "best_throughput_mb_s": best["throughput_mb_s"], "ratio": best["ratio"]})
+    return results
+
+class FakeJob:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "success"  # bir sonraki tick'te toplanır
+
+def bench_retention(workspace, args):
+    """Sahte saatle args.schedule_days gün: her gece 03:00'te tüm VM'ler, 10 dk jitter, en fazla 2 eşzamanlı iş"""
+    import retention
+    from schedules import BackupScheduler
+
+    folder = os.path.join(workspace, "remote", REMOTE, "retention")
+    os.makedirs(folder, exist_ok=True)
+    groups = [f"vm/{100 + i}" for i in range(args.schedule_vms)]
+    clock = [time.mktime((2026, 1, 1, 0, 0, 0, 0, 0, -1))]
+    stats = {"jobs": 0, "max_running": 0, "delays": [], "prunes": 0, "rclone_calls": 0, "deleted_sets": 0,
+             "prune_s": 0.0}
+
+    def resolve(policy):
+        # Her gün yeni bir snapshot
+        day = time.strftime("%Y-%m-%d", time.localtime(clock[0]))
+        return {g: f"{g}/{day}T02:00:00Z" for g in groups}
+
+    def submit(policy, snapshot):
+        vmid = snapshot.split("/")[1]
+        name = f"{vmid}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(clock[0]))}"
+        # vm/101 artımlı: pazar günleri tam, diğer günler .incr
+        incremental = vmid == "101" and time.localtime(clock[0]).tm_wday != 6
+        for suffix in ((".incr.tar.zst", ".incr.deleted") if incremental else (".tar.zst", ".tar.zst.idx")):
+            with open(os.path.join(folder, name + suffix), "wb") as f: f.write(b"x" * 1024)
+        stats["jobs"] += 1
+        tm = time.localtime(clock[0])
+        stats["delays"].append(tm.tm_hour * 3600 + tm.tm_min * 60 + tm.tm_sec)
+        return FakeJob(f"{vmid}-{stats['jobs']}")
+
+    def prune(remote, target_folder, rules):
+        start = time.perf_counter()
+        result = retention.prune_folder(f"{remote}:{target_folder}", rules, log=lambda m: None)
+        stats["prune_s"] += time.perf_counter() - start
+        stats["prunes"] += 1
+        stats["rclone_calls"] += result["rclone_calls"]
+        stats["deleted_sets"] += len(result["delete"])
+        return result
+
+    path = os.path.join(workspace, "data", "schedules.json")
+    scheduler = BackupScheduler(resolve, submit, prune, path=path, clock=lambda: clock[0], max_jobs=2,
+                                log=lambda m: None)
+    scheduler.upsert({"id": "nightly", "cron": "0 3 * * *", "selector": "vm/*", "remote": REMOTE,
+                      "target_folder": "retention", "jitter": 600,
+                      "retention": {"keep_last": 3, "keep_daily": 7, "keep_weekly": 4}})
+    start, end = time.perf_counter(), clock[0] + args.schedule_days * 86400
+    while clock[0] < end:
+        scheduler.tick()
+        stats["max_running"] = max(stats["max_running"], len(scheduler.running))
+        clock[0] += 60
+    elapsed = time.perf_counter() - start
+
+    kept = retention.group_sets(json.loads(subprocess.run(["rclone", "lsjson", f"{REMOTE}:retention"],
+                                                          capture_output=True).stdout))
+    # Yeniden başlatma: kapalıyken kaçırılan 3 gece tek bir çalıştırma olarak telafi edilir
+    jobs_before = stats["jobs"]
+    clock[0] += 3 * 86400
+    restarted = BackupScheduler(resolve, submit, prune, path=path, clock=lambda: clock[0], max_jobs=2,
+                                log=lambda m: None)
+    for _ in range(30):
+        restarted.tick()
+        clock[0] += 60
+    delays = [d - 3 * 3600 for d in stats["delays"][:jobs_before]]
+    return {
+        "days": args.schedule_days,
+        "vms": len(groups),
+        "ticks_s": round(elapsed, 3),
+        "jobs": jobs_before,
+        "max_running": stats["max_running"],
+        "start_delay_s": {"min": min(delays), "max": max(delays)} if delays else None,
+        "prunes": stats["prunes"],
+        "prune_avg_ms": round(stats["prune_s"] / stats["prunes"] * 1000, 2) if stats["prunes"] else None,
+        "rclone_calls_per_prune": round(stats["rclone_calls"] / stats["prunes"], 2) if stats["prunes"] else None,
+        "deleted_sets": stats["deleted_sets"],
+        "kept_sets": {vmid: [s.timestamp for s in sets] for vmid, sets in sorted(kept.items())[:2]},
+        "kept_per_vm": sorted({len(sets) for sets in kept.values()}),
+        "jobs_after_restart": stats["jobs"] - jobs_before,
+    }
+
+async def run(args, workspace):
+    image, image_mb = build_image(workspace, args.data_mb, args.dir_entries, args.small_files)
+    app_main, config = configure(workspace, args)
+    import httpx
+    from metrics import METRICS
+
+    snapshot = "vm/100/2023-11-14T22:13:20Z"
+    results = {
+        "suite": "pbsync-hermetic",
+        "version": RESULT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git": subprocess.run(["git", "-C", ROOT_DIR, "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True).stdout.strip() or None,
+        "python": platform.python_version(),
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+        "params": {"snapshots": args.snapshots, "vms": args.vms, "data_mb": args.data_mb, "image_mb": image_mb,
+                   "dir_entries": args.dir_entries, "small_files": args.small_files, "latency_s": args.latency,
+                   "host_shell": os.environ.get("PBSYNC_HOST_SHELL", "1") != "0"},
+    }
+    transport = httpx.ASGITransport(app=app_main.app)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+                if "catalog" in args.only: results["catalog"] = await bench_catalog(client, app_main, args)
+                if "explore" in args.only: results["explore"] = await bench_explore(client, app_main, snapshot, args)
+            if "stream" in args.only:
+                results["stream"] = await asyncio.to_thread(bench_stream, app_main, config, snapshot, workspace, args)
+            if "retention" in args.only:
+                results["retention"] = await asyncio.to_thread(bench_retention, workspace, args)
+        results["metrics"] = [line for line in METRICS.render().splitlines()
+                              if line.startswith(("pbsync_host_commands_total", "pbsync_stage_duration_seconds_sum",
+                                                  "pbsync_stage_duration_seconds_count"))]
+    finally:
+        with contextlib.redirect_stdout(sys.stderr):
+            app_main.SESSIONS.close_all()
+            app_main.HOST_SHELL.close()
+            # İş logları arka planda yazılır; sonuç JSON'undan sonra stdout'a ve silinmiş çalışma alanına düşmesin
+            app_main.JOB_LOGS.flush()
+        detach_loops(image)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="sonuç JSON dosyası (varsayılan stdout)")
+    parser.add_argument("--only", default="catalog,explore,stream,retention", help="çalıştırılacak bölümler")
+    parser.add_argument("--snapshots", type=int, default=20000, help="sentetik snapshot sayısı")
+    parser.add_argument("--vms", type=int, default=200, help="snapshot'ların dağıtılacağı VM sayısı")
+    parser.add_argument("--latency", type=float, default=0.0, help="her proxmox-backup-client çağrısına eklenen gecikme (s)")
+    parser.add_argument("--data-mb", type=int, default=128, help="test imajındaki büyük dosyaların toplamı")
+    parser.add_argument("--small-files", type=int, default=2000)
+    parser.add_argument("--dir-entries", type=int, default=5000, help="gezgin için büyük klasördeki girdi sayısı")
+    parser.add_argument("--codecs", default="none,lz4,zstd,pigz,seekable")
+    parser.add_argument("--catalog-runs", type=int, default=3)
+    parser.add_argument("--explore-runs", type=int, default=3)
+    parser.add_argument("--stream-runs", type=int, default=1)
+    parser.add_argument("--schedule-days", type=int, default=60, help="retention: sahte saatle simüle edilen gün")
+    parser.add_argument("--schedule-vms", type=int, default=10)
+    parser.add_argument("--workspace", help="çalışma dizini (varsayılan: geçici dizin, sonunda silinir)")
+    args = parser.parse_args()
+    args.only = set(args.only.split(","))
+    args.codecs = [c.strip() for c in args.codecs.split(",") if c.strip()]
+
+    if os.geteuid() != 0 or not shutil.which("losetup") or not shutil.which("mkfs.ext4"):
+        print(json.dumps({"suite": "pbsync-hermetic", "ok": False, "error": "requires root, losetup and mkfs.ext4"}))
+        sys.exit(2)
+
+    workspace = args.workspace or tempfile.mkdtemp(prefix="pbsync-bench-")
+    os.makedirs(workspace, exist_ok=True)
+    try:
+        results = asyncio.run(run(args, workspace))
+        results["ok"] = True
+    except Exception as e:
+        results = {"suite": "pbsync-hermetic", "ok": False, "error": str(e)}
+    finally:
+        if not args.workspace: shutil.rmtree(workspace, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(0 if results["ok"] else 1)
+
+if __name__ == "__main__":
+    main()
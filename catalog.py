@@ -0,0 +1,98 @@
+import json
+import subprocess
+import threading
+import time
+from aio import time_left
+
+# --- Constants ---
+CATALOG_TTL = 120  # saniye; bu süreden eski liste bir sonraki istekte yenilenir
+CATALOG_FETCH_TIMEOUT = 60  # takılan PBS bağlantısı katalog kilidini sonsuza kadar tutmasın
+
+def snapshot_path(item: dict):
+    """PBS snapshot yolunu üretir: vm/100/2024-01-31T22:00:01Z"""
+    ts = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(item['backup-time'])))
+    return f"{item['backup-type']}/{item['backup-id']}/{ts}"
+
+class SnapshotCatalog:
+    """
+    `proxmox-backup-client snapshot list` çıktısının bellek içi indeksi.
+    Liste bir kez çekilir; grup (backup-type/backup-id) ve zamana göre indekslenir.
+    TTL dolunca veya refresh=True ile istendiğinde yeniden çekilir.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self.repository = None
+        self.loaded_at = 0.0
+        self.error = None
+        self.by_group = {}   # "vm/100" -> [(backup_time, "vm/100/..."), ...] yeniden eskiye
+        self.by_type = {}    # "vm" -> {"100", ...}
+        self._lock = threading.Lock()
+
+    def _fetch(self, repository: str, env=None):
+        output = subprocess.check_output(
+            ["proxmox-backup-client", "snapshot", "list", "--repository", repository, "--output-format", "json"],
+            env=env, stderr=subprocess.PIPE, timeout=time_left(CATALOG_FETCH_TIMEOUT)
+        )
+        return json.loads(output.decode())
+
+    def _index(self, data):
+        by_group, by_type = {}, {}
+        for item in data:
+            if 'backup-type' not in item or 'backup-id' not in item or 'backup-time' not in item: continue
+            group = f"{item['backup-type']}/{item['backup-id']}"
+            by_group.setdefault(group, []).append((int(item['backup-time']), snapshot_path(item)))
+            by_type.setdefault(item['backup-type'], set()).add(str(item['backup-id']))
+        for snaps in by_group.values():
+            snaps.sort(reverse=True)
+        self.by_group, self.by_type = by_group, by_type
+
+    def ensure(self, repository: str, env=None, refresh=False):
+        """Katalog taze değilse (veya repo değiştiyse) yeniler. Hata olursa exception fırlatır."""
+        with self._lock:
+            fresh = (
+                self.repository == repository
+                and self.error is None
+                and time.monotonic() - self.loaded_at < self.ttl
+            )
+            if fresh and not refresh: return self
+            try:
+                data = self._fetch(repository, env)
+            except subprocess.TimeoutExpired:
+                self.error = f"PBS did not respond within {CATALOG_FETCH_TIMEOUT}s"
+                raise Exception(self.error)
+            except subprocess.CalledProcessError as e:
+                self.error = (e.stderr or b"").decode(errors="replace").strip() or str(e)
+                raise Exception(self.error)
+            except Exception as e:
+                self.error = str(e)
+                raise
+            self._index(data)
+            self.repository = repository
+            self.loaded_at = time.monotonic()
+            self.error = None
+            return self
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = 0.0
+
+    def groups(self, backup_type: str = None):
+        if backup_type:
+            return sorted(f"{backup_type}/{i}" for i in self.by_type.get(backup_type, ()))
+        return sorted(self.by_group.keys())
+
+    def snapshots(self, group: str, since: int = None, until: int = None):
+        """Grubun snapshot'larını yeniden eskiye döner; isteğe bağlı zaman aralığı ile süzülür"""
+        result = []
+        for backup_time, path in self.by_group.get(group, ()):
+            if until is not None and backup_time > until: continue
+            if since is not None and backup_time < since: break
+            result.append(path)
+        return result
+
+    def latest(self, group: str):
+        snaps = self.by_group.get(group)
+        return snaps[0][1] if snaps else None
+
+CATALOG = SnapshotCatalog()
@@ -0,0 +1,225 @@
+"""
+Parçalı, paralel ve devam ettirilebilir yükleme.
+
+Sıkıştırılmış akış sabit boyutlu parçalara bölünür ve sınırlı sayıda eşzamanlı rclone rcat ile
+<arşiv>.parts/part-NNNNNN olarak yüklenir. Bellekte en fazla (worker + 1) parça tamponu tutulur.
+Tamamlanan parçalar /app/data/uploads altındaki durum dosyasına yazılır; aynı arşiv yeniden
+yüklenirken boyutu ve sha256'sı tutan parçalar tekrar gönderilmez.
+Parçaların nasıl birleştirileceği <arşiv>.parts/manifest.json içinde yazar.
+
+Geri yükleme:
+    python chunked.py cat remote:klasor/100_20240101-000000.tar.gz.parts | tar -xzf -
+"""
+import hashlib
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Constants ---
+PART_SIZE = int(os.environ.get("PBSYNC_PART_SIZE_MB", "64")) * 1024 * 1024
+UPLOAD_WORKERS = int(os.environ.get("PBSYNC_UPLOAD_WORKERS", "4"))
+PART_RETRIES = int(os.environ.get("PBSYNC_PART_RETRIES", "3"))
+UPLOAD_STATE_DIR = "/app/data/uploads"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+def part_name(index):
+    return f"part-{index:06d}"
+
+def parts_dir(full_remote_path):
+    return f"{full_remote_path}.parts"
+
+class UploadState:
+    """Tamamlanan parçaların yerel kaydı; her commit'te atomik olarak diske yazılır"""
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.parts = {}  # index -> {"size", "sha256"}
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("key") == key:
+                self.parts = {int(i): p for i, p in data.get("parts", {}).items()}
+        except (OSError, ValueError): pass
+
+    def matches(self, index, size, digest):
+        with self._lock:
+            part = self.parts.get(index)
+        return part is not None and part["size"] == size and part["sha256"] == digest
+
+    def commit(self, index, size, digest):
+        with self._lock:
+            self.parts[index] = {"size": size, "sha256": digest}
+            data = {"key": self.key, "parts": self.parts}
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+
+    def discard(self):
+        try: os.remove(self.path)
+        except OSError: pass
+
+class UploadStats:
+    """Yüklenen / devam ettirilen (atlanan) byte sayaçları; ilerleme takibi için başka thread'den okunur"""
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.bytes_uploaded = 0
+        self.bytes_resumed = 0
+        self.parts_uploaded = 0
+        self.parts_resumed = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items(): setattr(self, key, getattr(self, key) + value)
+
+class ChunkedUploader:
+    """
+    Bir akışı parçalara bölüp paralel yükler.
+    register_process(proc) iptal için rclone süreçlerini kaydeder; cancelled() doğru dönerse okuma durur.
+    """
+
+    def __init__(self, remote_dir, state_path, part_size=PART_SIZE, workers=UPLOAD_WORKERS, retries=PART_RETRIES,
+                 register_process=None, cancelled=None, log=print, env=None):
+        self.remote_dir = remote_dir.rstrip("/")
+        self.env = env
+        self.part_size = part_size
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.register_process = register_process
+        self.cancelled = cancelled or (lambda: False)
+        self.log = log
+        self.state = UploadState(state_path, f"{self.remote_dir}|{part_size}")
+        self.stats = UploadStats()
+        self._free = queue.Queue()
+        self._allocated = 0
+        self._errors = []
+
+    def _buffer(self):
+        """Boş tampon alır; en fazla workers + 1 tampon ayrılır, gerisi serbest kalanı bekler"""
+        try: return self._free.get_nowait()
+        except queue.Empty: pass
+        if self._allocated < self.workers + 1:
+            self._allocated += 1
+            return bytearray(self.part_size)
+        while True:
+            try: return self._free.get(timeout=0.5)
+            except queue.Empty:
+                if self._errors or self.cancelled(): return None
+
+    def _fill(self, stream, buf):
+        view = memoryview(buf)
+        n = 0
+        while n < self.part_size:
+            read = stream.readinto(view[n:])
+            if not read: break
+            n += read
+        return n
+
+    def _rcat(self, remote, data):
+        proc = subprocess.Popen(["rclone", "rcat", remote], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, env=self.env)
+        if self.register_process: self.register_process(proc)
+        _, err = proc.communicate(data)
+        if proc.returncode != 0:
+            raise Exception(err.decode(errors="replace").strip() or f"rclone exited with {proc.returncode}")
+
+    def _upload_part(self, index, buf, size):
+        try:
+            data = memoryview(buf)[:size]
+            digest = hashlib.sha256(data).hexdigest()
+            if self.state.matches(index, size, digest):
+                self.stats.add(bytes_resumed=size, parts_resumed=1)
+                return index, size, digest
+            for attempt in range(self.retries + 1):
+                if self.cancelled(): raise InterruptedError("Upload cancelled.")
+                try:
+                    self._rcat(f"{self.remote_dir}/{part_name(index)}", data)
+                    break
+                except Exception as e:
+                    if attempt >= self.retries: raise Exception(f"Part {index} failed: {e}")
+                    self.stats.add(retries=1)
+                    self.log(f"[Cloud] Part {index} failed ({e}), retrying ({attempt + 1}/{self.retries})...")
+                    time.sleep(min(2 ** attempt, 30))
+            self.state.commit(index, size, digest)
+            self.stats.add(bytes_uploaded=size, parts_uploaded=1)
+            return index, size, digest
+        except Exception as e:
+            self._errors.append(e)
+            raise
+        finally:
+            self._free.put(buf)
+
+    def upload(self, stream, metadata=None, before_commit=None):
+        """
+        Akışı EOF'a kadar okuyup yükler, sonra manifest.json'u yazar. Manifest sözlüğünü döner.
+        before_commit() manifest yazılmadan önce çağrılır (ör. üst aşamaların çıkış kodu kontrolü);
+        hata fırlatırsa manifest yazılmaz, tamamlanan parçalar devam için kayıtlı kalır.
+        """
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pbsync-upload") as pool:
+            index = 0
+            while not self._errors:
+                if self.cancelled(): raise InterruptedError("Upload cancelled.")
+                buf = self._buffer()
+                if buf is None: break
+                size = self._fill(stream, buf)
+                if size == 0 and index > 0:
+                    self._free.put(buf)
+                    break
+                self.stats.bytes_read += size
+                futures.append(pool.submit(self._upload_part, index, buf, size))
+                index += 1
+                if size < self.part_size: break
+            parts = []
+            for future in futures:
+                try: parts.append(future.result())
+                except Exception: pass
+        if self.cancelled(): raise InterruptedError("Upload cancelled.")
+        if self._errors: raise self._errors[0]
+        if before_commit is not None: before_commit()
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "part_size": self.part_size,
+            "total_size": sum(size for _, size, _ in parts),
+            "parts": [{"name": part_name(i), "size": size, "sha256": digest} for i, size, digest in sorted(parts)],
+            **(metadata or {}),
+        }
+        self._rcat(f"{self.remote_dir}/{MANIFEST_NAME}", json.dumps(manifest, indent=1).encode())
+        self.state.discard()
+        return manifest
+
+def state_path_for(job_key):
+    os.makedirs(UPLOAD_STATE_DIR, exist_ok=True)
+    return os.path.join(UPLOAD_STATE_DIR, hashlib.sha1(job_key.encode()).hexdigest() + ".json")
+
+def cat(remote_dir, out, env=None):
+    """Manifest'e göre parçaları sırayla indirir, sha256 doğrular ve out'a yazar"""
+    remote_dir = remote_dir.rstrip("/")
+    manifest = json.loads(subprocess.run(["rclone", "cat", f"{remote_dir}/{MANIFEST_NAME}"], capture_output=True,
+                                         check=True, env=env).stdout)
+    for part in manifest["parts"]:
+        data = subprocess.run(["rclone", "cat", f"{remote_dir}/{part['name']}"], capture_output=True, check=True,
+                              env=env).stdout
+        if len(data) != part["size"] or hashlib.sha256(data).hexdigest() != part["sha256"]:
+            raise ValueError(f"Checksum mismatch in {part['name']}")
+        out.write(data)
+    out.flush()
+    return manifest
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "cat":
+        print("usage: python chunked.py cat <remote:path/archive.parts> > archive", file=sys.stderr)
+        sys.exit(2)
+    cat(sys.argv[2], sys.stdout.buffer)
@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# --- Constants ---
+CONFIG_DIR = "/app/data"
+CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
+RCLONE_CONFIG_PATH = os.path.join(CONFIG_DIR, "rclone.conf")
+
+class Config(Mapping):
+    """
+    config.json'dan yüklenen değişmez yapılandırma. Sözlük gibi okunur (config['pbs_repository_path']).
+    Alt süreç ortamları buradan üretilir; süreç genelindeki os.environ'a dokunulmaz.
+    """
+
+    __slots__ = ("_data", "_host_env", "_process_env", "stamp")
+
+    def __init__(self, data: dict, stamp=None, rclone_config=RCLONE_CONFIG_PATH):
+        data = dict(data)
+        pbs_user = data.get('pbs_user', 'root@pam')
+        pbs_host = data.get('pbs_host', 'localhost')
+        pbs_repo = data.get('pbs_repo', 'backup')
+        data['pbs_password'] = data.get('pbs_password', '')
+        data['pbs_fingerprint'] = (data.get('pbs_fingerprint') or '').strip()
+        data['pbs_repository_path'] = f"{pbs_user}@{pbs_host}:{pbs_repo}"
+
+        host_env = {'PBS_PASSWORD': data['pbs_password'], 'PBS_REPOSITORY': data['pbs_repository_path']}
+        if data['pbs_fingerprint']: host_env['PBS_FINGERPRINT'] = data['pbs_fingerprint']
+
+        object.__setattr__(self, "_data", MappingProxyType(data))
+        object.__setattr__(self, "_host_env", MappingProxyType(host_env))
+        # Konteyner içi süreçler (rclone, proxmox-backup-client) için: yükleme anındaki ortam + PBS/rclone ayarları
+        object.__setattr__(self, "_process_env", MappingProxyType({
+            **os.environ, **host_env, 'RCLONE_CONFIG': rclone_config
+        }))
+        object.__setattr__(self, "stamp", stamp)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is immutable")
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def host_env(self):
+        """Host'ta çalışan PBS komutlarına export edilecek değişkenler"""
+        return dict(self._host_env)
+
+    def process_env(self):
+        """Konteyner içinde başlatılan alt süreçler için tam ortam (her çağrıda yeni kopya)"""
+        return dict(self._process_env)
+
+class ConfigStore:
+    """
+    config.json'u bir kez yükler ve önbellekte tutar. Her istekte sadece stat() yapılır;
+    dosyanın mtime/boyutu değişmişse veya invalidate() çağrılmışsa yeniden yüklenir.
+    """
+
+    def __init__(self, path=CONFIG_FILE, rclone_path=RCLONE_CONFIG_PATH):
+        self.path = path
+        self.rclone_path = rclone_path
+        self._config = None
+        self._lock = threading.Lock()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self):
+        """Geçerli yapılandırma; dosya yoksa veya okunamıyorsa None"""
+        stamp = self._stamp()
+        if stamp is None: return None
+        cached = self._config
+        if cached is not None and cached.stamp == stamp: return cached
+        with self._lock:
+            if self._config is not None and self._config.stamp == stamp: return self._config
+            try:
+                with open(self.path, 'r') as f:
+                    self._config = Config(json.load(f), stamp, self.rclone_path)
+            except Exception:
+                self._config = None
+            return self._config
+
+    def save(self, data: dict, rclone_conf: str):
+        """Yapılandırmayı atomik olarak yazar ve önbelleği geçersiz kılar"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp, self.path)
+            tmp = self.rclone_path + ".tmp"
+            with open(tmp, 'w') as f:
+                f.write(rclone_conf)
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.rclone_path)
+            self._config = None
+
+    def invalidate(self):
+        with self._lock:
+            self._config = None
+
+CONFIG = ConfigStore()
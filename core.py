@@ -5,23 +5,50 @@ import shutil
 import glob
 import json
 import re
+import threading
+import signal
+from aio import time_left, deadline_passed
+from hostshell import HOST_SHELL, HOST_COMMAND_TIMEOUT, TIMEOUT_RETURNCODE, HostShellError, HostCommandTimeout
+from readiness import ReadinessReport, wait_until, loop_attached, nodes_exist
+from jobs import JobCancelled, JOB_MOUNT_ROOT
+from sizing import SIZES, normalize_path
+from manifest import MANIFESTS
+from listing import LISTINGS, page_bounds
+from layout import LAYOUTS
+from mappings import MAPPINGS
+from config import Config
+from metrics import timed, record_host_commands, PIPELINE_BYTES, PIPELINE_WAIT_SECONDS, PIPELINE_STALLS
+from relay import Relay, StallWatchdog, stage_waits
+import rawimage
+import chunked
+import dedup
+import seekable
 
 # --- Constants ---
 DRIVE_NAME = "drive-scsi0.img"
 MOUNT_POINT = "/mnt/pbsync_restore"
-LOG_FILE_PATH = "/app/data/pbsync_stream.log"
-
-def append_log(msg):
-    """Log hem konsola hem dosyaya yazar"""
-    print(msg)
-    try:
-        with open(LOG_FILE_PATH, "a") as f:
-            f.write(msg + "\n")
-    except: pass
-
-def run_host_command(command, env=None, suppress_errors=False):
+# Read-only mount yöntemleri; varsayılan deneme sırası bu sözlüğün sırasıdır
+MOUNT_STRATEGIES = {
+    "auto": "mount -o ro {device} {target}",
+    # Windows için force mount ve hiberfile temizliği
+    "ntfs-3g": "ntfs-3g -o ro,remove_hiberfile,force {device} {target}",
+    "xfs": "mount -t xfs -o ro,norecovery {device} {target}",
+    "ext4": "mount -t ext4 -o ro {device} {target}",
+}
+# Dosya sistemi türü biliniyorsa önce denenecek yöntem (genel mount'un boşa başarısız olmasını önler)
+FSTYPE_STRATEGIES = {"ntfs": "ntfs-3g", "xfs": "xfs"}
+# PBSYNC_HOST_SHELL=0 ile kalıcı host kabuğu kapatılıp eski nsenter-per-komut yöntemine dönülebilir
+USE_HOST_SHELL = os.environ.get("PBSYNC_HOST_SHELL", "1") != "0"
+# Akış bittikten sonra Python kaynak thread'inin bitmesi için beklenen en uzun süre; takılan bir cihaz okuması
+# (askıda PBS / FUSE) işi ve map'in serbest bırakılmasını sonsuza kadar bekletmesin
+WRITER_JOIN_TIMEOUT = 30
+# Tam dosya yedeğinde manifest sadece hedef artımlı kullanılıyorsa (manifest zaten varsa) çıkarılır;
+# PBSYNC_FILES_MANIFEST=1 ile her dosya yedeğinde çıkarılır (ilk artımlıdan önce zincir başı hazırlamak için)
+FILES_MANIFEST = os.environ.get("PBSYNC_FILES_MANIFEST", "0") == "1"
+
+def spawn_host_command(command, env=None):
+    """Eski yöntem: her komut için ayrı bir nsenter süreci başlatır"""
     cmd_str = ' '.join(command) if isinstance(command, list) else command
-    # print(f"HOST_EXEC: {cmd_str}") 
 
     env_prefix = ""
     if env:
@@ -29,69 +56,123 @@ def run_host_command(command, env=None, suppress_errors=False):
             env_prefix += f"export {k}='{v}'; "
     
     full_cmd = f"nsenter -t 1 -m -u -n -i bash -c \"{env_prefix}{cmd_str}\""
-    
+    proc = subprocess.Popen(full_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            start_new_session=True)
     try:
-        result = subprocess.run(
-            full_cmd, shell=True, check=True, capture_output=True, text=True
-        )
-        return result
-    except subprocess.CalledProcessError as e:
+        stdout, stderr = proc.communicate(timeout=time_left(HOST_COMMAND_TIMEOUT))
+    except subprocess.TimeoutExpired:
+        # shell=True: sadece sh değil nsenter ve komutun kendisi de öldürülür
+        try: os.killpg(proc.pid, signal.SIGKILL)
+        except OSError: pass
+        proc.communicate()
+        return subprocess.CompletedProcess(full_cmd, TIMEOUT_RETURNCODE, "", f"Host command timed out: {cmd_str}")
+    return subprocess.CompletedProcess(full_cmd, proc.returncode, stdout, stderr)
+
+def _host_exec(commands, env=None):
+    start = time.monotonic()
+    if USE_HOST_SHELL:
+        try:
+            results = HOST_SHELL.run_batch(commands, env)
+            record_host_commands(results, "shell", time.monotonic() - start)
+            return results
+        except HostShellError as e:
+            if e.started or isinstance(e, HostCommandTimeout):
+                # Komutların bir kısmı host'ta çalışmış olabilir (kpartx -a, mount ...): tekrar çalıştırılmaz.
+                # Süre dolduysa da yeni süreç açılmaz. Takılan/çöken komut ve sonrakiler başarısız sayılır.
+                print(f"Host commands failed: {e}")
+                code = TIMEOUT_RETURNCODE if isinstance(e, HostCommandTimeout) else 255
+                done = len(e.results)
+                failed = [subprocess.CompletedProcess(commands[done], code, "", str(e))]
+                failed += [subprocess.CompletedProcess(c, 255, "", "Not run: host shell failed") for c in commands[done + 1:]]
+                record_host_commands(e.results + failed, "shell", time.monotonic() - start)
+                return e.results + failed
+            print(f"Host shell unavailable, spawning per command: {e}")
+    results = [spawn_host_command(c, env) for c in commands]
+    record_host_commands(results, "spawn", time.monotonic() - start)
+    return results
+
+def run_host_command(command, env=None, suppress_errors=False):
+    cmd_str = ' '.join(command) if isinstance(command, list) else command
+    # print(f"HOST_EXEC: {cmd_str}") 
+
+    result = _host_exec([cmd_str], env)[0]
+    if result.returncode != 0:
         if not suppress_errors:
-            error_msg = f"ERROR on HOST: {e.returncode} | {e.stderr.strip()}"
+            error_msg = f"ERROR on HOST: {result.returncode} | {result.stderr.strip()}"
             print(error_msg)
-        raise e
+        raise subprocess.CalledProcessError(result.returncode, cmd_str, result.stdout, result.stderr)
+    return result
+
+def run_host_batch(commands, env=None):
+    """
+    Birden fazla komutu tek round-trip ile çalıştırır.
+    Hata fırlatmaz; her komut için CompletedProcess döner (returncode kontrolü çağırana aittir).
+    """
+    commands = [' '.join(c) if isinstance(c, list) else c for c in commands]
+    return _host_exec(commands, env)
 
 def cleanup():
-    try: run_host_command(f"umount -l {MOUNT_POINT}", suppress_errors=True)
-    except: pass
-    try: run_host_command("vgchange -an", suppress_errors=True)
-    except: pass
-    try: run_host_command("dmsetup remove_all", suppress_errors=True)
-    except: pass
-    try: run_host_command(f"proxmox-backup-client unmap {DRIVE_NAME}", suppress_errors=True)
-    except: pass
-    try: run_host_command("losetup -D", suppress_errors=True) 
+    # Önceki çalışmadan kalan PbSync map/mount artıklarını temizler; sadece uygulama açılışında, hiçbir iş çalışmıyorken.
+    # Sadece PbSync mount kökleri altındaki mount'lar ve kayıtlı loop'lar (bkz. mappings.py) serbest bırakılır;
+    # host'un veya başka araçların loop / device-mapper / LVM cihazlarına dokunulmaz. Hatalar bilinçli olarak yok sayılır
+    from sessions import SESSION_ROOT
+    roots = "|".join(re.escape(r.rstrip("/")) for r in dict.fromkeys([MOUNT_POINT, JOB_MOUNT_ROOT, SESSION_ROOT]))
+    try: run_host_batch([f"findmnt -rn -o TARGET | grep -E '^({roots})(/|$)' | sort -r | xargs -r -n1 umount -l"])
     except: pass
+    for loop_dev in MAPPINGS.owned(): release_mapping(loop_dev)
 
-def find_loop_on_host():
-    try:
-        res = run_host_command("losetup -a")
-        for line in res.stdout.strip().splitlines():
-            if DRIVE_NAME in line or "proxmox" in line:
-                return line.split(":")[0].strip()
-        res = run_host_command("ls -t /dev/loop* | head -n 1")
-        if res.stdout and "/dev/loop" in res.stdout:
-            return res.stdout.strip()
-    except: pass
-    return None
+def lvm_scope(loop_dev):
+    """
+    LVM komutlarını sadece bu loop'a ve kpartx partition'larına ait PV'lerle sınırlayan --config.
+    Diğer işlerin veya host'un aynı adlı VG'leri (ubuntu-vg vb.) görünmez; etkinleştirilmez ve kapatılmaz.
+    """
+    name = os.path.basename(loop_dev)
+    return f"--config 'devices {{ filter = [ \"a|^/dev/{name}$|\", \"a|^/dev/mapper/{name}p[0-9]+$|\", \"r|.*|\" ] }}'"
 
+def release_mapping(loop_dev, mount_points=()):
+    """
+    Sadece verilen loop cihazına ait kaynakları serbest bırakır (mount, LVM, kpartx, map).
+    Diğer işlerin veya gezinti oturumlarının cihazlarına dokunmaz. Map kaldırılınca loop kayıttan silinir.
+    """
+    cmds = [f"umount -l {m}" for m in mount_points]
+    unmap = None
+    if loop_dev:
+        cmds += [f"vgchange {lvm_scope(loop_dev)} -an", f"kpartx -d {loop_dev}"]
+        unmap = len(cmds)
+        cmds.append(f"proxmox-backup-client unmap {loop_dev}")
+    cmds += [f"rmdir {m}" for m in mount_points]
+    try: results = run_host_batch(cmds)
+    except: return
+    # Unmap başarısızsa kayıt kalır; sonraki açılışta tekrar denenir
+    if unmap is not None and unmap < len(results) and results[unmap].returncode == 0:
+        MAPPINGS.remove(loop_dev)
+
+def _human_size(size_bytes):
+    return f"{size_bytes / (1024**3):.2f} GB" if size_bytes > 1024**3 else f"{size_bytes / (1024**2):.2f} MB"
+
+def _walk_blockdevices(devices):
+    """lsblk ağacını (loop -> kpartx partition -> LVM volume) düz listeye çevirir"""
+    for dev in devices:
+        yield dev
+        yield from _walk_blockdevices(dev.get("children", []))
+
+@timed("candidates")
 def get_candidates(loop_dev):
     """
     Diskleri bulur, etiketlerini okur ve BOYUTLARINA göre sıralar.
     En büyük disk en başa gelir.
+    Tek bir lsblk çağrısı loop cihazını, kpartx partition'larını ve üzerlerindeki LVM volume'larını kapsar.
     """
-    candidates = []
+    candidates = {}
     loop_name = os.path.basename(loop_dev)
 
     # Yöntem 1: lsblk JSON çıktısı (Daha güvenilir ve detaylı)
     try:
-        # JSON formatında çıktı al: NAME, SIZE (byte), FSTYPE, LABEL, PARTLABEL
-        # -b: byte cinsinden boyut, -J: json formatı
-        res = run_host_command(f"lsblk -b -J -o NAME,SIZE,FSTYPE,LABEL,PARTLABEL {loop_dev}")
+        # -b: byte cinsinden boyut, -J: json formatı. lsblk holder'ları (dm/LVM) children altında verir.
+        res = run_host_command(f"lsblk -b -J -o NAME,PATH,SIZE,FSTYPE,LABEL,PARTLABEL {loop_dev}")
         data = json.loads(res.stdout)
-        
-        blockdevices = data.get("blockdevices", [])
-        
-        # Bazen lsblk partitionları 'children' altında listeler
-        items_to_process = []
-        for dev in blockdevices:
-            if dev["name"] == loop_name:
-                if "children" in dev:
-                    items_to_process.extend(dev["children"])
-            else:
-                items_to_process.append(dev)
 
-        for dev in items_to_process:
+        for dev in _walk_blockdevices(data.get("blockdevices", [])):
             fstype = dev.get("fstype")
             
             # Filtreler: Swap, LVM Member veya boş fstype'ları atla
@@ -100,10 +181,7 @@ def get_candidates(loop_dev):
             if "LVM2_member" in fstype: continue
 
             name = dev["name"]
-            size_bytes = int(dev.get("size", 0))
-            
-            # Boyutu okunabilir yap (GB/MB)
-            size_human = f"{size_bytes / (1024**3):.2f} GB" if size_bytes > 1024**3 else f"{size_bytes / (1024**2):.2f} MB"
+            size_bytes = int(dev.get("size") or 0)
             
             # Etiket oluştur (Label veya PartLabel varsa ekle)
             label = dev.get("label") or dev.get("partlabel") or ""
@@ -111,15 +189,16 @@ def get_candidates(loop_dev):
             if label:
                 desc += f" - {label}"
             
-            full_path = f"/dev/{name}"
-            if os.path.exists(f"/dev/mapper/{name}"): full_path = f"/dev/mapper/{name}"
+            full_path = dev.get("path") or f"/dev/{name}"
+            if full_path == f"/dev/{name}" and os.path.exists(f"/dev/mapper/{name}"): full_path = f"/dev/mapper/{name}"
 
-            candidates.append({
+            candidates[full_path] = {
                 "device": full_path,
                 "size_bytes": size_bytes, # Sıralama için ham veri
-                "size": size_human,       # Gösterim için
-                "type": desc
-            })
+                "size": _human_size(size_bytes), # Gösterim için
+                "type": desc,
+                "fstype": fstype
+            }
 
     except Exception as e:
         print(f"lsblk json failed, falling back: {e}")
@@ -140,254 +219,777 @@ def get_candidates(loop_dev):
                 
                 # Fallback modunda size string olduğu için sıralama düzgün çalışmayabilir
                 # ama en azından listelenir.
-                candidates.append({
+                candidates[full_path] = {
                     "device": full_path, 
                     "size_bytes": 0, 
                     "size": size, 
-                    "type": fstype
-                })
+                    "type": fstype,
+                    "fstype": fstype
+                }
         except: pass
 
-    # LVM Logical Volume Taraması (Ekstra)
-    try:
-        mapper_res = run_host_command("ls -1 /dev/mapper/")
-        for line in mapper_res.stdout.splitlines():
-            dev_name = line.strip()
-            if "control" in dev_name or "loop" in dev_name: continue
-            try:
-                # Byte cinsinden boyut al (-b)
-                info = run_host_command(f"lsblk -b -r -n -o SIZE,FSTYPE /dev/mapper/{dev_name}")
-                parts = info.stdout.split()
-                if len(parts) >= 2:
-                    size_bytes = int(parts[0])
-                    fstype = parts[1]
-                    full_path = f"/dev/mapper/{dev_name}"
-                    
-                    # Listede zaten yoksa ekle
-                    if not any(c['device'] == full_path for c in candidates):
-                        if fstype and "swap" not in fstype:
-                            size_human = f"{size_bytes / (1024**3):.2f} GB"
-                            candidates.append({
-                                "device": full_path, 
-                                "size_bytes": size_bytes, 
-                                "size": size_human, 
-                                "type": fstype
-                            })
-            except: pass
-    except: pass
-
     # --- KRİTİK NOKTA: SIRALAMA ---
     # Diskleri boyutlarına göre (Büyükten Küçüğe) sırala.
     # Böylece Windows C: veya Linux Root en üste gelir.
-    candidates.sort(key=lambda x: x['size_bytes'], reverse=True)
+    candidates = sorted(candidates.values(), key=lambda x: x['size_bytes'], reverse=True)
 
     if not candidates:
         candidates.append({"device": loop_dev, "size": "Disk Image", "size_bytes": 0, "type": "Raw/Unknown"})
     
     return candidates
 
-def mount_partition_by_index(active_loop, index):
-    try: run_host_command(f"kpartx -a -v -s {active_loop}")
-    except: pass
-    try: 
-        run_host_command("vgscan --mknodes")
-        run_host_command("vgchange -ay")
-    except: pass
-    time.sleep(1)
-
-    candidates = get_candidates(active_loop)
+def map_snapshot(config: Config, snapshot: str, drive_name: str = DRIVE_NAME, report=None):
+    """
+    Snapshot'ı host üzerinde map eder ve loop cihazını döner.
+    Loop yolu proxmox-backup-client çıktısından alınır; bulunamazsa None döner (losetup'ta tahmin yürütmek
+    başka bir işin loop'unu seçebilir). Map edilen loop açılış temizliği için kaydedilir (bkz. mappings.py).
+    """
+    with timed("map"):
+        res = run_host_command(f"proxmox-backup-client map {snapshot} {drive_name} --repository {config['pbs_repository_path']}", env=config.host_env())
+    output = (res.stdout or "") + (res.stderr or "")
+    match = re.search(r"/dev/loop\d+", output)
+    if not match:
+        print(f"No loop device in map output: {output.strip()}")
+        return None
+    loop_dev = match.group(0)
+    wait_until("loop", lambda: loop_attached(loop_dev), report)
+    MAPPINGS.add(loop_dev, snapshot)
+    return loop_dev
+
+def activate_partitions(active_loop, report=None):
+    """
+    Partition tablosunu ve LVM volume'larını host üzerinde aktif eder,
+    ardından oluşan /dev/mapper ve /dev/<vg>/<lv> düğümleri görünene kadar bekler.
+    """
+    try:
+        with timed("activate"):
+            kpartx_res, lvm_res = run_host_batch([
+                f"kpartx -a -v -s {active_loop}",
+                # Sadece bu loop üzerindeki VG'ler (bkz. lvm_scope)
+                f"vgscan {lvm_scope(active_loop)} --mknodes >/dev/null && vgchange {lvm_scope(active_loop)} -ay >/dev/null && "
+                f"lvs {lvm_scope(active_loop)} --noheadings --separator / -o vg_name,lv_name -S lv_active=active"
+            ])
+    except: return
+
+    # kpartx -v çıktısı: "add map loop0p1 (253:3): 0 1048576 linear 7:0 2048"
+    part_nodes = [f"/dev/mapper/{m}" for m in re.findall(r"add map (\S+)", kpartx_res.stdout)]
+    wait_until("partitions", lambda: nodes_exist(part_nodes), report)
+
+    if lvm_res.returncode == 0:
+        lv_nodes = [f"/dev/{line.strip()}" for line in lvm_res.stdout.splitlines() if "/" in line]
+        wait_until("lvm", lambda: nodes_exist(lv_nodes), report)
+
+def mount_order(fstype=None, preferred=None):
+    """Deneme sırası: katmanda kayıtlı çalışan yöntem, sonra dosya sistemine uygun olan, sonra varsayılan sıra"""
+    order = [preferred, FSTYPE_STRATEGIES.get((fstype or "").lower())] + list(MOUNT_STRATEGIES)
+    return list(dict.fromkeys(s for s in order if s in MOUNT_STRATEGIES))
+
+@timed("mount")
+def mount_device(device_to_mount, target=MOUNT_POINT, fstype=None, preferred=None):
+    """
+    Cihazı sırayla farklı sürücülerle read-only mount etmeyi dener.
+    Başarılı olan yöntemin adını (bkz. MOUNT_STRATEGIES), hiçbiri çalışmazsa None döner.
+    """
+    attempts = [f"( {MOUNT_STRATEGIES[name].format(device=device_to_mount, target=target)} && echo {name} )"
+                for name in mount_order(fstype, preferred)]
+    # Denemeler host üzerinde sırayla ve tek round-trip içinde yapılır; ilk başarılı olan adını yazar
+    try:
+        res = run_host_command(f"mkdir -p {target} && ( " + " || ".join(attempts) + " )", suppress_errors=True)
+    except: return None
+    used = [line.strip() for line in res.stdout.splitlines() if line.strip() in MOUNT_STRATEGIES]
+    return used[-1] if used else "auto"
+
+def mount_partition_by_index(active_loop, index, target=MOUNT_POINT, candidates=None, preferred=None):
+    """Aday tablosu verilirse yeniden keşif yapılmaz; sadece mount denenir. Çalışan mount yöntemini döner."""
+    if candidates is None:
+        activate_partitions(active_loop)
+        candidates = get_candidates(active_loop)
     if index >= len(candidates): raise Exception("Invalid partition index")
     
-    target = candidates[index]
-    device_to_mount = target['device']
-    
-    run_host_command(f"mkdir -p {MOUNT_POINT}")
-    
-    cmds = [
-        f"mount -o ro {device_to_mount} {MOUNT_POINT}",
-        # Windows için force mount ve hiberfile temizliği
-        f"ntfs-3g -o ro,remove_hiberfile,force {device_to_mount} {MOUNT_POINT}",
-        f"mount -t xfs -o ro,norecovery {device_to_mount} {MOUNT_POINT}",
-        f"mount -t ext4 -o ro {device_to_mount} {MOUNT_POINT}"
-    ]
-    
-    for cmd in cmds:
-        try:
-            run_host_command(cmd, suppress_errors=True)
-            return True
-        except: continue
-    return False
+    return mount_device(candidates[index]['device'], target, candidates[index].get('fstype'), preferred)
 
-def list_files_or_partitions(config: dict, snapshot: str, partition_id: str = None, path: str = ""):
-    print(f"\n--- Exploring: {snapshot} ---")
-    host_env = {
-        'PBS_PASSWORD': config['pbs_password'],
-        'PBS_REPOSITORY': config['pbs_repository_path']
-    }
-    if 'pbs_fingerprint' in config and config['pbs_fingerprint']:
-        host_env['PBS_FINGERPRINT'] = config['pbs_fingerprint']
+def list_files_or_partitions(config: Config, snapshot: str, partition_id: str = None, path: str = "",
+                             cursor: str = None, limit: int = None, details: bool = False):
+    """
+    Snapshot'ı kalıcı bir oturum üzerinden gezer.
+    İlk istekten sonra map/mount tekrarlanmaz; dizin listesi önbellekten sayfa sayfa döner (bkz. listing.py).
+    Sayfa (en fazla MAX_PAGE_SIZE girdi) burada, istek zaman aşımı ve oturum yeniden deneme kapsamında
+    hazırlanır; details=True ise sayfadaki girdilerin boyutu ve mtime'ı eklenir.
+    """
+    from sessions import SESSIONS
 
-    try: cleanup() 
-    except: pass
+    print(f"\n--- Exploring: {snapshot} ---")
+    # Oturum bayatlamışsa (mount düşmüş vb.) bir kez kapatıp yeniden açıyoruz
+    for attempt in range(2):
+        try:
+            with SESSIONS.use(config, snapshot) as session:
+                if not session.loop_dev: return {"status": "error", "message": "Loop device not found."}
 
+                if partition_id is None:
+                    # PARTITION LISTELEME (Boyuta göre sıralı gelir)
+                    candidates = session.candidates
+                
+                    if not candidates:
+                        return {"status": "error", "message": "No mountable partitions found."}
+
+                    partitions_list = []
+                    for idx, c in enumerate(candidates):
+                        partitions_list.append({
+                            "id": str(idx),
+                            "name": f"Partition {idx+1} ({c['type']})",
+                            "size": c['size'],
+                            "desc": c.get('device', 'Unknown')
+                        })
+                    return {"status": "success", "type": "partitions", "items": partitions_list}
+
+                mount_dir = session.mount(int(partition_id))
+                if not mount_dir: return {"status": "error", "message": "Mount failed. (Filesystem corrupted or unsupported)"}
+
+                idx = int(partition_id)
+                rel = normalize_path(path)
+                safe_path = os.path.normpath(os.path.join(mount_dir, rel))
+                if not safe_path.startswith(mount_dir): rel, safe_path = ".", mount_dir
+                try:
+                    listing = LISTINGS.get((snapshot, idx, rel), safe_path)
+                except (FileNotFoundError, NotADirectoryError):
+                    return {"status": "error", "message": "Path not found"}
+                try:
+                    start, end, next_cursor = page_bounds(len(listing), cursor, limit)
+                except ValueError:
+                    return {"status": "error", "message": "Invalid cursor"}
+                return {
+                    "status": "success", "type": "files", "current_path": path,
+                    "total": len(listing), "cursor": str(start), "next_cursor": next_cursor,
+                    "items": _listing_items(snapshot, idx, rel, safe_path, listing, start, end, details)
+                }
+        except OSError as e:
+            # Mount noktası kopmuş olabilir: oturumu (bu istek bıraktıktan sonra) kapat ve bir kez daha dene
+            SESSIONS.close(snapshot)
+            if attempt: return {"status": "error", "message": str(e)}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+def _listing_items(snapshot, partition, rel, path, listing, start, end, details):
+    items = []
+    for i in range(start, end):
+        name = listing.names[i]
+        item = {"name": name, "type": "dir" if listing.dirs[i] else "file",
+                "path": name if rel == "." else f"{rel}/{name}"}
+        if details:
+            size, mtime = listing.stat(i, path)
+            item["mtime"] = mtime
+            if not listing.dirs[i]: item["size_bytes"] = size
+        # Daha önce hesaplanmış klasör boyutu varsa ekle (ek I/O yok)
+        if listing.dirs[i]:
+            size = SIZES.cached(snapshot, DRIVE_NAME, partition, item["path"])
+            if size is not None: item["size_bytes"] = size
+        items.append(item)
+    return items
+
+def parse_rclone_stats(line):
+    """rclone --use-json-log satırından stats nesnesini çıkarır; stats içermeyen satırlar için None"""
+    if not line.startswith("{"): return None
     try:
-        run_host_command(f"proxmox-backup-client map {snapshot} {DRIVE_NAME} --repository {config['pbs_repository_path']}", env=host_env)
-        time.sleep(2) 
-        
-        active_loop = find_loop_on_host()
-        if not active_loop: return {"status": "error", "message": "Loop device not found."}
+        data = json.loads(line)
+    except ValueError: return None
+    return data.get("stats") if isinstance(data, dict) else None
 
-        try: run_host_command(f"kpartx -a -v -s {active_loop}")
-        except: pass
-        try: 
-            run_host_command("vgscan --mknodes")
-            run_host_command("vgchange -ay")
-        except: pass
-        time.sleep(1)
+class ProgressTracker:
+    """
+    Pipeline aşamalarının byte sayaçlarını toplar ve işe ilerleme olayı olarak yayınlar.
+    read_counter kaynağın ürettiği sıkıştırılmamış byte'ı, compress_counter sıkıştırıcının çıktısını verir
+    (aşamalar arasındaki relay sayaçlarından); yüklenen byte rclone'un JSON istatistiklerinden gelir.
+    """
 
-        if partition_id is None:
-            # PARTITION LISTELEME (Boyuta göre sıralı gelir)
-            candidates = get_candidates(active_loop)
-            
-            if not candidates:
-                return {"status": "error", "message": "No mountable partitions found."}
-
-            partitions_list = []
-            for idx, c in enumerate(candidates):
-                partitions_list.append({
-                    "id": str(idx),
-                    "name": f"Partition {idx+1} ({c['type']})",
-                    "size": c['size'],
-                    "desc": c.get('device', 'Unknown')
-                })
-            return {"status": "success", "type": "partitions", "items": partitions_list}
-        else:
+    def __init__(self, job, read_counter, compress_counter=None):
+        self.job = job
+        self.read_counter = read_counter
+        self.compress_counter = compress_counter
+        self.started = time.monotonic()
+        self.last = (self.started, 0)
+        self.bytes_read = 0
+        self.bytes_compressed = 0
+        self._counted = {"read": 0, "compressed": 0, "uploaded": 0}  # /metrics'e aktarılmış byte'lar
+
+    def _count(self, **stages):
+        for stage, value in stages.items():
+            delta = value - self._counted[stage]
+            if delta > 0:
+                PIPELINE_BYTES.inc(delta, stage=stage)
+                self._counted[stage] = value
+
+    def sample(self, bytes_uploaded):
+        now = time.monotonic()
+        self.bytes_read = self.read_counter()
+        # codec: none ise sıkıştırılmış = okunan
+        self.bytes_compressed = self.compress_counter() if self.compress_counter else self.bytes_read
+        if bytes_uploaded is None: bytes_uploaded = self.bytes_compressed
+
+        last_time, last_read = self.last
+        rate = (self.bytes_read - last_read) / (now - last_time) if now > last_time else 0.0
+        self.last = (now, self.bytes_read)
+        self._count(read=self.bytes_read, compressed=self.bytes_compressed, uploaded=bytes_uploaded)
+
+        total = self.job.progress.get("total_bytes") or 0
+        eta = int((total - self.bytes_read) / rate) if total and rate > 0 and total > self.bytes_read else None
+        self.job.update_progress(
+            bytes_read=self.bytes_read,
+            bytes_compressed=self.bytes_compressed,
+            bytes_uploaded=bytes_uploaded,
+            rate=round(rate, 1),
+            eta=eta,
+            ratio=round(self.bytes_compressed / self.bytes_read, 4) if self.bytes_read else None,
+            elapsed=round(now - self.started, 1)
+        )
+
+def estimate_path_size(config: Config, snapshot: str, partition_id: str, path: str = ""):
+    """Gezgin oturumu üzerinden bir klasörün boyutunu hesaplar (önbellekli)"""
+    from sessions import SESSIONS
+    try:
+        # Tarama bitene kadar oturum kullanımda sayılır; reaper / LRU mount'u altından kaldırmaz
+        with SESSIONS.use(config, snapshot) as session:
             idx = int(partition_id)
-            if mount_partition_by_index(active_loop, idx):
-                safe_path = os.path.normpath(os.path.join(MOUNT_POINT, path.strip('/')))
-                if not safe_path.startswith(MOUNT_POINT): safe_path = MOUNT_POINT
-                items = []
-                if os.path.exists(safe_path):
-                    with os.scandir(safe_path) as entries:
-                        for entry in entries:
-                            items.append({
-                                "name": entry.name,
-                                "type": "dir" if entry.is_dir() else "file",
-                                "path": os.path.relpath(entry.path, MOUNT_POINT)
-                            })
-                    items.sort(key=lambda x: (x["type"] != "dir", x["name"].lower()))
-                    return {"status": "success", "type": "files", "items": items, "current_path": path}
-                else: return {"status": "error", "message": "Path not found"}
-            else: return {"status": "error", "message": "Mount failed. (Filesystem corrupted or unsupported)"}
-    except Exception as e: return {"status": "error", "message": str(e)}
-    finally: cleanup()
-
-def run_backup_process(config: dict, snapshot: str, remote: str, target_folder: str = "", source_paths: str = ""):
-    with open(LOG_FILE_PATH, 'w') as f: f.write(f"--- Starting Stream for {snapshot} ---\n")
+            mount_dir = session.mount(idx)
+            if not mount_dir: return {"status": "error", "message": "Mount failed. (Filesystem corrupted or unsupported)"}
+            rel = normalize_path(path)
+            if not os.path.normpath(os.path.join(mount_dir, rel)).startswith(mount_dir): rel = "."
+            # İstek zaman aşımına uğrarsa tarama da durur (bkz. aio.run_blocking)
+            size, strategy = SIZES.estimate(snapshot, DRIVE_NAME, idx, mount_dir, [rel], strategy="walk",
+                                            stop=deadline_passed)
+        if size is None: return {"status": "error", "message": "Size scan timed out."}
+        return {"status": "success", "path": path, "size_bytes": size, "size": _human_size(size), "strategy": strategy}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def remote_target(remote, target_folder, name):
+    clean_remote = remote.rstrip(":")
+    if target_folder.strip():
+        return f"{clean_remote}:{target_folder.strip().strip('/')}/{name}"
+    return f"{clean_remote}:{name}"
+
+def remote_path(job, archive_name):
+    return remote_target(job.remote, job.target_folder, archive_name)
+
+class StreamSource:
+    """
+    Python içinde üretilen akış: write(fileobj) ile yazar, counter() okunan byte'ı verir.
+    Kaynak kendisi sıkıştırıyorsa (seekable) compressed() çıktının byte sayısını verir.
+    """
+
+    def __init__(self, write, counter, compressed=None):
+        self.write = write
+        self.counter = counter
+        self.compressed = compressed
+
+    def __call__(self, out):
+        self.write(out)
+
+@timed("pipeline")
+def stream_to_remote(job, full_remote_path, source, total_size=0, stdin_data=None, env=None):
+    """
+    Kaynağı sıkıştırıcı üzerinden rclone rcat'e akıtır.
+    source: ya bir komut (list, örn. tar) ya da write_fn(fileobj) çağrılabilir nesnesi (ham imaj gibi
+    Python içinde üretilen akışlar için; ayrı bir thread'de bir pipe'a yazar).
+    stdin_data: komut kaynağının stdin'ine ayrı bir thread'den yazılacak byte'lar (örn. tar -T - dosya listesi).
+    env: işin alt süreç ortamı (Config.process_env()); verilmezse süreç ortamı kullanılır.
+    Aşamalar arasındaki veri Relay thread'leri ile taşınır (bkz. relay.py); byte sayaçları ve bekleme süreleri
+    oradan gelir. Hiçbir aşama PBSYNC_STALL_TIMEOUT boyunca ilerlemezse iş sonlandırılır.
+    """
+    log = job.log
+    # Dedup deposu parçaları kendisi sıkıştırır; CDC sıkıştırılmamış akışta çalışmalı
+    compress_cmd = None if job.upload_mode == "dedup" else job.codec.command()
+    # JSON log: istatistik satırları yapılandırılmış "stats" alanı ile gelir
+    rclone_cmd = ["rclone", "rcat", full_remote_path, "-v", "--use-json-log", "--stats", "2s", "--buffer-size", "128M"]
     
-    append_log(f"Snapshot: {snapshot}")
-    host_env = {
-        'PBS_PASSWORD': config['pbs_password'],
-        'PBS_REPOSITORY': config['pbs_repository_path']
-    }
-    if 'pbs_fingerprint' in config and config['pbs_fingerprint']:
-        host_env['PBS_FINGERPRINT'] = config['pbs_fingerprint']
+    if total_size > 0:
+        rclone_cmd.extend(["--size", str(total_size)])
 
+    job.check_cancelled()
+    job.set_stage("streaming")
+    log(f"-> Streaming to {full_remote_path} (codec: {job.codec.name}, level: {job.codec.level})...")
+    
+    current_env = env if env is not None else os.environ.copy()
+    writer, writer_error, p1 = None, [], None
+    if callable(source):
+        read_fd, write_fd = os.pipe()
+        source_out = os.fdopen(read_fd, "rb")
+        def feed():
+            try:
+                with os.fdopen(write_fd, "wb") as out: source(out)
+            except BrokenPipeError: pass  # alt aşama kapandı; asıl hata rclone/sıkıştırıcıdan raporlanır
+            except Exception as e: writer_error.append(e)
+        writer = threading.Thread(target=feed, name=f"pbsync-source-{job.id}", daemon=True)
+        source_counter = getattr(source, "counter", None)
+    else:
+        p1 = subprocess.Popen(
+            source, stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=current_env
+        )
+        job.register_process(p1)
+        source_out = p1.stdout
+        source_counter = None
+        if stdin_data is not None:
+            def feed():
+                try:
+                    with p1.stdin: p1.stdin.write(stdin_data)
+                except BrokenPipeError: pass
+                except Exception as e: writer_error.append(e)
+            writer = threading.Thread(target=feed, name=f"pbsync-stdin-{job.id}", daemon=True)
+
+    # Her aşama sınırında bir relay: kaynak -> [sıkıştırıcı] -> yükleyici
+    relays = []
+    p2 = None
+    upload_from = source_out
+    if compress_cmd:
+        p2 = subprocess.Popen(compress_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=current_env)
+        job.register_process(p2)
+        relays.append(Relay(source_out, p2.stdin, "source", "compress"))
+        upload_from = p2.stdout
+
+    p3 = None
+    in_process = job.upload_mode in ("chunked", "dedup")
+    if in_process:
+        read_fd, write_fd = os.pipe()
+        upload_input, upload_dst = os.fdopen(read_fd, "rb"), os.fdopen(write_fd, "wb", buffering=0)
+    else:
+        p3 = subprocess.Popen(rclone_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=current_env)
+        job.register_process(p3)
+        upload_dst = p3.stdin
+    relays.append(Relay(upload_from, upload_dst, "compress" if p2 else "source", "upload"))
+
+    # Ham imaj gibi kaynaklar kendi sayacını verir (atlanan delikler dahil); yoksa ilk relay'in taşıdığı byte
+    read_counter = source_counter or (lambda: relays[0].bytes)
+    compress_counter = (lambda: relays[-1].bytes) if p2 else getattr(source, "compressed", None)
+    tracker = ProgressTracker(job, read_counter, compress_counter)
+
+    def on_stall(stalled):
+        PIPELINE_STALLS.inc(stage=stalled.stage)
+        job.abort(str(stalled))
+    watchdog = StallWatchdog(relays, on_stall=on_stall, probes=[lambda: job.progress.get("bytes_uploaded", 0)])
+
+    def check_sources():
+        """Relay'ler ve kaynak bitti mi, hatasız mı; yarıda kalan akış için arşiv tamamlanmış sayılmamalı"""
+        for r in relays: r.join()
+        if writer is not None:
+            # Durma / iptalde cihaz okumasında takılı kalmış olabilecek kaynak thread'i beklenmez (daemon thread)
+            aborted = watchdog.stalled is not None or job.cancelled
+            writer.join(0 if aborted else WRITER_JOIN_TIMEOUT)
+        if watchdog.stalled is not None: raise watchdog.stalled
+        job.check_cancelled()
+        if writer is not None and writer.is_alive():
+            raise Exception(f"Source did not finish within {WRITER_JOIN_TIMEOUT}s after the stream ended (device read hung?)")
+        if writer_error: raise Exception(f"Source read failed: {writer_error[0]}")
+        for r in relays:
+            if r.error is not None: raise Exception(f"Relay {r.upstream} -> {r.downstream} failed: {r.error}")
+
+    for r in relays: r.start()
+    if writer is not None: writer.start()
+    watchdog.start()
     try:
-        cleanup()
-        append_log("-> Mapping snapshot on Host...")
-        run_host_command(f"proxmox-backup-client map {snapshot} {DRIVE_NAME} --repository {config['pbs_repository_path']}", env=host_env)
-        time.sleep(3)
+        if in_process:
+            def before_commit():
+                check_sources()
+                for proc, name, ok in ((p1, "source", (0, 1)), (p2, "compressor", (0,))):
+                    # tar için 1: bazı dosyalar okunurken değişti (uyarı)
+                    if proc is not None and proc.wait() not in ok:
+                        raise Exception(f"{name} ({proc.args[0]}) exited with {proc.returncode}")
+            try:
+                upload = _upload_dedup if job.upload_mode == "dedup" else _upload_chunked
+                upload(job, full_remote_path, upload_input, tracker, before_commit, current_env)
+            finally:
+                upload_input.close()
+            return
 
-        active_loop = find_loop_on_host()
+        while True:
+            line = p3.stderr.readline()
+            if not line and p3.poll() is not None:
+                break
+            if line:
+                clean_line = line.strip()
+                stats = parse_rclone_stats(clean_line)
+                if stats is not None:
+                    tracker.sample(stats.get("bytes", 0))
+                    p = job.progress
+                    log(f"[Cloud] {_human_size(p['bytes_uploaded'])} uploaded, {_human_size(p['rate'])}/s, ETA {p['eta'] if p['eta'] is not None else '-'}s")
+                elif clean_line:
+                     log(f"[Cloud] {clean_line}")
+        
+        p3.wait()
+        # rclone hata ile çıktıysa üst aşamalar EPIPE ile sonlansın diye relay'ler durdurulur
+        for r in relays: r.stop()
+        check_sources()
+        job.check_cancelled()
+        if p3.returncode != 0: raise Exception("Upload failed.")
+        tracker.sample(None)
+    except Exception as e:
+        # Durma tespitinde süreçler öldürüldüğü için ikincil hatalar yerine asıl neden raporlanır
+        if watchdog.stalled is not None and e is not watchdog.stalled: raise watchdog.stalled from e
+        raise
+    finally:
+        watchdog.stop()
+        for r in relays: r.stop()
+        for r in relays: r.join()
+        _report_pipeline(job, relays, tracker)
+
+def _report_pipeline(job, relays, tracker):
+    """Aşama başına byte ve bekleme süreleri; diğer aşamaların en çok beklediği aşama darboğazdır"""
+    waits = stage_waits(relays)
+    stages = {name: {"wait_s": round(seconds, 2)} for name, seconds in waits.items()}
+    for r in relays:
+        stages[r.upstream]["bytes_out"] = r.bytes
+        stages[r.downstream]["bytes_in"] = r.bytes
+    for stage, seconds in waits.items(): PIPELINE_WAIT_SECONDS.inc(seconds, stage=stage)
+    job.update_progress(stages=stages)
+
+    elapsed = time.monotonic() - tracker.started
+    read, out = tracker.read_counter(), relays[-1].bytes
+    ratio = f"{out / read:.3f}" if read else "-"
+    waited = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in waits.items())
+    mode = "splice" if all(r.zero_copy for r in relays) else "buffered"
+    job.log(f"-> Pipeline: {_human_size(read)} read, {_human_size(out)} to upload (ratio {ratio}), "
+            f"{_human_size(read / elapsed if elapsed > 0 else 0)}/s; waiting on {waited} ({mode})")
+
+def _upload_chunked(job, full_remote_path, upload_input, tracker, before_commit, env):
+    """Sıkıştırılmış akışı sabit boyutlu parçalar halinde paralel yükler (bkz. chunked.py)"""
+    log = job.log
+    remote_dir = chunked.parts_dir(full_remote_path)
+    uploader = chunked.ChunkedUploader(
+        remote_dir, chunked.state_path_for(remote_dir),
+        register_process=job.register_process, cancelled=lambda: job.cancelled, log=log, env=env
+    )
+    log(f"-> Chunked upload: {chunked.part_name(0)}... ({_human_size(uploader.part_size)} parts, {uploader.workers} uploaders)")
+    done = threading.Event()
+    def report():
+        while not done.wait(2):
+            stats = uploader.stats
+            tracker.sample(stats.bytes_uploaded + stats.bytes_resumed)
+            p = job.progress
+            log(f"[Cloud] {stats.parts_uploaded} parts / {_human_size(p['bytes_uploaded'])} uploaded, {_human_size(p['rate'])}/s, ETA {p['eta'] if p['eta'] is not None else '-'}s")
+    reporter = threading.Thread(target=report, name=f"pbsync-progress-{job.id}", daemon=True)
+    reporter.start()
+    try:
+        manifest = uploader.upload(upload_input, {"archive": job.archive, "snapshot": job.snapshot}, before_commit)
+    except InterruptedError:
+        job.check_cancelled()
+        raise
+    finally:
+        done.set()
+        reporter.join()
+    stats = uploader.stats
+    tracker.sample(stats.bytes_uploaded + stats.bytes_resumed)
+    job.archive = {**job.archive, "parts": len(manifest["parts"]), "parts_dir": chunked.parts_dir(job.archive["name"])}
+    log(f"-> Uploaded {len(manifest['parts'])} parts ({stats.parts_resumed} resumed, {stats.retries} retries) to {remote_dir}")
+
+def _upload_dedup(job, full_remote_path, upload_input, tracker, before_commit, env):
+    """Akışı hedef klasördeki tekilleştirilmiş depoya yazar (bkz. dedup.py); sadece yeni parçalar yüklenir"""
+    log = job.log
+    store = remote_path(job, dedup.STORE_DIR_NAME)
+    writer = dedup.DedupWriter(store, register_process=job.register_process, cancelled=lambda: job.cancelled, env=env,
+                               log=log)
+    log(f"-> Dedup store: {store} ({writer.index.count()} known chunks)")
+    done = threading.Event()
+    def report():
+        while not done.wait(2):
+            stats = writer.stats
+            tracker.sample(stats.bytes_stored)
+            job.update_progress(chunks=stats.chunks, chunks_new=stats.chunks_new, bytes_new=stats.bytes_new)
+            log(f"[Cloud] {stats.chunks} chunks ({stats.chunks_new} new), {_human_size(stats.bytes_stored)} uploaded, {_human_size(job.progress['rate'])}/s")
+    reporter = threading.Thread(target=report, name=f"pbsync-progress-{job.id}", daemon=True)
+    reporter.start()
+    try:
+        recipe = writer.write(upload_input, job.archive["name"], {"snapshot": job.snapshot, "mode": job.mode}, before_commit)
+    except InterruptedError:
+        job.check_cancelled()
+        raise
+    finally:
+        done.set()
+        reporter.join()
+        writer.close()
+    stats = writer.stats
+    tracker.sample(stats.bytes_stored)
+    job.update_progress(bytes_compressed=stats.bytes_stored, chunks=stats.chunks, chunks_new=stats.chunks_new, bytes_new=stats.bytes_new)
+    job.archive = {**job.archive, "recipe": dedup.recipe_path(dedup.STORE_DIR_NAME, job.archive["name"]),
+                   "chunks": len(recipe["chunks"]), "chunks_new": stats.chunks_new}
+    log(f"-> Dedup: {stats.chunks} chunks, {stats.chunks_new} new ({_human_size(stats.bytes_new)} of {_human_size(stats.bytes_read)}), {_human_size(stats.bytes_stored)} uploaded")
+
+def upload_bytes(job, full_remote_path, data, env=None):
+    """Küçük yan dosyaları (silinenler listesi vb.) rclone rcat ile doğrudan yükler"""
+    job.check_cancelled()
+    result = subprocess.run(["rclone", "rcat", full_remote_path], input=data, capture_output=True, env=env)
+    if result.returncode != 0:
+        raise Exception(f"Upload of {full_remote_path} failed: {result.stderr.decode(errors='replace').strip()}")
+
+def _stream_tar(job, archive_name, tar_cmd, total_size=0, stdin_data=None, env=None):
+    """
+    tar akışını yükler. Aranabilir codec'te sıkıştırma süreç içinde çerçevelenir ve
+    arşivin yanına <arşiv>.idx indeksi yüklenir (bkz. seekable.py).
+    """
+    full_remote_path = remote_path(job, archive_name)
+    if not job.codec.seekable:
+        stream_to_remote(job, full_remote_path, tar_cmd, total_size, stdin_data=stdin_data, env=env)
+        return
+    # Aralık okuma tek bir uzak nesne gerektirir; parçalı / dedup yüklemede indeks anlamsız olur
+    if job.upload_mode != "stream": raise Exception("Seekable archives require the stream upload mode")
+    writer = seekable.SeekableWriter(job.codec.level, workers=job.codec.threads)
+    def write(out):
+        seekable.write_tar(tar_cmd, out, writer, job.register_process, lambda: job.cancelled, stdin_data, env)
+    stream_to_remote(job, full_remote_path, StreamSource(write, lambda: writer.bytes_in, lambda: writer.bytes_out), total_size, env=env)
+    index_name = archive_name + seekable.INDEX_SUFFIX
+    upload_bytes(job, remote_path(job, index_name), writer.index_bytes({"archive": archive_name, "snapshot": job.snapshot}), env)
+    job.archive = {**job.archive, "index": index_name, "frames": len(writer.frames)}
+    job.log(f"-> Index uploaded: {index_name} ({len(writer.indexer.files)} entries, {len(writer.frames)} frames)")
+
+def _scan_async(job, name, walk, on_total, stop):
+    """
+    Tam dosya yedeğinde boyut / manifest taramasını stream'e paralel çalıştırır.
+    walk(cancelled) (bytes, {yol: bytes}) döner; bitince on_total(bytes, totals) çağrılır.
+    stop (threading.Event) set edilirse tarama yarıda kesilir.
+    """
+    state = {"ok": False}
+    def run():
+        try:
+            # Ayrı thread'de çalıştığı için süre işin özetine açıkça yazılır
+            with timed(name, job.timings):
+                result = walk(lambda: job.cancelled or stop.is_set())
+            if result is None: return
+            on_total(*result)
+            state["ok"] = True
+        except InterruptedError: pass
+        except Exception as e: job.log(f"-> {name} failed: {e}")
+    thread = threading.Thread(target=run, name=f"pbsync-{name}-{job.id}", daemon=True)
+    thread.start()
+    return thread, state
+
+def _stream_incremental(job, scan, dirs, archive_base, env):
+    """
+    Artımlı mod: manifest ile karşılaştırıp sadece yeni/değişmiş girdileri tar'lar.
+    Silinen yollar NUL ayrılmış bir .deleted yan dosyası olarak arşivin yanına yüklenir.
+    """
+    log = job.log
+    job.set_stage("indexing")
+    baseline = scan.has_baseline()
+    log("-> Scanning files for changes..." if baseline else "-> No manifest yet; first incremental run is a full file list.")
+    with timed("index"):
+        scan.scan(job.mount_point, dirs, cancelled=lambda: job.cancelled)
+    job.check_cancelled()
+
+    changed = scan.changed()
+    deleted = scan.deleted()
+    changed_bytes = sum(size for _, size in changed)
+    log(f"-> Manifest: {scan.files} entries, {len(changed)} new/changed ({_human_size(changed_bytes)}), {len(deleted)} deleted")
+    job.update_progress(total_bytes=changed_bytes)
+
+    archive_name = f"{archive_base}.incr.tar{job.codec.extension}"
+    deleted_name = f"{archive_base}.incr.deleted"
+    job.archive = {
+        "name": archive_name if changed else None, "mode": "incremental", "base": baseline,
+        "changed": len(changed), "deleted": len(deleted),
+        "deleted_list": deleted_name if deleted else None, **job.codec.metadata()
+    }
+
+    if changed:
+        # Dosya listesi stdin'den NUL ayrılmış verilir; klasörler sadece kendi girdisiyle eklenir
+        tar_cmd = ["tar", "-C", job.mount_point, "--null", "--no-recursion", "-T", "-", "-cf", "-"]
+        file_list = b"".join(path + b"\0" for path, _ in changed)
+        _stream_tar(job, archive_name, tar_cmd, 0, stdin_data=file_list, env=env)
+    else:
+        log("-> No changed files; archive skipped.")
+    if deleted:
+        upload_bytes(job, remote_path(job, deleted_name), b"".join(path + b"\0" for path in deleted), env)
+        log(f"-> Deleted list uploaded: {deleted_name}")
+
+    scan.commit(job.snapshot, archive_name if changed else None, "incremental" if baseline else "full")
+
+def _stream_raw(job, active_loop, candidates, env):
+    """Ham mod: loop cihazını (veya seçili partition'ı) sıfır blokları atlayarak PBSRAW olarak yükler"""
+    if job.codec.seekable: raise Exception("Seekable archives are only available for files/incremental modes")
+    if job.partition_id is not None and job.partition_id != "":
+        idx = int(job.partition_id)
+        if idx < 0 or idx >= len(candidates): raise Exception("Invalid partition index")
+        device, suffix = candidates[idx]['device'], f"_part{idx}"
+    else:
+        device, suffix = active_loop, ""
+
+    vmid = job.snapshot.split('/')[1]
+    timestamp = job.timestamp
+    archive_name = f"{vmid}_{timestamp}{suffix}.pbsraw{job.codec.extension}"
+    job.archive = {"name": archive_name, "mode": "raw", "device": device, **job.codec.metadata()}
+
+    size = rawimage.device_size(device)
+    job.update_progress(total_bytes=size)
+    job.log(f"-> Raw image of {device} ({_human_size(size)})")
+
+    stats = rawimage.RawImageStats()
+    def publish():
+        job.progress["bytes_read"] = stats.bytes_scanned
+        job.progress["bytes_sparse"] = stats.bytes_sparse
+        return stats.bytes_scanned
+    def write(out):
+        rawimage.write_sparse_stream(device, out, stats, cancelled=lambda: job.cancelled)
+
+    stream_to_remote(job, remote_path(job, archive_name), StreamSource(write, publish), env=env)
+    job.log(f"-> Raw image: {_human_size(stats.bytes_data)} data, {_human_size(stats.bytes_sparse)} skipped as holes")
+
+def run_backup_process(config: Config, job):
+    """
+    Tek bir işi çalıştırır: map -> partition -> mount -> tar | sıkıştırıcı | rclone.
+    Ham modda mount yerine blok cihazı doğrudan okunur.
+    Tüm kaynaklar (loop, mount dizini, log) işe özeldir; temizlik sadece bu işin kaynaklarına dokunur.
+    """
+    log = job.log
+    snapshot = job.snapshot
+    log(f"--- Starting Stream for {snapshot} ---")
+    log(f"Snapshot: {snapshot} (job {job.id}, mode: {job.mode})")
+    # Devam ettirilen işte arşiv adı (ve parçalı yüklemenin durum kaydı) aynı kalsın diye sabitlenir
+    if not job.timestamp: job.timestamp = time.strftime('%Y%m%d-%H%M%S')
+    # İşe özel alt süreç ortamı (rclone config, PBS değişkenleri); os.environ değiştirilmez
+    env = config.process_env()
+
+    try:
+        # Aynı snapshot gezgin tarafından açık tutuluyorsa map çakışmasın diye kapatıyoruz
+        from sessions import SESSIONS
+        SESSIONS.close(snapshot)
+
+        job.check_cancelled()
+        job.set_stage("mapping")
+        log("-> Mapping snapshot on Host...")
+        readiness = ReadinessReport()
+        job.loop_dev = map_snapshot(config, snapshot, job.drive_name, report=readiness)
+        active_loop = job.loop_dev
         if not active_loop: raise Exception("Loop device not found on host.")
-        append_log(f"-> Active Loop: {active_loop}")
+        log(f"-> Active Loop: {active_loop}")
 
-        append_log("-> Scanning partitions...")
-        try: run_host_command(f"kpartx -a -v -s {active_loop}")
-        except: pass
-        try: 
-            run_host_command("vgscan --mknodes")
-            run_host_command("vgchange -ay")
-        except: pass
-        time.sleep(2)
+        # Tüm diskin ham imajı için partition/LVM aktivasyonuna gerek yok
+        if job.mode == "raw" and (job.partition_id is None or job.partition_id == ""):
+            _stream_raw(job, active_loop, [], env)
+            log("-> SUCCESS: Stream complete.")
+            return
+
+        job.check_cancelled()
+        job.set_stage("scanning")
+        log("-> Scanning partitions...")
+        activate_partitions(active_loop, readiness)
+        log(f"-> Device readiness: {readiness.summary()}")
 
         candidates = get_candidates(active_loop)
+        if job.mode == "raw":
+            _stream_raw(job, active_loop, candidates, env)
+            log("-> SUCCESS: Stream complete.")
+            return
+
+        job.set_stage("mounting")
         
         mounted = False
         # Otomatik modda: İlk sıradaki (En BÜYÜK) partition'ı dene
         # Bu, EFI veya Recovery'nin seçilmesini engeller.
-        for idx in range(len(candidates)):
-            if mount_partition_by_index(active_loop, idx):
+        # Düzen bu VM diskinin önceki snapshot'ıyla aynıysa son seçilen partition ve çalışan mount yöntemi önce denenir.
+        layout = LAYOUTS.lookup(config['pbs_repository_path'], snapshot, job.drive_name, active_loop, candidates)
+        if layout.hit and layout.index is not None:
+            log(f"-> Known layout: partition index {layout.index} via {layout.strategy(layout.index)}")
+        for idx in layout.order(len(candidates)):
+            job.check_cancelled()
+            strategy = mount_partition_by_index(active_loop, idx, job.mount_point, candidates=candidates,
+                                                preferred=layout.strategy(idx))
+            if strategy:
                 mounted = True
-                append_log(f"-> Mounted partition index {idx} ({candidates[idx]['type']} - {candidates[idx]['size']})")
+                mounted_idx = idx
+                layout.remember_mount(idx, strategy, chosen=True)
+                log(f"-> Mounted partition index {idx} ({candidates[idx]['type']} - {candidates[idx]['size']}, {strategy})")
                 break
         
         if not mounted: raise Exception("Mount failed. No mountable partitions found.")
 
         vmid = snapshot.split('/')[1]
-        timestamp = time.strftime('%Y%m%d-%H%M%S')
-        archive_name = f"{vmid}_{timestamp}.tar.gz"
-        
-        clean_remote = remote.rstrip(":")
-        if target_folder.strip():
-            full_remote_path = f"{clean_remote}:{target_folder.strip().strip('/')}/{archive_name}"
-        else:
-            full_remote_path = f"{clean_remote}:{archive_name}"
+        timestamp = job.timestamp
 
-        os.chdir(MOUNT_POINT)
-        
         dirs = ["."]
-        if source_paths.strip():
-            dirs = [p.strip() for p in source_paths.split(',') if p.strip()]
+        if job.source_paths.strip():
+            dirs = [normalize_path(p) for p in job.source_paths.split(',') if p.strip()]
 
-        # Progress Hesaplama
-        append_log("-> Calculating total size for progress stats...")
-        total_size = 0
+        # Manifest depo + uzak hedef + VM grubu (vm/100) + disk + partition + yol seti bazında tutulur
+        manifest_scope = MANIFESTS.scope(config['pbs_repository_path'], remote_path(job, "").rstrip("/"))
+        scan = MANIFESTS.begin("/".join(snapshot.split('/')[:2]),
+                               MANIFESTS.source_key(manifest_scope, job.drive_name, mounted_idx, dirs))
         try:
-            du_cmd = ["du", "-sb"] + dirs
-            res = subprocess.run(du_cmd, capture_output=True, text=True, check=True)
-            for line in res.stdout.splitlines():
-                parts = line.split()
-                if parts and parts[0].isdigit():
-                    total_size += int(parts[0])
-            size_mb = total_size / (1024*1024)
-            append_log(f"-> Total Size: {size_mb:.2f} MB")
-        except: 
+            if job.mode == "incremental":
+                _stream_incremental(job, scan, dirs, f"{vmid}_{timestamp}", env)
+                log("-> SUCCESS: Stream complete.")
+                return
+
+            archive_name = f"{vmid}_{timestamp}.tar{job.codec.extension}"
+            job.archive = {"name": archive_name, "mode": "files", **job.codec.metadata()}
+
+            # Progress Hesaplama: tüm volume için statvfs anlıktır; seçili yollar önbellekte yoksa
+            # boyut, stream'e paralel çalışan taramadan gelir (upload başlangıcını geciktirmez)
+            job.check_cancelled()
+            job.set_stage("sizing")
             total_size = 0
-
-        tar_cmd = ["tar", "cf", "-"] + dirs
-        pigz_cmd = ["pigz", "-1"]
-        rclone_cmd = ["rclone", "rcat", full_remote_path, "-P", "--stats", "2s", "--buffer-size", "128M"]
-        
-        if total_size > 0:
-            rclone_cmd.extend(["--size", str(total_size)])
-
-        append_log(f"-> Streaming to {full_remote_path}...")
-        
-        current_env = os.environ.copy()
-        p1 = subprocess.Popen(tar_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=current_env)
-        p2 = subprocess.Popen(pigz_cmd, stdin=p1.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=current_env)
-        p1.stdout.close()
-        
-        p3 = subprocess.Popen(rclone_cmd, stdin=p2.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=current_env)
-        p2.stdout.close()
-        
-        while True:
-            line = p3.stderr.readline()
-            if not line and p3.poll() is not None:
-                break
-            if line:
-                clean_line = line.strip()
-                if "Transferred" in clean_line or "%" in clean_line:
-                     append_log(f"[Cloud] {clean_line}")
-        
-        p3.wait()
-        if p3.returncode != 0: raise Exception("Upload failed.")
-        append_log("-> SUCCESS: Stream complete.")
-
+            size_known = dirs == ["."] or SIZES.is_cached(snapshot, job.drive_name, mounted_idx, dirs)
+            if size_known:
+                try:
+                    with timed("sizing"):
+                        total_size, strategy = SIZES.estimate(snapshot, job.drive_name, mounted_idx, job.mount_point, dirs)
+                    log(f"-> Total Size: {total_size / (1024*1024):.2f} MB ({strategy})")
+                except Exception as e:
+                    log(f"-> Size estimation failed: {e}")
+                    total_size = 0
+            else:
+                log("-> Calculating total size in background...")
+            job.update_progress(total_bytes=total_size)
+
+            def on_total(size, totals):
+                for path, path_size in totals.items(): SIZES.record(snapshot, job.drive_name, mounted_idx, path, path_size)
+                if not size_known:
+                    job.update_progress(total_bytes=size)
+                    log(f"-> Total Size: {size / (1024*1024):.2f} MB (walk)")
+
+            # Manifest taraması (lstat + SQLite) sadece artımlı zincir için gerekir; aksi halde sadece
+            # boyutu bilinmeyen yollar gezilir ve tar bitince tarama beklenmeden kesilir
+            record_manifest = FILES_MANIFEST or scan.has_baseline()
+            scan_stop = threading.Event()
+            scan_thread = None
+            if record_manifest:
+                def walk(cancelled):
+                    total = scan.scan(job.mount_point, dirs, cancelled=cancelled)
+                    return total, scan.totals
+                scan_thread, scan_state = _scan_async(job, "manifest_scan", walk, on_total, scan_stop)
+            elif not size_known:
+                def walk(cancelled):
+                    totals = {}
+                    for path in dirs:
+                        size, _ = SIZES.estimate(snapshot, job.drive_name, mounted_idx, job.mount_point, [path],
+                                                 "walk", stop=cancelled)
+                        if size is None: return None
+                        totals[path] = size
+                    return sum(totals.values()), totals
+                scan_thread, scan_state = _scan_async(job, "sizing", walk, on_total, scan_stop)
+
+            # Süreç genelindeki cwd'yi değiştirmemek için tar'a -C ile dizin veriyoruz
+            tar_cmd = ["tar", "-C", job.mount_point, "-cf", "-"] + dirs
+            try:
+                _stream_tar(job, archive_name, tar_cmd, total_size, env=env)
+            except BaseException:
+                scan_stop.set()
+                raise
+            finally:
+                if scan_thread is not None:
+                    # Boyut taraması artık gereksiz; manifest ise commit için tamamlanmalı
+                    if not record_manifest: scan_stop.set()
+                    # Tarama bitmeden mount kaldırılmasın (kesilen tarama klasör başına döner)
+                    scan_thread.join()
+            if record_manifest and scan_state["ok"]:
+                scan.commit(snapshot, archive_name, "full")
+                log(f"-> Manifest recorded ({scan.files} entries)")
+            log("-> SUCCESS: Stream complete.")
+        finally:
+            scan.close()
+
+    except JobCancelled as e:
+        log(f"CANCELLED: {e}", level="warning")
+        raise
     except Exception as e:
-        append_log(f"CRITICAL ERROR: {e}")
+        log(f"CRITICAL ERROR: {e}", level="error")
+        raise
     finally:
-        if os.getcwd() != "/": os.chdir("/")
-        cleanup()
\ No newline at end of file
+        release_mapping(job.loop_dev, [job.mount_point])
+        log(f"-> Timings: {job.timings.summary()}")
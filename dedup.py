@@ -0,0 +1,372 @@
+"""
+İçerik tanımlı parçalama (CDC) ile tekilleştirilmiş yedek deposu.
+
+Sıkıştırılmamış tar / ham imaj akışı, içerik tanımlı sınırlardan parçalara bölünür; her parça sha256 ile
+adreslenir, zlib ile sıkıştırılıp <hedef>/.pbsync-store/chunks/ab/abcd... olarak yüklenir.
+Depoda zaten olan parçalar tekrar yüklenmez (yerel SQLite parça indeksi; remote listelenmez).
+Her yedek için recipes/<arşiv>.recipe.gz (parça listesi) yazılır.
+
+Sınır tespiti: gear rolling hash'in 1-bit'lik sürümü. Her byte sabit bir tabloyla 0/1'e eşlenir
+(bytes.translate), hash son WINDOW byte'ın bitleridir; hash CUT_PATTERN'e eşit olduğunda parça kesilir.
+Böylece kayan pencere C hızında (translate + find) değerlendirilir.
+
+Geri yükleme:
+    python dedup.py restore remote:klasor/.pbsync-store 100_20240101-000000.tar > 100.tar
+Çöp toplama (hiçbir recipe'nin kullanmadığı parçalar):
+    python dedup.py gc remote:klasor/.pbsync-store
+GC, aynı depoya yazan bir yedek varken çalışmaz (STORE_LOCKS); yedekler de GC bitene kadar bekler.
+Parçanın yaşı, indekste son kullanıldığı (yüklendiği veya bir yedekte tekrar kullanıldığı) zamandır.
+"""
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# --- Constants ---
+STORE_DIR_NAME = ".pbsync-store"
+DEDUP_INDEX_PATH = "/app/data/chunks.db"
+MIN_CHUNK = int(os.environ.get("PBSYNC_DEDUP_MIN_KB", "1024")) * 1024
+MAX_CHUNK = int(os.environ.get("PBSYNC_DEDUP_MAX_KB", "8192")) * 1024
+WINDOW = 20  # 2^-20 olasılıkla kesim: MIN_CHUNK üstüne ortalama ~1 MB
+SCAN_STEP = 1024 * 1024
+READ_SIZE = 4 * 1024 * 1024
+DEDUP_WORKERS = int(os.environ.get("PBSYNC_UPLOAD_WORKERS", "4"))
+DEDUP_LEVEL = int(os.environ.get("PBSYNC_DEDUP_LEVEL", "1"))
+GC_GRACE_HOURS = 24
+RECIPE_VERSION = 1
+
+def _bits(seed, count):
+    out = bytearray()
+    counter = 0
+    while len(out) < count:
+        for byte in hashlib.sha256(seed + counter.to_bytes(4, "big")).digest():
+            out.append(byte & 1)
+        counter += 1
+    return bytes(out[:count])
+
+GEAR = bytes.maketrans(bytes(range(256)), _bits(b"pbsync-gear", 256))
+CUT_PATTERN = _bits(b"pbsync-cut", WINDOW)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    store TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    PRIMARY KEY (store, hash)
+) WITHOUT ROWID;
+"""
+
+def store_path(remote_base):
+    return f"{remote_base.rstrip('/')}/{STORE_DIR_NAME}"
+
+def chunk_path(store, digest):
+    return f"{store}/chunks/{digest[:2]}/{digest}"
+
+def recipe_path(store, archive_name):
+    return f"{store}/recipes/{archive_name}.recipe.gz"
+
+def find_cut(buf, limit):
+    """buf[:limit] içinde ilk içerik tanımlı kesim noktası; yoksa limit"""
+    pos = max(MIN_CHUNK - WINDOW, 0)
+    while pos < limit - WINDOW:
+        end = min(pos + SCAN_STEP + WINDOW, limit)
+        i = buf[pos:end].translate(GEAR).find(CUT_PATTERN)
+        if i >= 0: return pos + i + WINDOW
+        pos = end - WINDOW + 1
+    return limit
+
+def iter_chunks(stream):
+    """Akışı içerik tanımlı parçalara böler (MIN_CHUNK..MAX_CHUNK)"""
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < MAX_CHUNK:
+            data = stream.read(READ_SIZE)
+            if not data: eof = True
+            else: buf += data
+        if not buf: return
+        cut = len(buf) if eof and len(buf) <= MIN_CHUNK else find_cut(buf, min(len(buf), MAX_CHUNK))
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+def _parse_modtime(value):
+    """rclone lsjson ModTime (RFC3339, nanosaniyeli olabilir) -> epoch"""
+    try:
+        head, _, rest = value.partition(".")
+        tz = rest.lstrip("0123456789") if rest else ""
+        return datetime.fromisoformat((head + tz).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return time.time()
+
+def _rclone(args, data=None, env=None):
+    result = subprocess.run(["rclone"] + args, input=data, capture_output=True, env=env)
+    if result.returncode != 0:
+        raise Exception(f"rclone {args[0]} failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+class ChunkIndex:
+    """Depo başına bilinen parçaların yerel önbelleği (SQLite)"""
+
+    def __init__(self, store, db_path=DEDUP_INDEX_PATH):
+        self.store = store
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def touch(self, digest):
+        """Parça biliniyorsa son kullanım zamanını yeniler (GC'nin bekleme süresi buradan sayılır)"""
+        with self._lock, self.conn:
+            return self.conn.execute(
+                "UPDATE chunks SET created=strftime('%s','now') WHERE store=? AND hash=?", (self.store, digest)
+            ).rowcount > 0
+
+    def last_used(self):
+        with self._lock:
+            return dict(self.conn.execute("SELECT hash, created FROM chunks WHERE store=?", (self.store,)))
+
+    def add(self, digest, size, stored_size):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chunks VALUES (?,?,?,?,strftime('%s','now'))",
+                (self.store, digest, size, stored_size)
+            )
+
+    def remove(self, digests):
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM chunks WHERE store=? AND hash=?", [(self.store, d) for d in digests])
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks WHERE store=?", (self.store,)).fetchone()[0]
+
+    def rebuild(self, env=None):
+        """Yerel önbellek kaybolduysa remote'u bir kez listeleyip indeksi yeniden kurar"""
+        listing = json.loads(_rclone(["lsjson", "-R", "--files-only", f"{self.store}/chunks"], env=env) or b"[]")
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM chunks WHERE store=?", (self.store,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?,?,0,?,strftime('%s','now'))",
+                [(self.store, item["Name"], item["Size"]) for item in listing]
+            )
+        return len(listing)
+
+    def close(self):
+        try: self.conn.close()
+        except: pass
+
+class StoreBusy(Exception):
+    pass
+
+class StoreLocks:
+    """Depo başına süreç içi kilit: yedekler paylaşımlı tutar, GC sadece depo boşken özel tutar"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._writers = {}       # depo -> yazan yedek sayısı
+        self._collecting = set() # GC çalışan depolar
+
+    def acquire(self, store, cancelled=None):
+        """GC bitene kadar bekler; bu sırada iş iptal edilirse InterruptedError"""
+        with self._cond:
+            while store in self._collecting:
+                if cancelled is not None and cancelled(): raise InterruptedError("Upload cancelled.")
+                self._cond.wait(1)
+            self._writers[store] = self._writers.get(store, 0) + 1
+
+    def release(self, store):
+        with self._cond:
+            self._writers[store] -= 1
+            if not self._writers[store]: del self._writers[store]
+
+    def busy(self, store):
+        with self._cond:
+            return bool(self._writers.get(store)) or store in self._collecting
+
+    @contextmanager
+    def collecting(self, store):
+        with self._cond:
+            if self._writers.get(store): raise StoreBusy(f"{store}: a backup is writing to this store")
+            if store in self._collecting: raise StoreBusy(f"{store}: garbage collection already running")
+            self._collecting.add(store)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._collecting.discard(store)
+                self._cond.notify_all()
+
+STORE_LOCKS = StoreLocks()
+
+class DedupStats:
+    """Parça sayaçları; ilerleme takibi için başka thread'den okunur"""
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.bytes_new = 0
+        self.bytes_stored = 0
+        self.chunks = 0
+        self.chunks_new = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items(): setattr(self, key, getattr(self, key) + value)
+
+class DedupWriter:
+    """
+    Bir akışı depoya yazar: parçalar, indekste yoksa sıkıştırılıp paralel yüklenir.
+    Bellekte en fazla 2 * workers parça bekler.
+    """
+
+    def __init__(self, store, workers=DEDUP_WORKERS, level=DEDUP_LEVEL, register_process=None, cancelled=None,
+                 db_path=DEDUP_INDEX_PATH, env=None, log=print):
+        self.store = store
+        self.env = env
+        self.log = log
+        self.workers = max(1, workers)
+        self.level = level
+        self.register_process = register_process
+        self.cancelled = cancelled or (lambda: False)
+        self.index = ChunkIndex(store, db_path)
+        self.stats = DedupStats()
+        self._slots = threading.Semaphore(self.workers * 2)
+        self._pending = set()  # aynı akışta tekrar eden ve henüz yüklenmekte olan parçalar
+        self._pending_lock = threading.Lock()
+        self._errors = []
+
+    def _put(self, digest, chunk):
+        try:
+            data = zlib.compress(chunk, self.level)
+            proc = subprocess.Popen(["rclone", "rcat", chunk_path(self.store, digest)], stdin=subprocess.PIPE,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=self.env)
+            if self.register_process: self.register_process(proc)
+            _, err = proc.communicate(data)
+            if proc.returncode != 0: raise Exception(f"Chunk {digest[:12]} upload failed: {err.decode(errors='replace').strip()}")
+            self.index.add(digest, len(chunk), len(data))
+            self.stats.add(bytes_stored=len(data))
+        except Exception as e:
+            self._errors.append(e)
+        finally:
+            with self._pending_lock: self._pending.discard(digest)
+            self._slots.release()
+
+    def write(self, stream, archive_name, metadata=None, before_commit=None):
+        """Akışı parçalayıp yükler, sonra recipe'yi yazar. Recipe sözlüğünü döner."""
+        STORE_LOCKS.acquire(self.store, self.cancelled)
+        try:
+            return self._write(stream, archive_name, metadata, before_commit)
+        finally:
+            STORE_LOCKS.release(self.store)
+
+    def _write(self, stream, archive_name, metadata, before_commit):
+        if not self.index.count():
+            # Yerel indeks yok (yeni kurulum / silinmiş chunks.db): depodaki parçaları tekrar yüklememek için
+            try: self.log(f"-> Chunk index rebuilt from remote: {self.index.rebuild(self.env)} chunks")
+            except Exception as e: self.log(f"-> Chunk index not rebuilt (new store?): {e}")
+        recipe_chunks = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pbsync-dedup") as pool:
+            for chunk in iter_chunks(stream):
+                if self._errors: break
+                if self.cancelled(): raise InterruptedError("Upload cancelled.")
+                digest = hashlib.sha256(chunk).hexdigest()
+                recipe_chunks.append([digest, len(chunk)])
+                self.stats.add(bytes_read=len(chunk), chunks=1)
+                with self._pending_lock:
+                    if digest in self._pending: continue
+                if self.index.touch(digest): continue
+                with self._pending_lock: self._pending.add(digest)
+                self.stats.add(bytes_new=len(chunk), chunks_new=1)
+                self._slots.acquire()
+                pool.submit(self._put, digest, chunk)
+        if self.cancelled(): raise InterruptedError("Upload cancelled.")
+        if self._errors: raise self._errors[0]
+        if before_commit is not None: before_commit()
+
+        recipe = {
+            "version": RECIPE_VERSION,
+            "archive": archive_name,
+            "chunk_format": "zlib",
+            "size": self.stats.bytes_read,
+            "chunks": recipe_chunks,
+            "created": int(time.time()),
+            **(metadata or {}),
+        }
+        _rclone(["rcat", recipe_path(self.store, archive_name)], gzip.compress(json.dumps(recipe).encode(), 6), self.env)
+        return recipe
+
+    def close(self):
+        self.index.close()
+
+def restore(store, archive_name, out, env=None):
+    """Recipe'deki parçaları sırayla indirip doğrular ve out'a yazar"""
+    recipe = json.loads(gzip.decompress(_rclone(["cat", recipe_path(store, archive_name)], env=env)))
+    for digest, size in recipe["chunks"]:
+        chunk = zlib.decompress(_rclone(["cat", chunk_path(store, digest)], env=env))
+        if len(chunk) != size or hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"Checksum mismatch in chunk {digest}")
+        out.write(chunk)
+    out.flush()
+    return recipe
+
+def gc(store, grace_hours=GC_GRACE_HOURS, dry_run=False, db_path=DEDUP_INDEX_PATH, log=print, env=None):
+    """
+    Hiçbir recipe'de geçmeyen parçaları toplu olarak siler. Depoya yazan bir yedek varsa StoreBusy.
+    Son grace_hours içinde yüklenen veya tekrar kullanılan parçalar silinmez (başka bir süreçte / host'ta
+    çalışan bir yedeğin henüz recipe'si yazılmamış olabilir).
+    """
+    with STORE_LOCKS.collecting(store):
+        return _gc(store, grace_hours, dry_run, db_path, log, env)
+
+def _gc(store, grace_hours, dry_run, db_path, log, env):
+    recipes = json.loads(_rclone(["lsjson", "--files-only", f"{store}/recipes"], env=env) or b"[]")
+    referenced = set()
+    for item in recipes:
+        recipe = json.loads(gzip.decompress(_rclone(["cat", f"{store}/recipes/{item['Name']}"], env=env)))
+        referenced.update(digest for digest, _ in recipe["chunks"])
+
+    cutoff = time.time() - grace_hours * 3600
+    listing = json.loads(_rclone(["lsjson", "-R", "--files-only", f"{store}/chunks"], env=env) or b"[]")
+    index = ChunkIndex(store, db_path)
+    try: last_used = index.last_used()
+    finally: index.close()
+    garbage, freed = [], 0
+    for item in listing:
+        if item["Name"] in referenced: continue
+        # Yüklenme zamanı ile indeksteki son kullanımın yenisi (indekste yoksa sadece ModTime)
+        if max(_parse_modtime(item.get("ModTime", "")), last_used.get(item["Name"], 0)) > cutoff: continue
+        garbage.append(item)
+        freed += item["Size"]
+
+    log(f"GC {store}: {len(recipes)} recipes, {len(listing)} chunks, {len(garbage)} unreferenced ({freed} bytes)")
+    if garbage and not dry_run:
+        # Tek bir rclone çağrısı ile toplu silme; dosya listesi stdin'den
+        _rclone(["delete", f"{store}/chunks", "--files-from-raw", "-"],
+                "".join(item["Path"] + "\n" for item in garbage).encode(), env)
+        index = ChunkIndex(store, db_path)
+        try: index.remove([item["Name"] for item in garbage])
+        finally: index.close()
+    return {"recipes": len(recipes), "chunks": len(listing), "deleted": 0 if dry_run else len(garbage),
+            "unreferenced": len(garbage), "freed_bytes": freed}
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "restore":
+        restore(sys.argv[2], sys.argv[3], sys.stdout.buffer)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "gc":
+        gc(sys.argv[2], dry_run="--dry-run" in sys.argv, log=lambda m: print(m, file=sys.stderr))
+    else:
+        print("usage: python dedup.py restore <remote:path/.pbsync-store> <archive> > archive\n"
+              "       python dedup.py gc <remote:path/.pbsync-store> [--dry-run]", file=sys.stderr)
+        sys.exit(2)
@@ -0,0 +1,210 @@
+import os
+import selectors
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from aio import time_left
+
+# --- Constants ---
+# Host namespace'inde tek bir kalıcı bash açılır; komutlar stdin üzerinden çerçevelenerek gönderilir
+HOST_SHELL_ARGV = ["nsenter", "-t", "1", "-m", "-u", "-n", "-i", "bash", "--noprofile", "--norc"]
+# Tek bir host komutunun en uzun süresi; aşılırsa kabuk (ve komut) öldürülüp sonraki çağrıda yeniden açılır
+HOST_COMMAND_TIMEOUT = float(os.environ.get("PBSYNC_HOST_TIMEOUT", "300"))
+TIMEOUT_RETURNCODE = 124  # timeout(1) ile aynı
+# Eşzamanlı host komutu sayısı; yavaş bir komut (pbc map, kpartx) diğer işleri ve gezgini bekletmesin
+HOST_SHELLS = max(1, int(os.environ.get("PBSYNC_HOST_SHELLS", "4")))
+
+class HostShellError(Exception):
+    """
+    results: kabuk bozulmadan önce tamamlanan komutların sonuçları.
+    started: komutlar kabuğa yazıldı mı; yazıldıysa bir kısmı host'ta çalışmış olabilir (tekrar çalıştırılmamalı).
+    """
+
+    def __init__(self, message, results=None, started=True):
+        super().__init__(message)
+        self.results = results or []
+        self.started = started
+
+class HostCommandTimeout(HostShellError):
+    pass
+
+class HostShell:
+    """
+    Host üzerinde uzun ömürlü bir bash süreci.
+
+    Her komut bir subshell içinde çalıştırılır; stdout ve stderr ayrı pipe'lar üzerinden okunur,
+    her birinin sonuna `<token>` işaretli bir çerçeve satırı (stdout'ta çıkış kodu ile) eklenir.
+    Böylece her komut için yeni bir nsenter süreci başlatılmaz.
+    Süreç ölürse bir sonraki çağrıda otomatik olarak yeniden başlatılır.
+    """
+
+    def __init__(self, argv=None, timeout=HOST_COMMAND_TIMEOUT):
+        self.argv = argv or HOST_SHELL_ARGV
+        self.timeout = timeout
+        self.token = f"__PBSYNC_{uuid.uuid4().hex}"
+        self.proc = None
+        self.spawns = 0
+        self._lock = threading.Lock()
+        self._out_marker = f"\n{self.token} ".encode()
+        self._err_marker = f"\n{self.token}\n".encode()
+
+    def _start(self):
+        # Ayrı süreç grubu: zaman aşımında kabuk, subshell ve takılan komut birlikte öldürülür
+        self.proc = subprocess.Popen(
+            self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True
+        )
+        self._bufs = {self.proc.stdout.fileno(): bytearray(), self.proc.stderr.fileno(): bytearray()}
+        self.spawns += 1
+
+    def _ensure(self):
+        if self.proc is None or self.proc.poll() is not None:
+            if self.proc is not None: self.close()
+            self._start()
+
+    def _write(self, data: str):
+        self.proc.stdin.write(data.encode())
+        self.proc.stdin.flush()
+
+    def _frame(self, command: str, env=None):
+        env_prefix = ""
+        if env:
+            for k, v in env.items():
+                env_prefix += f"export {k}={shlex.quote(str(v))}; "
+        return (
+            f"read -r -d '' __cmd <<'{self.token}'\n"
+            f"{env_prefix}{command}\n"
+            f"{self.token}\n"
+            f"( eval \"$__cmd\" ) </dev/null; __rc=$?\n"
+            f"printf '\\n{self.token} %d\\n' $__rc; printf '\\n{self.token}\\n' >&2\n"
+        )
+
+    def _fill(self, fd):
+        chunk = os.read(fd, 65536)
+        if not chunk: raise HostShellError("Host shell exited")
+        self._bufs[fd] += chunk
+
+    def _read_result(self, command: str, timeout=None):
+        out_fd, err_fd = self.proc.stdout.fileno(), self.proc.stderr.fileno()
+        out_buf, err_buf = self._bufs[out_fd], self._bufs[err_fd]
+        deadline = time.monotonic() + time_left(self.timeout if timeout is None else timeout)
+        with selectors.DefaultSelector() as sel:
+            sel.register(out_fd, selectors.EVENT_READ)
+            sel.register(err_fd, selectors.EVENT_READ)
+            while True:
+                out_end = out_buf.find(self._out_marker)
+                rc_end = out_buf.find(b"\n", out_end + len(self._out_marker)) if out_end >= 0 else -1
+                err_end = err_buf.find(self._err_marker)
+                if rc_end >= 0 and err_end >= 0: break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: raise HostCommandTimeout(f"Host command timed out: {command}")
+                for key, _ in sel.select(remaining):
+                    self._fill(key.fd)
+
+        rc = int(out_buf[out_end + len(self._out_marker):rc_end])
+        stdout = out_buf[:out_end].decode(errors="replace")
+        stderr = err_buf[:err_end].decode(errors="replace")
+        del out_buf[:rc_end + 1]
+        del err_buf[:err_end + len(self._err_marker)]
+        return subprocess.CompletedProcess(command, rc, stdout, stderr)
+
+    def run_batch(self, commands, env=None, timeout=None):
+        """
+        Komutları tek seferde gönderir ve sonuçları aynı sırayla döner (check yapılmaz).
+        timeout: komut başına süre (varsayılan self.timeout). Aşılırsa veya kabuk çökerse kabuk öldürülür ve
+        tamamlanan sonuçlarla HostShellError fırlatılır; kalan komutlar çalıştırılmaz.
+        """
+        # Başka bir komut kabuğu tutuyorsa en fazla son tarihe kadar beklenir
+        if not self._lock.acquire(timeout=time_left(self.timeout)):
+            raise HostCommandTimeout("Timed out waiting for the host shell", started=False)
+        try:
+            if time_left(self.timeout) <= 0:
+                raise HostCommandTimeout("Deadline passed before the host command was sent", started=False)
+            for attempt in range(2):
+                self._ensure()
+                try:
+                    self._write("".join(self._frame(c, env) for c in commands))
+                    break
+                except (BrokenPipeError, OSError):
+                    # Yazma başarısızsa komutlar hiç çalışmadı; kabuğu yeniden başlatıp tekrar deneriz
+                    self.close(kill=True)
+                    if attempt: raise HostShellError("Host shell is not accepting commands", started=False)
+            results = []
+            try:
+                for c in commands: results.append(self._read_result(c, timeout))
+                return results
+            except HostCommandTimeout as e:
+                self.close(kill=True)
+                raise HostCommandTimeout(str(e), results)
+            except (HostShellError, ValueError, OSError) as e:
+                # Çerçeve bozulduysa kanal güvenilmez: öldür (pipe'ta bekleyen komutlar çalışmasın), sonra yeniden açılır
+                self.close(kill=True)
+                raise HostShellError(f"Host shell crashed: {e}", results)
+        finally:
+            self._lock.release()
+
+    def run(self, command: str, env=None):
+        return self.run_batch([command], env)[0]
+
+    def close(self, kill=False):
+        proc, self.proc = self.proc, None
+        if proc is None: return
+        if kill:
+            try: os.killpg(proc.pid, signal.SIGKILL)
+            except OSError: pass
+        try:
+            proc.stdin.close()
+        except: pass
+        try:
+            proc.wait(timeout=2)
+        except:
+            try: os.killpg(proc.pid, signal.SIGKILL)
+            except OSError: proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+class HostShellPool:
+    """
+    Küçük bir HostShell havuzu; HostShell ile aynı arayüz (run_batch / run / close).
+    Kabuklar ilk ihtiyaçta açılır. Boştaki kabuklardan en son kullanılan seçilir, böylece düşük
+    eşzamanlılıkta tek kabuk sıcak kalır. Her çağıran boş kabuğu kendi son tarihine kadar bekler.
+    """
+
+    def __init__(self, size=HOST_SHELLS, argv=None, timeout=HOST_COMMAND_TIMEOUT):
+        self.timeout = timeout
+        self.shells = [HostShell(argv, timeout) for _ in range(size)]
+        self._free = list(self.shells)
+        self._cond = threading.Condition()
+
+    @property
+    def spawns(self):
+        return sum(s.spawns for s in self.shells)
+
+    def _acquire(self):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout=time_left(self.timeout)):
+                raise HostCommandTimeout("Timed out waiting for a free host shell", started=False)
+            return self._free.pop()
+
+    def _release(self, shell):
+        with self._cond:
+            self._free.append(shell)
+            self._cond.notify()
+
+    def run_batch(self, commands, env=None, timeout=None):
+        shell = self._acquire()
+        try:
+            return shell.run_batch(commands, env, timeout)
+        finally:
+            self._release(shell)
+
+    def run(self, command: str, env=None):
+        return self.run_batch([command], env)[0]
+
+    def close(self, kill=False):
+        for shell in self.shells: shell.close(kill)
+
+HOST_SHELL = HostShellPool()
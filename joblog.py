@@ -0,0 +1,258 @@
+"""
+Yapılandırılmış iş logları.
+
+Her log satırı bir olaydır: {"seq", "ts", "job", "level", "msg"}. Olaylar önce işin bellekteki halka
+tamponuna (ve tüm işlerin ortak halkasına) eklenir; dosya ve konsol yazımı arka plandaki LogWriter
+thread'i tarafından toplu yapılır (FLUSH_INTERVAL'da bir, dosya başına tek open/write).
+Dosyalar iş başına <JOBS_DIR>/<job_id>.jsonl (JSON lines) olarak tutulur, LOG_MAX_BYTES'ı geçince
+.1, .2 ... olarak döndürülür. En yeni LOG_KEEP_JOBS işin logları saklanır, LOG_RETENTION_DAYS'den eski
+loglar silinir. /stream-logs halka tamponundan okur; bellekte olmayan eski işler için dosyanın sonu okunur.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+# --- Constants ---
+FLUSH_INTERVAL = float(os.environ.get("PBSYNC_LOG_FLUSH_S", "1"))
+LOG_MAX_BYTES = int(os.environ.get("PBSYNC_LOG_MAX_KB", "5120")) * 1024
+LOG_BACKUPS = int(os.environ.get("PBSYNC_LOG_BACKUPS", "2"))
+LOG_KEEP_JOBS = int(os.environ.get("PBSYNC_LOG_KEEP_JOBS", "200"))
+LOG_RETENTION_DAYS = float(os.environ.get("PBSYNC_LOG_RETENTION_DAYS", "30"))
+RING_SIZE = int(os.environ.get("PBSYNC_LOG_RING", "2000"))  # iş başına bellekte tutulan olay
+RING_JOBS = 64  # halka tamponu bellekte tutulan iş sayısı
+MAX_PENDING = 5000  # bu kadar satır birikirse aralık beklenmeden yazılır
+LOG_SUFFIX = ".jsonl"
+TAIL_READ_BYTES = 256 * 1024
+
+def job_id_of(filename):
+    """<job_id>.jsonl[.N] -> job_id; log dosyası değilse None"""
+    name, sep, _ = filename.partition(LOG_SUFFIX)
+    return name if sep and name else None
+
+def prune_logs(directory, keep_jobs=LOG_KEEP_JOBS, max_age_days=LOG_RETENTION_DAYS, active=()):
+    """En yeni keep_jobs işin logları dışında kalanları ve max_age_days'den eskileri siler"""
+    groups = {}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                job_id = job_id_of(entry.name)
+                if job_id is None: continue
+                try: mtime = entry.stat().st_mtime
+                except OSError: continue
+                newest, paths = groups.get(job_id, (0, []))
+                groups[job_id] = (max(newest, mtime), paths + [entry.path])
+    except OSError: return 0
+    cutoff = time.time() - max_age_days * 86400 if max_age_days > 0 else None
+    ordered = sorted(groups.items(), key=lambda item: item[1][0], reverse=True)
+    removed = 0
+    for rank, (job_id, (mtime, paths)) in enumerate(ordered):
+        if job_id in active: continue
+        if rank < keep_jobs and (cutoff is None or mtime >= cutoff): continue
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError: pass
+    return removed
+
+class LogWriter:
+    """Satırları kuyrukta biriktirip arka plan thread'inde toplu yazar; dosya boyutu aşılınca döndürür"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS, console=True):
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.console = console
+        self._pending = []  # (yol, dosya satırı, konsol satırı)
+        self._tasks = []    # yazım thread'inde çalıştırılacak bakım işleri (retention)
+        self._sizes = {}    # yol -> bilinen dosya boyutu
+        self._queued = 0    # kuyruğa giren satır sayısı
+        self._written = 0   # yazılmış satır sayısı
+        self._flush = False
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def write(self, path, line, console_line=None):
+        with self._cond:
+            self._pending.append((path, line, console_line))
+            self._queued += 1
+            self._ensure_thread()
+            if len(self._pending) >= MAX_PENDING: self._cond.notify_all()
+
+    def submit(self, task):
+        """Bakım işini (örn. eski logları silme) yazım thread'ine bırakır; çağıranı bekletmez"""
+        with self._cond:
+            self._tasks.append(task)
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def flush(self, timeout=5):
+        """Şu ana kadar kuyruğa giren satırlar yazılana kadar bekler"""
+        with self._cond:
+            target = self._queued
+            if self._thread is None: return
+            self._flush = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._written >= target or self._closed, timeout)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None: thread.join(5)
+
+    def _ensure_thread(self):
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(target=self._run, name="pbsync-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Satırlar aralık boyunca birikir: dosya başına tek open/write
+                self._cond.wait_for(lambda: self._flush or self._closed or self._tasks or len(self._pending) >= MAX_PENDING,
+                                    self.flush_interval)
+                batch, self._pending = self._pending, []
+                tasks, self._tasks = self._tasks, []
+                self._flush = False
+                closed = self._closed
+            if batch: self._write_batch(batch)
+            for task in tasks:
+                try: task()
+                except Exception as e: print(f"Log maintenance failed: {e}")
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+                if closed and not self._pending: return
+
+    def _write_batch(self, batch):
+        if self.console:
+            text = "".join(c for _, _, c in batch if c)
+            if text:
+                try:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                except: pass
+        by_path = OrderedDict()
+        for path, line, _ in batch: by_path.setdefault(path, []).append(line)
+        for path, lines in by_path.items():
+            try: self._append(path, "".join(lines).encode("utf-8", errors="replace"))
+            except OSError as e: print(f"Log write failed for {path}: {e}")
+
+    def _append(self, path, data):
+        size = self._sizes.get(path)
+        if size is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try: size = os.path.getsize(path)
+            except OSError: size = 0
+        if size and size + len(data) > self.max_bytes:
+            self._rotate(path)
+            size = 0
+        with open(path, "ab") as f: f.write(data)
+        # Bitmiş işlerin boyut kayıtları birikmesin; silinen kayıt gerekirse dosyadan tekrar okunur
+        if len(self._sizes) > RING_JOBS * 4: self._sizes.clear()
+        self._sizes[path] = size + len(data)
+
+    def _rotate(self, path):
+        if self.backups <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backups, 0, -1):
+            src = path if i == 1 else f"{path}.{i - 1}"
+            if os.path.exists(src): os.replace(src, f"{path}.{i}")
+
+class JobLog:
+    """Tek bir işin logu: halka tampon + arka planda yazılan dosya"""
+
+    def __init__(self, store, job_id, path, ring_size=RING_SIZE):
+        self.store = store
+        self.job_id = job_id
+        self.path = path
+        self.ring = deque(maxlen=ring_size)
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    def write(self, msg, level="info"):
+        with self._lock:
+            self.seq += 1
+            event = {"seq": self.seq, "ts": round(time.time(), 3), "job": self.job_id, "level": level, "msg": msg}
+            self.ring.append(event)
+        self.store.recent_events.append(event)
+        self.store.writer.write(self.path, json.dumps(event, ensure_ascii=False) + "\n", f"[{self.job_id}] {msg}\n")
+        return event
+
+    def tail(self, since=None, limit=None):
+        """seq'i since'den büyük olaylar (en fazla son limit tanesi)"""
+        with self._lock:
+            events = [e for e in self.ring if since is None or e["seq"] > since]
+        return events[-limit:] if limit else events
+
+class JobLogStore:
+    def __init__(self, writer=None, ring_size=RING_SIZE, max_jobs=RING_JOBS):
+        self.writer = writer or LogWriter()
+        self.ring_size = ring_size
+        self.max_jobs = max_jobs
+        self.recent_events = deque(maxlen=ring_size)  # tüm işlerin son olayları
+        self._logs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, job_id, path):
+        log = JobLog(self, job_id, path, self.ring_size)
+        with self._lock:
+            self._logs[job_id] = log
+            while len(self._logs) > self.max_jobs: self._logs.popitem(last=False)
+            active = set(self._logs)
+        # Yeni iş başlarken eski loglar yazım thread'inde temizlenir
+        self.writer.submit(lambda: prune_logs(os.path.dirname(path), active=active))
+        return log
+
+    def get(self, job_id):
+        with self._lock:
+            return self._logs.get(job_id)
+
+    def tail(self, job_id, path, since=None, limit=None):
+        """Bellekteki halkadan, yoksa (yeniden başlatma sonrası / eski iş) dosyanın sonundan olaylar"""
+        log = self.get(job_id)
+        if log is not None: return log.tail(since, limit)
+        events = read_tail(path)
+        if since is not None: events = [e for e in events if e.get("seq", 0) > since]
+        return events[-limit:] if limit else events
+
+    def recent(self, limit=None):
+        events = list(self.recent_events)
+        return events[-limit:] if limit else events
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+def read_tail(path, max_bytes=TAIL_READ_BYTES):
+    """JSON lines dosyasının son max_bytes'ındaki olaylar (ilk yarım satır atlanır)"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(size - max_bytes, 0))
+            data = f.read()
+    except OSError:
+        return []
+    lines = data.split(b"\n")
+    if size > max_bytes: lines = lines[1:]
+    events = []
+    for line in lines:
+        if not line.strip(): continue
+        try: events.append(json.loads(line))
+        except ValueError: pass
+    return events
+
+JOB_LOGS = JobLogStore()
+atexit.register(JOB_LOGS.close)
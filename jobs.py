@@ -0,0 +1,270 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from compression import get_codec
+from metrics import StageTimings, track, JOBS_FINISHED, JOB_SECONDS
+from joblog import JOB_LOGS, LOG_SUFFIX
+
+# --- Constants ---
+JOBS_DIR = "/app/data/jobs"
+JOB_MOUNT_ROOT = "/mnt/pbsync_restore"
+DEFAULT_DRIVE_NAME = "drive-scsi0.img"
+MAX_CONCURRENT_JOBS = int(os.environ.get("PBSYNC_MAX_JOBS", "2"))
+MAX_QUEUED_JOBS = 32
+MAX_FINISHED_JOBS = 50  # bellekte tutulacak bitmiş iş sayısı
+DEFAULT_UPLOAD_MODE = os.environ.get("PBSYNC_UPLOAD", "stream")
+
+ACTIVE_STATES = ("queued", "running")
+
+class JobCancelled(Exception):
+    pass
+
+class ProgressBroadcaster:
+    """
+    İş olaylarını (ilerleme, log, bitiş) bekleyen SSE istemcilerine iletir.
+    Worker thread'lerinden publish() çağrılır; olaylar her abonenin event loop'una thread-safe aktarılır.
+    """
+
+    def __init__(self):
+        self._subscribers = []  # (loop, asyncio.Queue)
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.append((loop, queue))
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers = [(l, q) for l, q in self._subscribers if q is not queue]
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try: loop.call_soon_threadsafe(self._offer, queue, event)
+            except RuntimeError: self.unsubscribe(queue)  # loop kapanmış
+
+    @staticmethod
+    def _offer(queue, event):
+        # Yavaş istemci kuyruğu doldurursa en eski olay atılır; son durum her zaman iletilir
+        if queue.full():
+            try: queue.get_nowait()
+            except asyncio.QueueEmpty: pass
+        queue.put_nowait(event)
+
+class BackupJob:
+    """
+    Tek bir yedekleme işi. Her işin kendi drive adı, loop cihazı, mount dizini ve log dosyası vardır;
+    böylece aynı anda çalışan işler birbirinin kaynaklarına dokunmaz.
+    """
+
+    def __init__(self, snapshot, remote, target_folder="", source_paths="", drive_name=DEFAULT_DRIVE_NAME, codec=None,
+                 mode="files", partition_id=None, upload_mode=None, timestamp=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.snapshot = snapshot
+        self.remote = remote
+        self.target_folder = target_folder
+        self.source_paths = source_paths
+        self.drive_name = drive_name or DEFAULT_DRIVE_NAME
+        self.codec = codec or get_codec()
+        self.mode = mode or "files"  # files: mount + tar, incremental: manifest'e göre değişenler, raw: sparse imaj
+        self.partition_id = partition_id
+        self.upload_mode = upload_mode or DEFAULT_UPLOAD_MODE  # stream: tek rclone rcat, chunked: paralel parçalar
+        self.timestamp = timestamp  # arşiv adındaki zaman damgası; devam ettirilen işte aynı kalır
+        self.archive = None  # yüklenen arşivin adı ve codec bilgisi
+        self.mount_point = os.path.join(JOB_MOUNT_ROOT, self.id)
+        self.log_path = os.path.join(JOBS_DIR, f"{self.id}{LOG_SUFFIX}")
+        self.journal = JOB_LOGS.open(self.id, self.log_path)  # halka tampon + döndürülen JSON lines dosyası
+        self.loop_dev = None
+        self.status = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.timings = StageTimings()  # aşama süreleri ve host komut sayısı (bkz. metrics.py)
+        self.progress = {
+            "stage": "queued",
+            "bytes_read": 0,
+            "bytes_compressed": 0,
+            "bytes_uploaded": 0,
+            "total_bytes": 0,
+            "rate": 0.0,
+            "eta": None,
+        }
+        self.events = ProgressBroadcaster()
+        self._cancel = threading.Event()
+        self._procs = []
+        self._lock = threading.Lock()
+
+    def log(self, msg, level="info"):
+        """Log olayı işin halka tamponuna girer; konsol ve dosya yazımı arka planda toplu yapılır (bkz. joblog.py)"""
+        event = self.journal.write(msg, level)
+        self.events.publish({"type": "log", "msg": msg, "level": level, "seq": event["seq"]})
+
+    def set_stage(self, stage):
+        self.update_progress(stage=stage)
+
+    def update_progress(self, **fields):
+        self.progress.update(fields)
+        self.progress["updated"] = time.time()
+        self.events.publish({"type": "progress", **self.progress})
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        JOBS_FINISHED.inc(mode=self.mode, status=status)
+        if self.started: JOB_SECONDS.observe(self.finished - self.started, mode=self.mode)
+        self.update_progress(stage=status)
+        self.events.publish({"type": "end", **self.to_dict()})
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set(): raise JobCancelled("Job cancelled by user.")
+
+    def register_process(self, proc):
+        with self._lock:
+            self._procs.append(proc)
+        # İptal, süreç kaydedilmeden hemen önce geldiyse burada yakalıyoruz
+        if self._cancel.is_set(): self._terminate()
+
+    def _terminate(self):
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            try:
+                if proc.poll() is None: proc.terminate()
+            except: pass
+
+    def abort(self, reason):
+        """İptal dışı bir nedenle (örn. duran pipeline aşaması) işin süreçlerini sonlandırır"""
+        self.log(f"-> ABORT: {reason}", level="error")
+        self._terminate()
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self.finish("cancelled")
+            return
+        self._terminate()
+
+    def resume(self):
+        """Aynı parametre ve arşiv adıyla yeni bir iş; parçalı yüklemede tamamlanan parçalar tekrar gönderilmez"""
+        return BackupJob(
+            self.snapshot, self.remote, self.target_folder, self.source_paths, self.drive_name, self.codec,
+            self.mode, self.partition_id, self.upload_mode, self.timestamp
+        )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "snapshot": self.snapshot,
+            "remote": self.remote,
+            "target_folder": self.target_folder,
+            "source_paths": self.source_paths,
+            "drive_name": self.drive_name,
+            "mode": self.mode,
+            "partition_id": self.partition_id,
+            "upload_mode": self.upload_mode,
+            "timestamp": self.timestamp,
+            "loop": self.loop_dev,
+            "codec": self.codec.metadata(),
+            "archive": self.archive,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": dict(self.progress),
+            "timings": self.timings.to_dict(),
+        }
+
+class JobScheduler:
+    """Sınırlı sayıda worker ile yedekleme işlerini kuyruklar ve çalıştırır"""
+
+    def __init__(self, runner, max_workers=MAX_CONCURRENT_JOBS, max_queued=MAX_QUEUED_JOBS):
+        self.runner = runner  # runner(config, job)
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pbsync-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, config, job: BackupJob):
+        with self._lock:
+            active = [j for j in self._jobs.values() if j.status in ACTIVE_STATES]
+            if len(active) >= self.max_queued:
+                raise Exception("Job queue is full.")
+            for other in active:
+                if other.snapshot == job.snapshot and other.drive_name == job.drive_name:
+                    raise Exception(f"A job for {job.snapshot} is already {other.status} ({other.id}).")
+            self._jobs[job.id] = job
+            self._prune()
+        job.log(f"--- Queued Stream for {job.snapshot} ---")
+        job.future = self._executor.submit(self._run, config, job)
+        return job
+
+    def _run(self, config, job):
+        if job.cancelled:
+            job.finish("cancelled")
+            return
+        job.status = "running"
+        job.started = time.time()
+        try:
+            with track(job.timings):
+                self.runner(config, job)
+            job.finish("cancelled" if job.cancelled else "success")
+        except JobCancelled as e:
+            job.finish("cancelled", str(e))
+        except Exception as e:
+            job.finish("failed", str(e))
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status not in ACTIVE_STATES]
+        for job in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            self._jobs.pop(job.id, None)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def latest(self):
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def list(self):
+        with self._lock:
+            return [j.to_dict() for j in reversed(self._jobs.values())]
+
+    def count(self, status):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status == status)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None: return None
+        if job.status in ACTIVE_STATES: job.cancel()
+        return job
+
+    def resume(self, config, job_id):
+        job = self._jobs.get(job_id)
+        if job is None: return None
+        if job.status in ACTIVE_STATES: raise Exception(f"Job {job_id} is still {job.status}.")
+        return self.submit(config, job.resume())
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status in ACTIVE_STATES: job.cancel()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,110 @@
+"""
+Repository + VM + disk bazında kalıcı partition düzeni önbelleği.
+
+Her snapshot map edildiğinde aday listesi (cihaz, dosya sistemi, boyut) çıkarılır. Liste bir önceki
+snapshot'takiyle aynıysa, yedeklemenin son seçtiği partition ve her partition için çalışan mount
+yöntemi (auto, ntfs-3g, xfs, ext4) doğrudan kullanılır; düzen değişmişse kayıt sıfırlanır ve
+normal deneme sırasına dönülür. Kayıtlar /app/data/layouts.json dosyasında tutulur.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+# --- Constants ---
+LAYOUT_CACHE_PATH = "/app/data/layouts.json"
+LAYOUT_CACHE_MAX = 1024  # en eski güncellenen kayıtlar atılır
+
+def relative_device(device, loop_dev):
+    """Loop numarası her map'te değişebildiği için cihaz yolundaki loop adı yer tutucuya çevrilir"""
+    loop_name = os.path.basename(loop_dev or "")
+    if not loop_name: return device
+    return re.sub(rf"\b{re.escape(loop_name)}(?=p\d+$|$)", "{loop}", device)
+
+def layout_signature(candidates, loop_dev):
+    return [[relative_device(c["device"], loop_dev), c.get("type", ""), c.get("size_bytes", 0)] for c in candidates]
+
+class DiskLayout:
+    """Bir VM diskinin kaydı; remember_* çağrıları değişiklik varsa store'a yazar"""
+
+    def __init__(self, store, key, entry, hit):
+        self.store = store
+        self.key = key
+        self.entry = entry
+        self.hit = hit  # düzen önceki kayıtla aynı mı
+
+    @property
+    def index(self):
+        """Yedeklemenin son seçtiği partition (düzen değişmediyse)"""
+        return self.entry.get("index")
+
+    def strategy(self, index):
+        return self.entry["mounts"].get(str(index))
+
+    def order(self, count):
+        """Auto modda denenecek partition sırası: önce son seçilen, sonra boyut sırası"""
+        first = self.index
+        if first is None or not 0 <= first < count: return list(range(count))
+        return [first] + [i for i in range(count) if i != first]
+
+    def remember_mount(self, index, strategy, chosen=False):
+        changed = self.entry["mounts"].get(str(index)) != strategy or (chosen and self.entry.get("index") != index)
+        if not changed: return
+        self.entry["mounts"][str(index)] = strategy
+        if chosen: self.entry["index"] = index
+        self.store.save(self.key, self.entry)
+
+class LayoutStore:
+    def __init__(self, path=LAYOUT_CACHE_PATH, max_entries=LAYOUT_CACHE_MAX):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    @staticmethod
+    def key(repository, snapshot, drive_name):
+        """
+        PBS repository + snapshot'ın VM grubu (vm/100) + disk adı; aynı VM'in tüm snapshot'ları kaydı paylaşır.
+        Farklı repository / datastore'lardaki aynı VMID'ler ayrı kayıtlardır.
+        """
+        return f"{repository}|" + "/".join(snapshot.split("/")[:2]) + "|" + drive_name
+
+    def lookup(self, repository, snapshot, drive_name, loop_dev, candidates):
+        """Aday listesine karşılık gelen DiskLayout; düzen değişmişse boş bir kayıtla başlar"""
+        key = self.key(repository, snapshot, drive_name)
+        signature = layout_signature(candidates, loop_dev)
+        with self._lock:
+            entry = self._load().get(key)
+        hit = entry is not None and entry.get("layout") == signature
+        if not hit:
+            entry = {"layout": signature, "index": None, "mounts": {}}
+            if candidates: self.save(key, entry)
+        return DiskLayout(self, key, json.loads(json.dumps(entry)), hit)
+
+    def save(self, key, entry):
+        with self._lock:
+            entries = self._load()
+            entries[key] = {**json.loads(json.dumps(entry)), "updated": time.time()}
+            if len(entries) > self.max_entries:
+                for old in sorted(entries, key=lambda k: entries[k].get("updated", 0))[:len(entries) - self.max_entries]:
+                    entries.pop(old, None)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = self.path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Layout cache not saved: {e}")
+
+LAYOUTS = LayoutStore()
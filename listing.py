@@ -0,0 +1,99 @@
+"""
+Gezgin için sayfalı dizin listeleri.
+
+Bir dizin ilk istendiğinde tek bir scandir ile okunur, sıralanır ve (snapshot, partition, yol) anahtarıyla
+önbelleğe alınır; sonraki sayfalar bu listeden cursor + limit ile O(sayfa) maliyetle kesilir.
+Boyut ve mtime sadece istenirse ve sadece sayfadaki girdiler için okunur, sonuç listede saklanır.
+Snapshot'lar değişmez olduğu için girdiler geçersiz olmaz; toplam girdi sayısına göre LRU ile sınırlanır.
+Liste mount yolunu tutmaz: gezgin oturumu kapanıp başka bir dizine yeniden mount edilebilir, stat her
+çağrıda o anki dizine göre yapılır.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# --- Constants ---
+PAGE_SIZE = int(os.environ.get("PBSYNC_PAGE_SIZE", "500"))
+MAX_PAGE_SIZE = 5000
+LISTING_CACHE_ENTRIES = int(os.environ.get("PBSYNC_LISTING_CACHE_ENTRIES", "1000000"))
+
+class Listing:
+    """Bir dizinin sıralı girdileri (önce klasörler, sonra büyük/küçük harf duyarsız ada göre)"""
+
+    __slots__ = ("names", "dirs", "stats")
+
+    def __init__(self, entries):
+        entries.sort(key=lambda e: (not e[1], e[0].lower(), e[0]))
+        self.names = [name for name, _ in entries]
+        self.dirs = [is_dir for _, is_dir in entries]
+        self.stats = {}  # index -> (size, mtime); sayfa sayfa doldurulur
+
+    def __len__(self):
+        return len(self.names)
+
+    def stat(self, index, path):
+        """path: dizinin şu anki mount yolu. Başarısız stat önbelleğe alınmaz (sonraki istekte tekrar denenir)."""
+        cached = self.stats.get(index)
+        if cached is not None: return cached
+        # Sadece girdiye özgü hatalar yutulur; EIO / ENOTCONN (kopan FUSE / mount) yukarı çıkar ve
+        # gezgin oturumu kapatıp yeniden dener
+        try:
+            st = os.lstat(os.path.join(path, self.names[index]))
+        except (FileNotFoundError, PermissionError):
+            return (None, None)
+        cached = self.stats[index] = (st.st_size, int(st.st_mtime))
+        return cached
+
+def scan_directory(path):
+    """
+    Dizini tek geçişte okur. Girdi başına sadece d_type kullanılır (stat yok).
+    Dizinin kendisi okunamazsa OSError yükselir (mount kopması vb. çağıran tarafından ele alınır).
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try: entries.append((entry.name, entry.is_dir()))
+            except OSError: entries.append((entry.name, False))
+    return Listing(entries)
+
+def parse_cursor(cursor):
+    """Cursor listedeki sıradaki girdinin konumudur; boş veya None baştan başlar"""
+    if not cursor: return 0
+    offset = int(cursor)
+    if offset < 0: raise ValueError("Invalid cursor")
+    return offset
+
+def page_bounds(total, cursor=None, limit=None):
+    """(başlangıç, bitiş, sonraki cursor); son sayfada sonraki cursor None"""
+    start = min(parse_cursor(cursor), total)
+    limit = max(1, min(limit or PAGE_SIZE, MAX_PAGE_SIZE))
+    end = min(start + limit, total)
+    return start, end, str(end) if end < total else None
+
+class ListingCache:
+    """Sıralı dizin listelerinin LRU önbelleği; üst sınır liste sayısı değil toplam girdi sayısıdır"""
+
+    def __init__(self, max_entries=LISTING_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # (snapshot, partition, yol) -> Listing
+        self._entries = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, path):
+        with self._lock:
+            listing = self._cache.get(key)
+            if listing is not None:
+                self._cache.move_to_end(key)
+                return listing
+        # Okuma kilit dışında; aynı dizin için eşzamanlı ilk istekler nadirdir ve sonuç aynıdır
+        listing = scan_directory(path)
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = listing
+                self._entries += len(listing)
+                while self._entries > self.max_entries and len(self._cache) > 1:
+                    _, old = self._cache.popitem(last=False)
+                    self._entries -= len(old)
+        return listing
+
+LISTINGS = ListingCache()
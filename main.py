@@ -1,18 +1,33 @@
 import os
 import json
+import asyncio
 import subprocess
-from fastapi import FastAPI, Form, Request, BackgroundTasks, Depends
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, Form, Request, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 import uvicorn
-from core import run_backup_process, list_files_or_partitions
+from core import run_backup_process, list_files_or_partitions, estimate_path_size, cleanup, remote_target
+from sessions import SESSIONS
+from hostshell import HOST_SHELL
+from catalog import CATALOG
+import jobs
+from jobs import BackupJob, JobScheduler
+from compression import get_codec, CODECS
+from manifest import MANIFESTS
+import dedup
+import seekable
+import aio
+from aio import run_blocking, check_command, OperationTimeout
+from config import CONFIG, Config
+from metrics import METRICS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from joblog import JOB_LOGS, LOG_SUFFIX, RING_SIZE
+import retention
+from retention import RetentionPolicy
+from schedules import BackupScheduler, match_groups
 
 # --- AYARLAR ---
-CONFIG_DIR = "/app/data"
-CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
-RCLONE_CONFIG_PATH = os.path.join(CONFIG_DIR, "rclone.conf")
-LOG_FILE_PATH = "/app/data/pbsync_stream.log"
+LOG_TAIL_EVENTS = 200  # /stream-logs'un varsayılan olarak döndürdüğü son olay sayısı
 
 app = FastAPI(title="PbSync")
 
@@ -31,31 +46,66 @@ if not os.path.isdir(TEMPLATES_DIR):
 
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
+SCHEDULER = JobScheduler(run_backup_process)
+
+def resolve_scheduled(policy):
+    """Politikanın seçicisine uyan grupların en yeni snapshot'ları (katalog tazelenerek)"""
+    config = CONFIG.get()
+    if not config: raise Exception("No Config")
+    CATALOG.ensure(config['pbs_repository_path'], config.process_env(), refresh=True)
+    return {group: CATALOG.latest(group) for group in match_groups(policy.selector, CATALOG.groups())}
+
+def submit_scheduled(policy, snapshot):
+    config = CONFIG.get()
+    if not config: raise Exception("No Config")
+    options = policy.options
+    upload_mode = options.get("upload_mode")
+    job_codec = get_codec("none") if upload_mode == "dedup" else get_codec(options.get("codec"), options.get("level"))
+    return SCHEDULER.submit(config, BackupJob(
+        snapshot, policy.remote, policy.target_folder, options.get("source_paths", ""), options.get("drive_name", ""),
+        job_codec, options.get("mode", "files"), options.get("partition_id"), upload_mode
+    ))
+
+def prune_target(remote, target_folder, policies, dry_run=False, config=None):
+    """
+    Hedef klasörü budar. Manifest'te tam olarak kayıtlı ilk artımlı çalıştırmalar zincir başı sayılır;
+    kuyruktaki / çalışan işlerin arşivleri korunur.
+    """
+    config = config or CONFIG.get()
+    if not config: raise Exception("No Config")
+    folder = remote_target(remote, target_folder, "").rstrip("/")
+    scope = MANIFESTS.scope(config['pbs_repository_path'], folder)
+    full = {r["archive"].split(".")[0] for r in MANIFESTS.runs(limit=100000, scope=scope) if r["kind"] == "full" and r["archive"]}
+    protect = {f"{j['snapshot'].split('/')[1]}_{j['timestamp']}" for j in SCHEDULER.list()
+               if j["status"] in jobs.ACTIVE_STATES and j["timestamp"]}
+    return retention.prune_folder(folder, policies, dry_run, full, protect, env=config.process_env())
+
+SCHEDULES = BackupScheduler(resolve_scheduled, submit_scheduled, prune_target)
+
+METRICS.gauge("pbsync_jobs_running", "Backup jobs currently running.", lambda: SCHEDULER.count("running"))
+METRICS.gauge("pbsync_jobs_queued", "Backup jobs waiting for a worker.", lambda: SCHEDULER.count("queued"))
+METRICS.gauge("pbsync_explore_sessions", "Open explorer mount sessions.", lambda: len(SESSIONS.list()))
+
+@app.on_event("startup")
+async def start_session_reaper():
+    # Önceki çalışmadan kalan map/mount artıkları; henüz hiçbir iş veya oturum yokken temizlenir
+    try: cleanup()
+    except: pass
+    SESSIONS.start_reaper()
+    SCHEDULES.start()
+
+@app.on_event("shutdown")
+async def close_sessions():
+    SCHEDULES.stop()
+    SCHEDULER.shutdown()
+    SESSIONS.close_all()
+    HOST_SHELL.close()
+    aio.shutdown()
+    JOB_LOGS.close()
+
 def get_config():
-    if not os.path.exists(CONFIG_FILE):
-        return None
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-    except Exception as e:
-        return None
-
-    os.environ['RCLONE_CONFIG'] = RCLONE_CONFIG_PATH
-    
-    pbs_user = config.get('pbs_user', 'root@pam')
-    pbs_host = config.get('pbs_host', 'localhost')
-    pbs_repo = config.get('pbs_repo', 'backup')
-    pbs_pass = config.get('pbs_password', '')
-    pbs_fingerprint = config.get('pbs_fingerprint', '')
-
-    os.environ['PBS_PASSWORD'] = pbs_pass
-    if pbs_fingerprint and pbs_fingerprint.strip():
-        os.environ['PBS_FINGERPRINT'] = pbs_fingerprint.strip()
-    
-    repo = f"{pbs_user}@{pbs_host}:{pbs_repo}"
-    os.environ['PBS_REPOSITORY'] = repo
-    config['pbs_repository_path'] = repo
-    return config
+    """Önbellekteki değişmez yapılandırma; config.json değişmişse (mtime) yeniden yüklenir"""
+    return CONFIG.get()
 
 @app.get("/setup", response_class=HTMLResponse)
 async def get_setup_page(request: Request):
@@ -71,7 +121,6 @@ async def handle_setup_form(
     rclone_conf: str = Form(...)
 ):
     try:
-        os.makedirs(CONFIG_DIR, exist_ok=True)
         config_data = {
             "pbs_host": pbs_host.strip(),
             "pbs_repo": pbs_repo.strip(),
@@ -79,115 +128,376 @@ async def handle_setup_form(
             "pbs_password": pbs_password.strip(),
             "pbs_fingerprint": pbs_fingerprint.strip() if pbs_fingerprint else ""
         }
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config_data, f, indent=4)
-        with open(RCLONE_CONFIG_PATH, 'w') as f:
-            f.write(rclone_conf.strip())
-        os.chmod(RCLONE_CONFIG_PATH, 0o600)
+        CONFIG.save(config_data, rclone_conf.strip())
+        CATALOG.invalidate()
         return RedirectResponse(url="/", status_code=303)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request, config: dict = Depends(get_config)):
+async def read_root(request: Request, config: Config = Depends(get_config)):
     if config is None:
         return RedirectResponse(url="/setup")
     rclone_remotes = []
     try:
-        remotes_raw = subprocess.check_output("rclone listremotes", shell=True, env=os.environ).decode().strip()
+        remotes_raw = (await check_command(["rclone", "listremotes"], env=config.process_env())).strip()
         rclone_remotes = [line.strip() for line in remotes_raw.split('\n') if line]
     except Exception as e:
         rclone_remotes = [f"ERROR: {str(e)}"]
     return templates.TemplateResponse("index.html", {
         "request": request, 
         "remotes": rclone_remotes,
+        "codecs": list(CODECS.keys()),
         "config": config
     })
 
 @app.get("/check-status")
-async def check_status(config: dict = Depends(get_config)):
+async def check_status(config: Config = Depends(get_config)):
     if not config: 
         return {"pbs": {"status": False, "msg": "No Config"}, "rclone": {"status": False, "msg": "No Config"}}
-    response = {}
-    try:
-        subprocess.run(
-            f"proxmox-backup-client snapshot list --repository {os.environ['PBS_REPOSITORY']} --output-format json-pretty", 
-            shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=os.environ
-        )
-        response["pbs"] = {"status": True, "msg": "Connected"}
-    except Exception as e:
-        response["pbs"] = {"status": False, "msg": str(e)}
-    try:
-        subprocess.run("rclone listremotes", shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=os.environ)
-        response["rclone"] = {"status": True, "msg": "Ready"}
-    except Exception as e:
-        response["rclone"] = {"status": False, "msg": str(e)}
-    return response
+    async def pbs():
+        try:
+            # Bağlantı testi katalog üzerinden: liste tazeyse PBS'e tekrar gidilmez
+            await run_blocking(CATALOG.ensure, config['pbs_repository_path'], config.process_env(), timeout=aio.PBS_TIMEOUT)
+            return {"status": True, "msg": "Connected"}
+        except Exception as e:
+            return {"status": False, "msg": str(e)}
+    async def rclone():
+        try:
+            await check_command(["rclone", "listremotes"], env=config.process_env())
+            return {"status": True, "msg": "Ready"}
+        except Exception as e:
+            return {"status": False, "msg": str(e)}
+    # İki kontrol paralel; biri yavaşsa diğerini bekletmez
+    pbs_status, rclone_status = await asyncio.gather(pbs(), rclone())
+    return {"pbs": pbs_status, "rclone": rclone_status}
 
 @app.post("/scan-vms")
-async def scan_vms(config: dict = Depends(get_config)):
+async def scan_vms(refresh: bool = False, config: Config = Depends(get_config)):
     if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
-    cmd = f"proxmox-backup-client snapshot list --repository {os.environ['PBS_REPOSITORY']} --output-format json-pretty"
     try:
-        output = subprocess.check_output(cmd, shell=True, env=os.environ).decode().strip()
-        data = json.loads(output)
-        vms = set()
-        for item in data:
-            if 'backup-type' in item and 'backup-id' in item:
-                vms.add(f"{item['backup-type']}/{item['backup-id']}")
-        return {"status": "success", "vms": sorted(list(vms))}
+        catalog = await run_blocking(CATALOG.ensure, config['pbs_repository_path'], config.process_env(), refresh=refresh,
+                                     timeout=aio.PBS_TIMEOUT)
+        return {"status": "success", "vms": catalog.groups()}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.post("/scan-snapshots")
-async def scan_snapshots(vmid: str = Form(...), config: dict = Depends(get_config)):
+async def scan_snapshots(vmid: str = Form(...), refresh: bool = False, config: Config = Depends(get_config)):
     if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
-    filter_str = vmid if "/" in vmid else f"vm/{vmid}"
-    cmd = f"proxmox-backup-client snapshot list --repository {os.environ['PBS_REPOSITORY']} | grep '{filter_str}' | awk '{{print $2}}' | sort -r"
+    group = vmid if "/" in vmid else f"vm/{vmid}"
     try:
-        result = subprocess.check_output(cmd, shell=True, env=os.environ).decode().strip().split('\n')
-        return {"status": "success", "snapshots": [s for s in result if s]}
+        catalog = await run_blocking(CATALOG.ensure, config['pbs_repository_path'], config.process_env(), refresh=refresh,
+                                     timeout=aio.PBS_TIMEOUT)
+        return {"status": "success", "snapshots": catalog.snapshots(group)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def stream_listing(result, batch=200):
+    """
+    Hazır dosya listesi sayfasını JSON olarak parça parça yazar (büyük sayfanın tamamı tek bir string olarak
+    bellekte tutulmaz). Girdiler ve stat'ları list_files_or_partitions içinde, zaman aşımı altında hazırlanır;
+    burada I/O yapılmadığı için yanıt yarıda hata ile kesilmez. Senkron üreteç olduğu için Starlette bunu
+    thread havuzunda tüketir.
+    """
+    items = result.pop("items")
+    yield json.dumps(result)[:-1] + ', "items": ['
+    chunk, first = [], True
+    for item in items:
+        chunk.append(json.dumps(item))
+        if len(chunk) >= batch:
+            yield ("" if first else ",") + ",".join(chunk)
+            chunk, first = [], False
+    if chunk: yield ("" if first else ",") + ",".join(chunk)
+    yield "]}"
+
 @app.post("/explore")
 async def explore_snapshot(
     snapshot: str = Form(...), 
     path: str = Form(""),
     partition_id: str = Form(None), 
-    config: dict = Depends(get_config)
+    cursor: str = Form(None),
+    limit: int = Form(None),
+    details: bool = Form(False),
+    config: Config = Depends(get_config)
 ):
+    """Partition listesi veya dizin içeriğinin bir sayfası; next_cursor doluysa sonraki sayfa onunla istenir"""
     if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
-    result = list_files_or_partitions(config, snapshot, partition_id, path)
-    return result
+    try:
+        result = await run_blocking(list_files_or_partitions, config, snapshot, partition_id, path, cursor, limit, details,
+                                    timeout=aio.EXPLORE_TIMEOUT)
+    except OperationTimeout as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 504)
+    if result.get("type") != "files": return result
+    return StreamingResponse(stream_listing(result), media_type="application/json")
+
+@app.post("/explore/size")
+async def explore_size(
+    snapshot: str = Form(...),
+    partition_id: str = Form(...),
+    path: str = Form(""),
+    config: Config = Depends(get_config)
+):
+    if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
+    try:
+        return await run_blocking(estimate_path_size, config, snapshot, partition_id, path, timeout=aio.EXPLORE_TIMEOUT)
+    except OperationTimeout as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 504)
+
+@app.get("/explore/sessions")
+async def explore_sessions():
+    return {"status": "success", "sessions": SESSIONS.list()}
+
+@app.post("/explore/close")
+async def explore_close(snapshot: str = Form(None)):
+    if snapshot:
+        closed = 1 if await run_blocking(SESSIONS.close, snapshot) else 0
+    else:
+        closed = await run_blocking(SESSIONS.close_all)
+    return {"status": "success", "closed": closed}
 
 @app.post("/start-stream")
 async def start_stream(
-    background_tasks: BackgroundTasks, 
     snapshot: str = Form(...), 
     remote: str = Form(...),
     target_folder: str = Form(""),
     source_paths: str = Form(""), 
-    config: dict = Depends(get_config)
+    drive_name: str = Form(""),
+    codec: str = Form(None),
+    level: int = Form(None),
+    threads: int = Form(None),
+    long_mode: bool = Form(False),
+    mode: str = Form("files"),
+    partition_id: str = Form(None),
+    upload_mode: str = Form(None),
+    config: Config = Depends(get_config)
 ):
     if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
-    background_tasks.add_task(run_backup_process, config, snapshot, remote, target_folder, source_paths)
-    return {"status": "started", "message": f"Stream Started: {snapshot} -> {remote}"}
+    if mode not in ("files", "incremental", "raw"): return JSONResponse({"status": "error", "message": f"Unknown mode: {mode}"}, 400)
+    if upload_mode not in (None, "", "stream", "chunked", "dedup"):
+        return JSONResponse({"status": "error", "message": f"Unknown upload mode: {upload_mode}"}, 400)
+    try:
+        # Dedup deposunda parçalar ayrı ayrı sıkıştırılır; arşiv akışı sıkıştırılmaz
+        job_codec = get_codec("none") if upload_mode == "dedup" else get_codec(codec, level, threads, long_mode)
+        if job_codec.seekable and (mode == "raw" or (upload_mode or jobs.DEFAULT_UPLOAD_MODE) != "stream"):
+            return JSONResponse({"status": "error", "message": "Seekable archives need files/incremental mode and stream upload"}, 400)
+        job = SCHEDULER.submit(config, BackupJob(
+            snapshot, remote, target_folder, source_paths, drive_name, job_codec, mode, partition_id, upload_mode
+        ))
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 409)
+    return {"status": "started", "job_id": job.id, "message": f"Stream Queued: {snapshot} -> {remote}"}
 
-@app.get("/stream-logs")
-async def get_stream_logs():
-    if not os.path.exists(LOG_FILE_PATH):
-        return {"logs": "Waiting for logs..."}
-    
+@app.get("/jobs")
+async def list_jobs():
+    return {"status": "success", "jobs": SCHEDULER.list()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = SCHEDULER.get(job_id)
+    if not job: return JSONResponse({"status": "error", "message": "Job not found"}, 404)
+    return {"status": "success", "job": job.to_dict()}
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = SCHEDULER.cancel(job_id)
+    if not job: return JSONResponse({"status": "error", "message": "Job not found"}, 404)
+    return {"status": "success", "job": job.to_dict()}
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str, config: Config = Depends(get_config)):
+    """Başarısız / iptal edilmiş işi aynı arşiv adıyla yeniden kuyruğa alır"""
+    if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
     try:
-        with open(LOG_FILE_PATH, "r", encoding="utf-8", errors="ignore") as f:
-            f.seek(0, 2) 
-            size = f.tell()
-            f.seek(max(size - 4000, 0)) 
-            content = f.read()
-            return {"logs": content}
+        job = SCHEDULER.resume(config, job_id)
     except Exception as e:
-        return {"logs": f"Error reading logs: {e}"}
+        return JSONResponse({"status": "error", "message": str(e)}, 409)
+    if not job: return JSONResponse({"status": "error", "message": "Job not found"}, 404)
+    return {"status": "started", "job_id": job.id, "message": f"Stream Resumed: {job.snapshot} -> {job.remote}"}
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """İş ilerlemesini Server-Sent Events olarak iter (bellekteki durumdan, dosya okunmadan)"""
+    job = SCHEDULER.get(job_id)
+    if not job: return JSONResponse({"status": "error", "message": "Job not found"}, 404)
+
+    async def stream():
+        queue = job.events.subscribe()
+        try:
+            yield f"event: progress\ndata: {json.dumps({'type': 'progress', **job.progress})}\n\n"
+            if job.status not in ("queued", "running"):
+                yield f"event: end\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] == "end": return
+        finally:
+            job.events.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/manifests")
+async def list_manifests(vm: str = None):
+    """Manifest kayıtlı yedek çalıştırmaları (tam / artımlı zinciri)"""
+    return {"status": "success", "runs": MANIFESTS.runs(vm)}
+
+@app.post("/dedup/gc")
+async def dedup_gc(remote: str = Form(...), target_folder: str = Form(""), dry_run: bool = Form(False),
+                   config: Config = Depends(get_config)):
+    """Hedef klasördeki dedup deposunda hiçbir recipe'nin kullanmadığı parçaları siler"""
+    if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
+    store = remote_target(remote, target_folder, dedup.STORE_DIR_NAME)
+    # Kuyruktaki dedup işleri henüz depoyu kilitlemedi; GC'nin sildiği eski bir parçayı kullanabilirler
+    waiting = [j["id"] for j in SCHEDULER.list() if j["status"] in jobs.ACTIVE_STATES and j["upload_mode"] == "dedup"
+               and remote_target(j["remote"], j["target_folder"], dedup.STORE_DIR_NAME) == store]
+    if waiting:
+        return JSONResponse({"status": "error", "message": f"Dedup jobs active on this store: {', '.join(waiting)}"}, 409)
+    try:
+        result = await run_blocking(dedup.gc, store, dedup.GC_GRACE_HOURS, dry_run, env=config.process_env())
+    except dedup.StoreBusy as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 409)
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 500)
+    return {"status": "success", **result}
+
+@app.post("/restore")
+async def restore(remote: str = Form(...), target_folder: str = Form(""), archive: str = Form(...),
+                  paths: str = Form(""), raw: bool = Form(False), config: Config = Depends(get_config)):
+    """
+    Aranabilir arşivden seçili yolları indirir: sadece ilgili çerçeveler uzak depodan okunur.
+    Sonuç bir tar akışıdır; raw=true ve tek bir normal dosya seçildiyse dosyanın kendisi döner.
+    """
+    if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
+    env = config.process_env()
+    full_path = remote_target(remote, target_folder, archive)
+    try:
+        index = await run_blocking(seekable.load_index, full_path, env, aio.PBS_TIMEOUT, timeout=aio.PBS_TIMEOUT)
+    except FileNotFoundError:
+        return JSONResponse({"status": "error", "message": f"No seekable index for {archive}"}, 404)
+    except (OperationTimeout, subprocess.TimeoutExpired):
+        return JSONResponse({"status": "error", "message": f"Index download timed out after {aio.PBS_TIMEOUT}s"}, 504)
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 500)
+    entries = seekable.select(index, paths.split(","))
+    if not entries: return JSONResponse({"status": "error", "message": "No matching entries"}, 404)
+
+    if raw and len(entries) == 1 and entries[0][4] in ("0", "7"):
+        name = os.path.basename(entries[0][0])
+        return StreamingResponse(seekable.iter_file(full_path, index, entries[0], env, aio.PBS_TIMEOUT), media_type="application/octet-stream",
+                                 headers={"Content-Disposition": f'attachment; filename="{name}"',
+                                          "Content-Length": str(entries[0][3])})
+    name = archive.split(".tar")[0] + "_restore.tar"
+    return StreamingResponse(seekable.iter_tar(full_path, index, entries, env, aio.PBS_TIMEOUT), media_type="application/x-tar",
+                             headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.get("/schedules")
+async def list_schedules():
+    """Zamanlanmış yedekleme politikaları, bir sonraki çalışma zamanları ve son olaylar"""
+    return {"status": "success", **SCHEDULES.list()}
+
+@app.post("/schedules")
+async def save_schedule(
+    cron: str = Form(...),
+    selector: str = Form(...),
+    remote: str = Form(...),
+    target_folder: str = Form(""),
+    id: str = Form(None),
+    name: str = Form(""),
+    jitter: int = Form(0),
+    enabled: bool = Form(True),
+    skip_unchanged: bool = Form(True),
+    mode: str = Form("files"),
+    codec: str = Form(None),
+    level: int = Form(None),
+    upload_mode: str = Form(None),
+    source_paths: str = Form(""),
+    drive_name: str = Form(""),
+    partition_id: str = Form(None),
+    keep_last: int = Form(0),
+    keep_daily: int = Form(0),
+    keep_weekly: int = Form(0),
+    keep_monthly: int = Form(0),
+):
+    """
+    Politika ekler / günceller (id verilirse). cron: "dakika saat gün ay haftanın-günü" veya @daily;
+    selector: vm/100, vm/*, 100 (virgülle birden çok). keep_* kuralları işler bitince hedef klasöre uygulanır.
+    """
+    if mode not in ("files", "incremental", "raw"): return JSONResponse({"status": "error", "message": f"Unknown mode: {mode}"}, 400)
+    if upload_mode not in (None, "", "stream", "chunked", "dedup"):
+        return JSONResponse({"status": "error", "message": f"Unknown upload mode: {upload_mode}"}, 400)
+    options = {"mode": mode, "codec": codec, "level": level, "upload_mode": upload_mode, "source_paths": source_paths,
+               "drive_name": drive_name, "partition_id": partition_id}
+    try:
+        get_codec(codec, level)
+        policy = SCHEDULES.upsert({
+            "id": id, "name": name, "cron": cron, "selector": selector, "remote": remote, "target_folder": target_folder,
+            "jitter": jitter, "enabled": enabled, "skip_unchanged": skip_unchanged, "options": options,
+            "retention": {"keep_last": keep_last, "keep_daily": keep_daily, "keep_weekly": keep_weekly,
+                          "keep_monthly": keep_monthly},
+        })
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 400)
+    return {"status": "success", "policy": policy.to_dict(), "next_run": policy.next_run()}
+
+@app.delete("/schedules/{policy_id}")
+async def delete_schedule(policy_id: str):
+    if not SCHEDULES.delete(policy_id): return JSONResponse({"status": "error", "message": "Schedule not found"}, 404)
+    return {"status": "success"}
+
+@app.post("/schedules/{policy_id}/run")
+async def run_schedule(policy_id: str):
+    """Politikayı zamanını beklemeden çalıştırır (jitter uygulanmaz, eşzamanlılık sınırı geçerlidir)"""
+    queued = await run_blocking(SCHEDULES.run_now, policy_id)
+    if queued is None: return JSONResponse({"status": "error", "message": "Schedule not found"}, 404)
+    return {"status": "success", "queued": queued}
+
+@app.post("/retention")
+async def apply_retention(remote: str = Form(...), target_folder: str = Form(""), vmid: str = Form("*"),
+                          keep_last: int = Form(0), keep_daily: int = Form(0), keep_weekly: int = Form(0),
+                          keep_monthly: int = Form(0), dry_run: bool = Form(True), config: Config = Depends(get_config)):
+    """Hedef klasöre tutma kurallarını elle uygular; varsayılan olarak sadece planı döner (dry_run)"""
+    if not config: return JSONResponse({"status": "error", "message": "No Config"}, 401)
+    rules = RetentionPolicy(keep_last, keep_daily, keep_weekly, keep_monthly)
+    if not rules.enabled: return JSONResponse({"status": "error", "message": "At least one keep_* rule is required"}, 400)
+    try:
+        result = await run_blocking(prune_target, remote, target_folder, {vmid: rules}, dry_run, config)
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 500)
+    return {"status": "success", **{k: result[k] for k in ("keep", "delete", "bytes", "dry_run", "rclone_calls")}}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metin formatında aşama süreleri, host komut sayaçları ve pipeline byte'ları"""
+    return Response(METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/stream-logs")
+async def get_stream_logs(job_id: str = None, since: int = None, limit: int = LOG_TAIL_EVENTS):
+    """
+    İşin son log olayları (bellekteki halka tampondan). since verilirse sadece o seq'ten sonraki olaylar döner;
+    istemci yanıttaki last_seq ile tekrar sorarak sadece yeni satırları alır.
+    """
+    limit = max(1, min(limit, RING_SIZE))
+    job = SCHEDULER.get(job_id) if job_id else SCHEDULER.latest()
+    if job is not None:
+        events = job.journal.tail(since, limit)
+    elif job_id:
+        # Kuyruktan düşmüş veya yeniden başlatma öncesi iş: halka tamponu ya da dosyanın sonu
+        if not job_id.isalnum(): return JSONResponse({"status": "error", "message": "Invalid job id"}, 400)
+        events = JOB_LOGS.tail(job_id, os.path.join(jobs.JOBS_DIR, job_id + LOG_SUFFIX), since, limit)
+    else:
+        events = JOB_LOGS.recent(limit)
+    if not events and since is None: return {"logs": "Waiting for logs...", "events": [], "last_seq": since}
+    return {
+        "logs": "\n".join(e["msg"] for e in events),
+        "events": events,
+        "last_seq": events[-1]["seq"] if events else since,
+        "job": job.to_dict() if job else None,
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
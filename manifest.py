@@ -0,0 +1,183 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# --- Constants ---
+MANIFEST_DB_PATH = "/app/data/manifests.db"
+SCAN_WORKERS = int(os.environ.get("PBSYNC_SIZE_WORKERS", "8"))
+INSERT_BATCH = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    vm TEXT NOT NULL,
+    source TEXT NOT NULL,
+    path BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    PRIMARY KEY (vm, source, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS runs (
+    vm TEXT NOT NULL,
+    source TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    archive TEXT,
+    kind TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    created INTEGER NOT NULL
+);
+"""
+
+def _scan_dir(top, path, rel):
+    """
+    Bir klasörün girdilerini (rel_path_bytes, size, mtime_ns, inode) olarak döner;
+    ayrıca klasör olmayan girdilerin toplam boyutunu ve alt klasörleri.
+    """
+    rows, subdirs, file_bytes = [], [], 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                    entry_rel = os.path.join(rel, entry.name) if rel != "." else entry.name
+                    rows.append((os.fsencode(entry_rel), st.st_size, st.st_mtime_ns, st.st_ino))
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append((top, entry.path, entry_rel))
+                    else:
+                        file_bytes += st.st_size
+                except OSError: pass
+    except OSError: pass
+    return top, rows, file_bytes, subdirs
+
+class ManifestScan:
+    """
+    Tek bir VM + kaynak için yapılan tarama. Sonuçlar geçici bir tabloya yazılır,
+    önceki manifest ile SQL üzerinden karşılaştırılır ve yükleme başarılı olursa commit() ile kalıcı olur.
+    """
+
+    def __init__(self, db_path, vm, source):
+        self.vm = vm
+        self.source = source
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("CREATE TEMP TABLE scan (path BLOB PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER) WITHOUT ROWID")
+        self.totals = {}  # kaynak yolu -> toplam dosya byte'ı
+        self.files = 0
+
+    def has_baseline(self):
+        row = self.conn.execute("SELECT 1 FROM files WHERE vm=? AND source=? LIMIT 1", (self.vm, self.source)).fetchone()
+        return row is not None
+
+    def scan(self, root, paths, cancelled=None, workers=SCAN_WORKERS):
+        """
+        Kaynak yolları (mount köküne göre göreli, normalize edilmiş) paralel scandir ile gezer.
+        Kök dışındaki her yolun kendisi de manifest'e girer. Toplam dosya byte'ını döner.
+        """
+        batch = []
+        def flush():
+            self.conn.executemany("INSERT OR REPLACE INTO scan VALUES (?,?,?,?)", batch)
+            self.files += len(batch)
+            batch.clear()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pbsync-manifest") as pool:
+            pending = set()
+            for top in paths:
+                full = os.path.join(root, top)
+                self.totals[top] = 0
+                if top != ".":
+                    try:
+                        st = os.lstat(full)
+                        batch.append((os.fsencode(top), st.st_size, st.st_mtime_ns, st.st_ino))
+                        if not os.path.isdir(full) or os.path.islink(full):
+                            self.totals[top] += st.st_size
+                            continue
+                    except OSError: continue
+                pending.add(pool.submit(_scan_dir, top, full, top))
+
+            while pending:
+                if cancelled is not None and cancelled():
+                    for f in pending: f.cancel()
+                    raise InterruptedError("Manifest scan cancelled.")
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    top, rows, file_bytes, subdirs = future.result()
+                    self.totals[top] += file_bytes
+                    batch.extend(rows)
+                    for sub in subdirs: pending.add(pool.submit(_scan_dir, *sub))
+                if len(batch) >= INSERT_BATCH: flush()
+        flush()
+        return sum(self.totals.values())
+
+    def changed(self):
+        """Yeni veya değişmiş girdiler: (yol_bytes, size) listesi"""
+        return self.conn.execute(
+            "SELECT s.path, s.size FROM scan s "
+            "LEFT JOIN files f ON f.vm=? AND f.source=? AND f.path=s.path "
+            "WHERE f.path IS NULL OR f.size!=s.size OR f.mtime!=s.mtime OR f.inode!=s.inode "
+            "ORDER BY s.path",
+            (self.vm, self.source)
+        ).fetchall()
+
+    def deleted(self):
+        return [row[0] for row in self.conn.execute(
+            "SELECT f.path FROM files f WHERE f.vm=? AND f.source=? "
+            "AND NOT EXISTS (SELECT 1 FROM scan s WHERE s.path=f.path) ORDER BY f.path",
+            (self.vm, self.source)
+        )]
+
+    def commit(self, snapshot, archive, kind):
+        with self.conn:
+            self.conn.execute("DELETE FROM files WHERE vm=? AND source=?", (self.vm, self.source))
+            self.conn.execute(
+                "INSERT INTO files SELECT ?, ?, path, size, mtime, inode FROM scan", (self.vm, self.source)
+            )
+            self.conn.execute(
+                "INSERT INTO runs VALUES (?,?,?,?,?,?,strftime('%s','now'))",
+                (self.vm, self.source, snapshot, archive, kind, self.files)
+            )
+
+    def close(self):
+        try: self.conn.close()
+        except: pass
+
+class ManifestStore:
+    """VM ve kaynak yolu bazında dosya manifest'leri (SQLite, /app/data altında)"""
+
+    def __init__(self, db_path=MANIFEST_DB_PATH):
+        self.db_path = db_path
+
+    @staticmethod
+    def scope(repository, target):
+        """PBS deposu + uzak hedef klasör: zincirler farklı klasörler / depolar arasında karışmaz"""
+        return f"{repository}|{target}|"
+
+    @staticmethod
+    def source_key(scope, drive_name, partition, paths):
+        return f"{scope}{drive_name}:p{partition}:" + ",".join(sorted(paths))
+
+    def begin(self, vm, source):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        return ManifestScan(self.db_path, vm, source)
+
+    def runs(self, vm=None, limit=50, scope=None):
+        if not os.path.exists(self.db_path): return []
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.executescript(SCHEMA)
+            query = "SELECT vm, source, snapshot, archive, kind, files, created FROM runs"
+            where, args = [], ()
+            if vm:
+                where.append("vm=?")
+                args += (vm,)
+            if scope:
+                where.append("substr(source, 1, length(?))=?")
+                args += (scope, scope)
+            if where: query += " WHERE " + " AND ".join(where)
+            rows = conn.execute(query + " ORDER BY created DESC LIMIT ?", args + (limit,)).fetchall()
+        finally:
+            conn.close()
+        keys = ("vm", "source", "snapshot", "archive", "kind", "files", "created")
+        return [dict(zip(keys, r)) for r in rows]
+
+MANIFESTS = ManifestStore()
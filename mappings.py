@@ -0,0 +1,69 @@
+"""
+PbSync'in host üzerinde map ettiği loop cihazlarının kalıcı kaydı.
+
+Her map edilen loop, backing dosyasıyla birlikte /app/data/mappings.json dosyasına yazılır ve
+serbest bırakılınca silinir. Açılış temizliği sadece burada kayıtlı olan ve backing dosyası hâlâ
+aynı olan loop'lara dokunur; host üzerindeki diğer loop, device-mapper ve LVM cihazları etkilenmez.
+"""
+import json
+import os
+import threading
+
+# --- Constants ---
+MAPPINGS_PATH = "/app/data/mappings.json"
+
+def backing_file(loop_dev):
+    """Loop cihazının backing dosyası (sysfs); görünmüyorsa veya loop boşsa None"""
+    try:
+        with open(f"/sys/class/block/{os.path.basename(loop_dev)}/loop/backing_file") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+class MappingRegistry:
+    def __init__(self, path=MAPPINGS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Mapping registry save failed: {e}")
+
+    def add(self, loop_dev, snapshot):
+        with self._lock:
+            entries = self._load()
+            entries[loop_dev] = {"snapshot": snapshot, "backing": backing_file(loop_dev)}
+            self._save(entries)
+
+    def remove(self, loop_dev):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(loop_dev, None) is not None: self._save(entries)
+
+    def owned(self):
+        """
+        Önceki çalışmadan kalan ve hâlâ PbSync'e ait olan loop'lar.
+        Boşalmış veya başka bir backing dosyasıyla yeniden kullanılmış loop'ların kaydı sessizce düşürülür.
+        """
+        with self._lock:
+            entries = self._load()
+            owned = [loop for loop, entry in entries.items() if backing_file(loop) == entry.get("backing")]
+            stale = [loop for loop in entries if loop not in owned]
+            for loop in stale: del entries[loop]
+            if stale: self._save(entries)
+            return owned
+
+MAPPINGS = MappingRegistry()
@@ -0,0 +1,204 @@
+"""
+Süreç içi metrikler ve Prometheus metin formatı (GET /metrics).
+
+Aşama süreleri (map, loop, kpartx/LVM, aday tespiti, mount, boyut, pipeline) histogram olarak,
+host komutları ve pipeline aşamalarının taşıdığı byte'lar sayaç olarak tutulur.
+Bir iş thread'i track(timings) ile işaretlenirse aynı ölçümler işin kendi StageTimings özetine de yazılır;
+gezgin gibi iş dışı çağrılar sadece süreç geneli metriklere girer.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Constants ---
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 7200)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _number(value):
+    if value == float("inf"): return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}  # sıralı etiket tuple'ı -> değer
+        self._lock = threading.Lock()
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_number(value)}" for key, value in items]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+class Gauge(_Metric):
+    """fn verilirse değer her okumada fn()'den alınır (kuyruk uzunluğu, açık oturum sayısı gibi)"""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn=None):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def _samples(self):
+        if self.fn is None: return super()._samples()
+        try: value = self.fn()
+        except Exception: return []
+        return [f"{self.name} {_number(value)}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DURATION_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        slot = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][slot] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, n)) for key, (counts, total, n) in self._values.items())
+        lines = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self._register(Counter(name, help))
+
+    def gauge(self, name, help, fn=None):
+        return self._register(Gauge(name, help, fn))
+
+    def histogram(self, name, help, buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, help, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics: lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class StageTimings:
+    """Tek bir işin aşama süreleri ve host komut sayısı; tekrarlanan aşamaların süreleri toplanır"""
+
+    def __init__(self):
+        self.stages = {}  # stage -> saniye
+        self.host_commands = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count_host(self, n):
+        with self._lock:
+            self.host_commands += n
+
+    def to_dict(self):
+        with self._lock:
+            return {"stages": {s: round(v, 3) for s, v in self.stages.items()}, "host_commands": self.host_commands}
+
+    def summary(self):
+        data = self.to_dict()
+        parts = [f"{stage} {seconds:.2f}s" for stage, seconds in data["stages"].items()]
+        return f"{', '.join(parts) or '-'} ({data['host_commands']} host commands)"
+
+METRICS = Registry()
+STAGE_SECONDS = METRICS.histogram("pbsync_stage_duration_seconds", "Duration of backup/explore stages.")
+HOST_COMMANDS = METRICS.counter("pbsync_host_commands_total", "Commands executed on the host, by transport and result.")
+HOST_ROUNDTRIP_SECONDS = METRICS.histogram("pbsync_host_roundtrip_seconds", "Duration of one host round-trip (single command or batch).")
+PIPELINE_BYTES = METRICS.counter("pbsync_pipeline_bytes_total", "Bytes moved by each pipeline stage (read, compressed, uploaded).")
+PIPELINE_WAIT_SECONDS = METRICS.counter("pbsync_pipeline_wait_seconds_total", "Time the pipeline relays spent waiting on each stage.")
+PIPELINE_STALLS = METRICS.counter("pbsync_pipeline_stalls_total", "Jobs aborted because a pipeline stage made no progress.")
+JOBS_FINISHED = METRICS.counter("pbsync_jobs_total", "Finished backup jobs, by mode and final status.")
+JOB_SECONDS = METRICS.histogram("pbsync_job_duration_seconds", "Wall time of finished backup jobs.")
+
+_current = threading.local()
+
+@contextmanager
+def track(timings):
+    """Bu thread'deki ölçümleri ayrıca timings'e (işin StageTimings'i) yazar"""
+    previous = getattr(_current, "timings", None)
+    _current.timings = timings
+    try:
+        yield timings
+    finally:
+        _current.timings = previous
+
+def current():
+    return getattr(_current, "timings", None)
+
+def record_stage(stage, seconds, timings=None):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if timings is None: timings = current()
+    if timings is not None: timings.add(stage, seconds)
+
+@contextmanager
+def timed(stage, timings=None):
+    """Bloğun (veya dekore edilen fonksiyonun) süresini aşama histogramına ve işin özetine ekler"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.monotonic() - start, timings)
+
+def record_host_commands(results, transport, seconds):
+    """Bir host round-trip'inin sonuçlarını sayar (returncode != 0 olanlar error)"""
+    failed = sum(1 for r in results if r.returncode != 0)
+    if len(results) > failed: HOST_COMMANDS.inc(len(results) - failed, transport=transport, status="ok")
+    if failed: HOST_COMMANDS.inc(failed, transport=transport, status="error")
+    HOST_ROUNDTRIP_SECONDS.observe(seconds, transport=transport)
+    timings = current()
+    if timings is not None: timings.count_host(len(results))
@@ -0,0 +1,141 @@
+"""
+Sparse-aware ham disk imajı akışı (PBSRAW formatı).
+
+Blok cihazı büyük bir tamponla sıralı okunur; tamamen sıfır olan bloklar veri olarak yazılmaz,
+HOLE kaydı olarak işaretlenir. Çıktı sıkıştırıcıya / rclone'a stream edilir.
+
+Format (big-endian):
+    MAGIC(8) | device_size(Q) | block_size(I)
+    kayıtlar: kind(B) | offset(Q) | length(Q) [+ DATA ise length byte veri]
+    kind: 1=DATA, 2=HOLE, 0=END (END kaydında length = toplam veri byte'ı)
+
+Geri yükleme:
+    zstd -dc vm.pbsraw.zst | python rawimage.py extract disk.img
+"""
+import os
+import struct
+import sys
+
+# --- Constants ---
+MAGIC = b"PBSRAW01"
+BLOCK_SIZE = 64 * 1024          # sıfır tespiti granülaritesi
+READ_SIZE = 8 * 1024 * 1024     # tek okuma (ve tek DATA kaydı) için en büyük boyut
+HEADER = struct.Struct(">8sQI")
+RECORD = struct.Struct(">BQQ")
+KIND_END, KIND_DATA, KIND_HOLE = 0, 1, 2
+
+ZERO_BLOCK = bytes(BLOCK_SIZE)
+
+class RawImageStats:
+    """Okunan / yazılan / atlanan byte sayaçları; ilerleme takibi için başka thread'den okunur"""
+
+    def __init__(self):
+        self.device_size = 0
+        self.bytes_scanned = 0
+        self.bytes_data = 0
+        self.bytes_sparse = 0
+
+def device_size(path):
+    fd = os.open(path, os.O_RDONLY)
+    try: return os.lseek(fd, 0, os.SEEK_END)
+    finally: os.close(fd)
+
+def _runs(buf, length):
+    """Tampon içindeki ardışık (is_zero, start, end) bloklarını döner"""
+    start, current = 0, None
+    for i in range(0, length, BLOCK_SIZE):
+        n = min(BLOCK_SIZE, length - i)
+        is_zero = buf.startswith(ZERO_BLOCK if n == BLOCK_SIZE else ZERO_BLOCK[:n], i)
+        if current is None:
+            current = is_zero
+        elif is_zero != current:
+            yield current, start, i
+            start, current = i, is_zero
+    if current is not None:
+        yield current, start, length
+
+def write_sparse_stream(src_path, out, stats=None, cancelled=None):
+    """
+    src_path'i okuyup PBSRAW akışını out'a (yazılabilir dosya nesnesi) yazar.
+    cancelled() doğru dönerse okuma yarıda kesilir ve InterruptedError fırlatılır.
+    """
+    stats = stats or RawImageStats()
+    fd = os.open(src_path, os.O_RDONLY)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+        os.lseek(fd, 0, os.SEEK_SET)
+        stats.device_size = size
+        # Kernel readahead penceresini büyütür (sıralı okuma ipucu)
+        try: os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except (AttributeError, OSError): pass
+
+        out.write(HEADER.pack(MAGIC, size, BLOCK_SIZE))
+        buf = bytearray(READ_SIZE)
+        view = memoryview(buf)
+        offset = 0
+        hole_start = None
+
+        while offset < size:
+            if cancelled is not None and cancelled(): raise InterruptedError("Raw stream cancelled.")
+            n = os.readv(fd, [view[:min(READ_SIZE, size - offset)]])
+            if n <= 0: break
+            for is_zero, start, end in _runs(buf, n):
+                if is_zero:
+                    if hole_start is None: hole_start = offset + start
+                    stats.bytes_sparse += end - start
+                    continue
+                if hole_start is not None:
+                    out.write(RECORD.pack(KIND_HOLE, hole_start, offset + start - hole_start))
+                    hole_start = None
+                out.write(RECORD.pack(KIND_DATA, offset + start, end - start))
+                out.write(view[start:end])
+                stats.bytes_data += end - start
+            offset += n
+            stats.bytes_scanned = offset
+
+        if hole_start is not None:
+            out.write(RECORD.pack(KIND_HOLE, hole_start, offset - hole_start))
+        out.write(RECORD.pack(KIND_END, offset, stats.bytes_data))
+        out.flush()
+        return stats
+    finally:
+        os.close(fd)
+
+def _read_exact(inp, n):
+    data = inp.read(n)
+    if len(data) != n: raise EOFError("Truncated PBSRAW stream")
+    return data
+
+def extract(inp, out_path, write_zeros=False):
+    """
+    PBSRAW akışını out_path'e açar. Normal dosyada HOLE'lar sparse bırakılır;
+    blok cihazına yazarken hedef sıfırlanmış değilse write_zeros=True kullanın.
+    """
+    magic, size, block_size = HEADER.unpack(_read_exact(inp, HEADER.size))
+    if magic != MAGIC: raise ValueError("Not a PBSRAW stream")
+    zero = bytes(READ_SIZE)
+    with open(out_path, "r+b" if os.path.exists(out_path) else "wb") as out:
+        while True:
+            kind, offset, length = RECORD.unpack(_read_exact(inp, RECORD.size))
+            if kind == KIND_END: break
+            out.seek(offset)
+            if kind == KIND_DATA:
+                remaining = length
+                while remaining:
+                    chunk = _read_exact(inp, min(remaining, READ_SIZE))
+                    out.write(chunk)
+                    remaining -= len(chunk)
+            elif write_zeros:
+                remaining = length
+                while remaining:
+                    step = min(remaining, READ_SIZE)
+                    out.write(zero[:step])
+                    remaining -= step
+        if os.path.isfile(out_path): out.truncate(size)
+    return size
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "extract":
+        print("usage: python rawimage.py extract <output> [--write-zeros] < image.pbsraw", file=sys.stderr)
+        sys.exit(2)
+    extract(sys.stdin.buffer, sys.argv[2], write_zeros="--write-zeros" in sys.argv)
@@ -0,0 +1,64 @@
+import os
+import time
+
+from metrics import record_stage
+
+# --- Constants ---
+# Aşama başına en fazla bekleme süresi (saniye)
+STAGE_TIMEOUTS = {
+    "loop": 10,
+    "partitions": 10,
+    "lvm": 15,
+}
+POLL_INITIAL = 0.02
+POLL_MAX = 0.5
+
+class ReadinessReport:
+    """Her aşamanın gerçekte ne kadar beklediğini ve zaman aşımına uğrayıp uğramadığını tutar"""
+
+    def __init__(self):
+        self.stages = {}  # stage -> {"waited": saniye, "polls": n, "ready": bool}
+
+    def record(self, stage, waited, polls, ready):
+        self.stages[stage] = {"waited": round(waited, 3), "polls": polls, "ready": ready}
+
+    def summary(self):
+        parts = []
+        for stage, info in self.stages.items():
+            mark = "" if info["ready"] else " TIMEOUT"
+            parts.append(f"{stage} {info['waited']:.2f}s{mark}")
+        return ", ".join(parts)
+
+def wait_until(stage, probe, report=None, timeout=None):
+    """
+    probe() doğru (truthy) bir değer dönene kadar artan aralıklarla yoklar.
+    Cihaz zaten hazırsa hiç beklemeden döner. Zaman aşımında son probe değerini döner.
+    """
+    if timeout is None: timeout = STAGE_TIMEOUTS.get(stage, 10)
+    start = time.monotonic()
+    delay = POLL_INITIAL
+    polls = 0
+    while True:
+        polls += 1
+        try: value = probe()
+        except Exception: value = None
+        waited = time.monotonic() - start
+        if value or waited >= timeout:
+            if report is not None: report.record(stage, waited, polls, bool(value))
+            record_stage(stage, waited)
+            return value
+        time.sleep(min(delay, max(timeout - waited, 0)))
+        delay = min(delay * 2, POLL_MAX)
+
+def loop_attached(loop_dev):
+    """Loop cihazının bir backing dosyasına bağlanıp boyut kazandığını kontrol eder"""
+    name = os.path.basename(loop_dev)
+    try:
+        with open(f"/sys/class/block/{name}/size") as f:
+            return int(f.read().strip() or 0) > 0
+    except OSError:
+        # sysfs görünmüyorsa cihaz düğümünün varlığı ile yetiniyoruz
+        return os.path.exists(loop_dev)
+
+def nodes_exist(paths):
+    return all(os.path.exists(p) for p in paths)
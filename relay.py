@@ -0,0 +1,188 @@
+"""
+Pipeline aşamaları arasında süreç içi aktarım (kaynak -> sıkıştırıcı -> yükleyici).
+
+Her aşama sınırında bir Relay thread'i veriyi bir pipe'tan diğerine taşır: Linux'ta os.splice ile
+(kullanıcı alanına kopya yok), değilse tekrar kullanılan tek bir tampon ile. Relay taşıdığı byte'ı ve
+girdi beklerken (üst aşama yavaş) / çıktı beklerken (alt aşama yavaş) geçen süreyi sayar.
+StallWatchdog hiçbir sayaç ilerlemezse, relay durumlarından duran aşamayı bulup işi sonlandırır.
+"""
+import errno
+import os
+import select
+import threading
+import time
+
+# --- Constants ---
+RELAY_BUFFER = int(os.environ.get("PBSYNC_RELAY_BUFFER_KB", "1024")) * 1024
+PIPE_SIZE = 1024 * 1024  # /proc/sys/fs/pipe-max-size varsayılanı
+STALL_TIMEOUT = float(os.environ.get("PBSYNC_STALL_TIMEOUT", "600"))  # saniye; 0: kapalı
+POLL_INTERVAL_MS = 1000
+
+class PipelineStalled(Exception):
+    def __init__(self, stage, seconds):
+        super().__init__(f"Pipeline stalled: {stage} stage made no progress for {int(seconds)}s")
+        self.stage = stage
+        self.seconds = seconds
+
+def enlarge_pipe(fd, size=PIPE_SIZE):
+    """Pipe kapasitesini büyütür (varsayılan 64 KB); pipe değilse veya sınır aşılırsa sessizce geçer"""
+    try:
+        import fcntl
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, size)
+    except (ImportError, AttributeError, OSError): pass
+
+class Relay:
+    """
+    src (okunabilir) -> dst (yazılabilir) aktarımı. src/dst dosya nesneleridir; relay bitince ikisini de kapatır,
+    böylece alt aşama EOF, üst aşama (alt aşama öldüyse) EPIPE görür.
+    upstream / downstream: her iki taraftaki aşamanın adı (durma tespitinde suçlu aşama için).
+    """
+
+    def __init__(self, src, dst, upstream, downstream, buffer_size=RELAY_BUFFER):
+        self.src = src
+        self.dst = dst
+        self.upstream = upstream
+        self.downstream = downstream
+        self.buffer_size = buffer_size
+        self.bytes = 0
+        self.state = "idle"  # reading: girdi bekleniyor, writing: çıktı bekleniyor, done
+        self.waits = {"reading": 0.0, "writing": 0.0}
+        self.error = None
+        self.broken = False  # alt aşama girdisini kapattı (kendi çıkış kodu ile raporlanır)
+        self.zero_copy = hasattr(os, "splice")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"pbsync-relay-{upstream}", daemon=True)
+
+    def start(self):
+        enlarge_pipe(self.src.fileno())
+        enlarge_pipe(self.dst.fileno())
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._copy(self.src.fileno(), self.dst.fileno())
+        except BrokenPipeError:
+            self.broken = True
+        except Exception as e:
+            self.error = e
+        finally:
+            self.state = "done"
+            for f in (self.dst, self.src):
+                try: f.close()
+                except: pass
+
+    def _wait(self, poller, state):
+        """poll ile bekler (durdurma isteğini görmek için kısa aralıklarla); durdurulduysa False"""
+        self.state = state
+        started = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                if poller.poll(POLL_INTERVAL_MS): return True
+            return False
+        finally:
+            self.waits[state] += time.monotonic() - started
+
+    def _copy(self, src, dst):
+        readable, writable = select.poll(), select.poll()
+        readable.register(src, select.POLLIN)
+        writable.register(dst, select.POLLOUT)
+        buffer = None
+        while self._wait(readable, "reading"):
+            if self.zero_copy:
+                if not self._wait(writable, "writing"): return
+                try:
+                    n = os.splice(src, dst, self.buffer_size, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    # splice desteklemeyen dosya türleri (pipe olmayan uçlar): tampon ile devam
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS): raise
+                    self.zero_copy = False
+                    continue
+                if n == 0: return
+                self.bytes += n
+                continue
+            if buffer is None: buffer = bytearray(self.buffer_size)
+            n = os.readv(src, [buffer])
+            if n == 0: return
+            view = memoryview(buffer)[:n]
+            while view:
+                if not self._wait(writable, "writing"): return
+                written = os.write(dst, view)
+                view = view[written:]
+                self.bytes += written
+
+def stage_waits(relays):
+    """
+    Aşama başına bekleme süresi: relay girdi bekliyorsa üst aşama, çıktı bekliyorsa alt aşama yavaştır.
+    Ortadaki aşamayı iki relay aynı anda bekler; çift saymamak için büyüğü alınır.
+    """
+    waits = {}
+    for r in relays:
+        waits[r.upstream] = max(waits.get(r.upstream, 0.0), r.waits["reading"])
+        waits[r.downstream] = max(waits.get(r.downstream, 0.0), r.waits["writing"])
+    return waits
+
+def culprit(relays):
+    """
+    Akış durduğunda sorumlu aşama. Son relay çıktı bekliyorsa yükleyici; değilse girdi bekleyen ilk relay'in
+    üst aşaması (sıkıştırıcı durursa ondan sonraki relay girdi bekler); hiçbiri yoksa çıktı beklenen aşama.
+    """
+    if relays[-1].state == "writing": return relays[-1].downstream
+    for r in relays:
+        if r.state == "reading": return r.upstream
+    for r in relays:
+        if r.state == "writing": return r.downstream
+    return relays[-1].downstream  # tüm veri aktarıldı; yükleyici bitiremiyor
+
+class StallWatchdog:
+    """
+    Relay sayaçları ve probes (örn. yüklenen byte) timeout saniye boyunca hiç değişmezse
+    duran aşamayı belirler, relay'leri durdurur ve on_stall(PipelineStalled) çağırır.
+    """
+
+    def __init__(self, relays, timeout=STALL_TIMEOUT, on_stall=None, probes=()):
+        self.relays = relays
+        self.timeout = timeout
+        self.on_stall = on_stall
+        self.probes = list(probes)
+        self.stalled = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.timeout > 0 and self.relays:
+            self._thread = threading.Thread(target=self._run, name="pbsync-watchdog", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not None: self._thread.join()
+
+    def _signature(self):
+        values = [r.bytes for r in self.relays]
+        for probe in self.probes:
+            try: values.append(probe())
+            except: pass
+        return values
+
+    def _run(self):
+        last, changed = self._signature(), time.monotonic()
+        while not self._done.wait(min(1.0, self.timeout / 4)):
+            current, now = self._signature(), time.monotonic()
+            if current != last:
+                last, changed = current, now
+                continue
+            if now - changed < self.timeout: continue
+            self.stalled = PipelineStalled(culprit(self.relays), now - changed)
+            for r in self.relays: r.stop()
+            if self.on_stall is not None: self.on_stall(self.stalled)
+            return
@@ -0,0 +1,177 @@
+"""
+Hedef klasördeki eski yedeklerin budanması.
+
+Klasör tek bir `rclone lsjson` ile listelenir. Aynı `{vmid}_{zaman damgası}` önekini taşıyan her şey
+(arşiv, .idx indeksi, .incr.deleted listesi, parçalı yüklemenin .parts klasörü) bir yedek setidir.
+Her VM için kurallar (son N, günlük, haftalık, aylık) yeniden eskiye uygulanır; herhangi bir kuralın tuttuğu set
+kalır. Tutulan artımlı bir setin zincirindeki (bir önceki tam sete kadar) setler de korunur.
+Silinecek dosyalar tek bir `rclone delete --files-from-raw` çağrısında (DELETE_BATCH'lik gruplar halinde),
+.parts klasörleri `rclone purge` ile silinir. Dedup deposundaki recipe'ler bu budamaya dahil değildir.
+
+    python retention.py remote:klasor --keep-last 7 --keep-weekly 4 [--apply]
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# --- Constants ---
+DELETE_BATCH = 1000
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"  # core.run_backup_process'in arşiv adındaki zaman damgası
+SET_PATTERN = re.compile(r"^(?P<vmid>[^_/]+)_(?P<ts>\d{8}-\d{6})(?P<rest>[._].*)?$")
+RULES = ("keep_last", "keep_daily", "keep_weekly", "keep_monthly")
+
+class RetentionPolicy:
+    """Kurallar 0 ise o kural kapalıdır; tüm kurallar kapalıysa hiçbir şey silinmez"""
+
+    def __init__(self, keep_last=0, keep_daily=0, keep_weekly=0, keep_monthly=0):
+        self.keep_last = int(keep_last or 0)
+        self.keep_daily = int(keep_daily or 0)
+        self.keep_weekly = int(keep_weekly or 0)
+        self.keep_monthly = int(keep_monthly or 0)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{rule: (data or {}).get(rule, 0) for rule in RULES})
+
+    def to_dict(self):
+        return {rule: getattr(self, rule) for rule in RULES}
+
+    @property
+    def enabled(self):
+        return any(getattr(self, rule) > 0 for rule in RULES)
+
+    def merge(self, other):
+        """Aynı VM'e birden çok politika denk gelirse her kuralın büyüğü geçerlidir (daha çok tutan kazanır)"""
+        return RetentionPolicy(**{rule: max(getattr(self, rule), getattr(other, rule)) for rule in RULES})
+
+class BackupSet:
+    def __init__(self, vmid, timestamp):
+        self.vmid = vmid
+        self.timestamp = timestamp
+        self.time = time.mktime(time.strptime(timestamp, TIMESTAMP_FORMAT))
+        self.files = []  # klasöre göre yol
+        self.dirs = []   # .parts klasörleri
+        self.size = 0
+        self.incremental = True  # sadece .incr.* girdileri varsa artımlı
+
+    @property
+    def prefix(self):
+        return f"{self.vmid}_{self.timestamp}"
+
+    def add(self, item, rest):
+        if item.get("IsDir"): self.dirs.append(item["Path"])
+        else:
+            self.files.append(item["Path"])
+            self.size += max(item.get("Size", 0), 0)
+        if not rest.startswith(".incr."): self.incremental = False
+
+def group_sets(listing):
+    """lsjson çıktısı -> {vmid: [BackupSet, ...] yeniden eskiye}; yedek adına uymayan girdiler atlanır"""
+    sets = {}
+    for item in listing:
+        match = SET_PATTERN.match(item.get("Name") or item.get("Path", ""))
+        if not match: continue
+        try:
+            key = (match["vmid"], match["ts"])
+            backup_set = sets.get(key) or sets.setdefault(key, BackupSet(*key))
+        except ValueError: continue  # geçersiz tarih
+        backup_set.add(item, match["rest"] or "")
+    by_vm = {}
+    for backup_set in sets.values(): by_vm.setdefault(backup_set.vmid, []).append(backup_set)
+    for vm_sets in by_vm.values(): vm_sets.sort(key=lambda s: s.timestamp, reverse=True)
+    return by_vm
+
+def _bucket(rule, t):
+    tm = time.localtime(t)
+    if rule == "keep_daily": return (tm.tm_year, tm.tm_yday)
+    if rule == "keep_weekly": return datetime.fromtimestamp(t).isocalendar()[:2]
+    return (tm.tm_year, tm.tm_mon)
+
+def select_keep(sets, policy, full=(), protect=()):
+    """
+    sets: bir VM'in setleri (yeniden eskiye). Dönen sözlük: tutulan set öneki -> nedenler.
+    full: artımlı adı taşısa da tam olduğu bilinen setler (manifest'siz ilk artımlı çalıştırma).
+    protect: asla silinmeyecek setler (örn. hâlâ yüklenen işin arşivi).
+    """
+    reasons = {}
+    if not policy.enabled:
+        return {s.prefix: ["no rules"] for s in sets}
+    for i, s in enumerate(sets):
+        if i < policy.keep_last: reasons.setdefault(s.prefix, []).append("last")
+    for rule in ("keep_daily", "keep_weekly", "keep_monthly"):
+        limit, seen = getattr(policy, rule), set()
+        if limit <= 0: continue
+        for s in sets:
+            bucket = _bucket(rule, s.time)
+            if bucket in seen: continue
+            seen.add(bucket)
+            if len(seen) > limit: break
+            reasons.setdefault(s.prefix, []).append(rule[5:])
+    for s in sets:
+        if s.prefix in protect: reasons.setdefault(s.prefix, []).append("active")
+    # Artımlı setler bir önceki tam sete kadar tüm zincire ihtiyaç duyar
+    for i, s in enumerate(sets):
+        if s.prefix not in reasons or not s.incremental or s.prefix in full: continue
+        for older in sets[i + 1:]:
+            if "chain" not in reasons.get(older.prefix, []): reasons.setdefault(older.prefix, []).append("chain")
+            if not older.incremental or older.prefix in full: break
+    return reasons
+
+def plan(listing, policies, full=(), protect=()):
+    """
+    policies: {vmid: RetentionPolicy}; "*" anahtarı listede olmayan tüm VM'lere uygulanır.
+    Dönen plan: {"keep": [...], "delete": [set önekleri], "files": [...], "dirs": [...], "bytes": n}
+    """
+    result = {"keep": [], "delete": [], "files": [], "dirs": [], "bytes": 0}
+    for vmid, sets in sorted(group_sets(listing).items()):
+        policy = policies.get(vmid) or policies.get("*")
+        if policy is None: continue
+        kept = select_keep(sets, policy, full, protect)
+        for s in sets:
+            if s.prefix in kept:
+                result["keep"].append({"set": s.prefix, "reasons": kept[s.prefix]})
+                continue
+            result["delete"].append(s.prefix)
+            result["files"].extend(s.files)
+            result["dirs"].extend(s.dirs)
+            result["bytes"] += s.size
+    return result
+
+def _rclone(args, data=None, env=None):
+    result = subprocess.run(["rclone"] + args, input=data, capture_output=True, env=env)
+    if result.returncode != 0:
+        raise Exception(f"rclone {args[0]} failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+def prune_folder(folder, policies, dry_run=False, full=(), protect=(), log=print, env=None):
+    """Klasörü bir kez listeler, planı çıkarır ve (dry_run değilse) toplu siler"""
+    listing = json.loads(_rclone(["lsjson", folder], env=env) or b"[]")
+    result = plan(listing, policies, full, protect)
+    log(f"Retention {folder}: {len(result['keep'])} sets kept, {len(result['delete'])} to delete "
+        f"({len(result['files'])} files, {len(result['dirs'])} dirs, {result['bytes']} bytes)")
+    calls = 1
+    if not dry_run:
+        files = result["files"]
+        for start in range(0, len(files), DELETE_BATCH):
+            batch = files[start:start + DELETE_BATCH]
+            _rclone(["delete", folder, "--files-from-raw", "-"], "".join(p + "\n" for p in batch).encode(), env)
+            calls += 1
+        for path in result["dirs"]:
+            _rclone(["purge", f"{folder.rstrip('/')}/{path}"], env=env)
+            calls += 1
+    return {**result, "folder": folder, "dry_run": dry_run, "rclone_calls": calls}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune old PbSync backup sets in a remote folder")
+    parser.add_argument("folder")
+    for rule in RULES: parser.add_argument("--" + rule.replace("_", "-"), type=int, default=0)
+    parser.add_argument("--apply", action="store_true", help="delete (default: dry run)")
+    args = parser.parse_args()
+    rules = RetentionPolicy(**{rule: getattr(args, rule) for rule in RULES})
+    out = prune_folder(args.folder, {"*": rules}, dry_run=not args.apply, log=lambda m: print(m, file=sys.stderr))
+    json.dump({k: out[k] for k in ("keep", "delete", "bytes", "rclone_calls")}, sys.stdout, indent=1)
+    print()
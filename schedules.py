@@ -0,0 +1,393 @@
+"""
+Yerleşik zamanlayıcı ve tutma (retention) kuralları.
+
+Politikalar /app/data/schedules.json dosyasında tutulur. Her politikada bir cron ifadesi (dakika saat gün ay
+haftanın-günü veya @daily gibi kısaltmalar), bir VM seçicisi (vm/100, vm/*, 100; virgülle birden çok),
+hedef remote/klasör, iş seçenekleri ve tutma kuralları bulunur.
+Zamanı gelen politikada, seçiciye uyan her grubun en yeni snapshot'ı kuyruğa alınır. Her iş, 0..jitter saniye
+arası bir gecikmeyle başlar; gecikme politika, grup ve çalışma zamanına göre sabittir. Aynı anda en fazla
+MAX_SCHEDULED_JOBS zamanlanmış iş aktif olur. Politikanın işleri bitince, en az biri başarılıysa, hedef klasör
+budanır. Aynı klasörü paylaşan politikalar tek bir listelemeyle budanır (bkz. retention.py).
+Saat (clock) ve snapshot çözme / iş gönderme / budama fonksiyonları dışarıdan verilir. tick(now) deterministik
+olduğundan zamanlayıcı sahte bir saat ve yerel bir remote ile sınanabilir.
+"""
+import fnmatch
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from retention import RetentionPolicy
+
+# --- Constants ---
+SCHEDULES_PATH = "/app/data/schedules.json"
+TICK_SECONDS = 30
+MAX_SCHEDULED_JOBS = int(os.environ.get("PBSYNC_SCHEDULE_MAX_JOBS", "2"))
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))  # haftanın günü: 0 ve 7 pazar
+JOB_OPTIONS = ("mode", "codec", "level", "upload_mode", "source_paths", "drive_name", "partition_id")
+FINISHED_STATES = ("success", "failed", "cancelled")
+HISTORY_SIZE = 200
+
+def _parse_field(text, lo, hi):
+    values = set()
+    for part in text.split(","):
+        part, stepped, step = part.partition("/")
+        step = int(step) if stepped else 1
+        if step <= 0: raise ValueError(text)
+        if part in ("*", "?"): start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            # "5/15": 5'ten başlayıp 15'er
+            start = int(part)
+            end = hi if stepped else start
+        if not lo <= start <= end <= hi: raise ValueError(text)
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSpec:
+    """5 alanlı cron ifadesi; zamanlar yerel saate göre hesaplanır"""
+
+    def __init__(self, expr):
+        self.expr = expr.strip()
+        fields = CRON_ALIASES.get(self.expr, self.expr).split()
+        if len(fields) != 5: raise ValueError(f"Invalid cron expression: {expr}")
+        try:
+            parsed = [_parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, CRON_FIELDS)]
+        except ValueError:
+            raise ValueError(f"Invalid cron expression: {expr}")
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {d % 7 for d in weekdays}
+        # Standart cron: gün ve haftanın günü ikisi de kısıtlıysa birinin tutması yeter
+        self.any_day = fields[2] in ("*", "?")
+        self.any_weekday = fields[4] in ("*", "?")
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        if self.any_day and self.any_weekday: return True
+        if self.any_day: return weekday
+        if self.any_weekday: return day
+        return day or weekday
+
+    def next_after(self, ts):
+        """ts'den sonraki ilk eşleşen dakika (epoch)"""
+        dt = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError(f"Cron expression never fires: {self.expr}")
+
+def match_groups(selector, groups):
+    """Seçiciye uyan gruplar. '/' içermeyen desen sadece id ile eşleşir (100, 1*)"""
+    patterns = [p.strip() for p in (selector or "").split(",") if p.strip()]
+    return [g for g in groups
+            if any(fnmatch.fnmatchcase(g if "/" in p else g.split("/", 1)[-1], p) for p in patterns)]
+
+def jitter_delay(policy_id, group, fire_time, jitter):
+    """0..jitter saniye; aynı politika, grup ve çalışma için her seferinde aynı değer"""
+    if not jitter or jitter <= 0: return 0.0
+    return random.Random(f"{policy_id}|{group}|{int(fire_time)}").uniform(0, jitter)
+
+class Policy:
+    def __init__(self, id=None, name="", cron="@daily", selector="", remote="", target_folder="", jitter=0,
+                 enabled=True, skip_unchanged=True, options=None, retention=None, created=None, last_run=None,
+                 last_snapshots=None):
+        self.id = id or uuid.uuid4().hex[:8]
+        self.name = name or self.id
+        self.cron = CronSpec(cron)
+        self.selector = selector
+        self.remote = remote
+        self.target_folder = (target_folder or "").strip().strip("/")
+        self.jitter = max(0, int(jitter or 0))
+        self.enabled = bool(enabled)
+        self.skip_unchanged = bool(skip_unchanged)  # grubun snapshot'ı değişmediyse tekrar yedekleme
+        self.options = {k: v for k, v in (options or {}).items() if k in JOB_OPTIONS and v not in (None, "")}
+        self.retention = retention if isinstance(retention, RetentionPolicy) else RetentionPolicy.from_dict(retention)
+        self.created = created if created is not None else time.time()
+        self.last_run = last_run
+        self.last_snapshots = dict(last_snapshots or {})  # grup -> son başarılı yedeklenen snapshot
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{k: data.get(k) for k in ("id", "name", "cron", "selector", "remote", "target_folder", "jitter",
+                                               "options", "retention", "created", "last_run", "last_snapshots")},
+                   enabled=data.get("enabled", True), skip_unchanged=data.get("skip_unchanged", True))
+
+    def next_run(self):
+        return self.cron.next_after(self.last_run if self.last_run is not None else self.created)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "cron": self.cron.expr,
+            "selector": self.selector,
+            "remote": self.remote,
+            "target_folder": self.target_folder,
+            "jitter": self.jitter,
+            "enabled": self.enabled,
+            "skip_unchanged": self.skip_unchanged,
+            "options": self.options,
+            "retention": self.retention.to_dict(),
+            "created": self.created,
+            "last_run": self.last_run,
+            "last_snapshots": self.last_snapshots,
+        }
+
+class BackupScheduler:
+    """
+    resolve(policy) -> {grup: en yeni snapshot}
+    submit(policy, snapshot) -> BackupJob (status alanı izlenir)
+    prune(remote, target_folder, {vmid: RetentionPolicy}) -> budama sonucu
+    """
+
+    def __init__(self, resolve, submit, prune, path=SCHEDULES_PATH, clock=time.time, max_jobs=MAX_SCHEDULED_JOBS,
+                 log=print):
+        self.resolve = resolve
+        self.submit = submit
+        self.prune = prune
+        self.path = path
+        self.clock = clock
+        self.max_jobs = max_jobs
+        self.log = log
+        self.policies = None  # id -> Policy; ilk kullanımda dosyadan yüklenir
+        self.pending = []     # [zamanı, politika id, grup, snapshot] zamana göre sıralı
+        self.running = []     # [politika id, grup, snapshot, job]
+        self.firing = {}      # politika id -> başarılı iş sayısı (çalışma sürerken)
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Kalıcılık ---
+
+    def _load(self):
+        if self.policies is not None: return
+        self.policies = OrderedDict()
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for item in data.get("policies", []):
+            try:
+                policy = Policy.from_dict(item)
+                self.policies[policy.id] = policy
+            except Exception as e:
+                self.log(f"Schedule {item.get('id')} skipped: {e}")
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"policies": [p.to_dict() for p in self.policies.values()]}, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.log(f"Schedules not saved: {e}")
+
+    def _event(self, policy_id, msg, now=None):
+        self.history.append({"ts": now if now is not None else self.clock(), "policy": policy_id, "msg": msg})
+        self.log(f"[schedule {policy_id}] {msg}")
+
+    # --- Yönetim ---
+
+    def list(self):
+        with self._lock:
+            self._load()
+            result = []
+            for policy in self.policies.values():
+                try: next_run = policy.next_run() if policy.enabled else None
+                except ValueError: next_run = None
+                result.append({
+                    **policy.to_dict(),
+                    "next_run": next_run,
+                    "pending": sum(1 for p in self.pending if p[1] == policy.id),
+                    "running": [r[3].id for r in self.running if r[0] == policy.id],
+                })
+            return {"policies": result, "history": list(self.history)}
+
+    def upsert(self, data):
+        """Yeni politika ekler veya aynı id'li politikayı günceller (çalışma durumu korunur)"""
+        with self._lock:
+            self._load()
+            old = self.policies.get(data.get("id") or "")
+            if old is not None:
+                data = {**data, "created": old.created, "last_run": old.last_run, "last_snapshots": old.last_snapshots}
+            else:
+                data = {**data, "created": self.clock()}
+            policy = Policy.from_dict(data)
+            policy.next_run()  # hiç çalışmayacak ifadeleri (31 Şubat gibi) baştan reddet
+            self.policies[policy.id] = policy
+            self._save()
+            return policy
+
+    def delete(self, policy_id):
+        with self._lock:
+            self._load()
+            if self.policies.pop(policy_id, None) is None: return False
+            self.pending = [p for p in self.pending if p[1] != policy_id]
+            self._save()
+            return True
+
+    def run_now(self, policy_id):
+        """Politikayı zamanını beklemeden (jitter'sız) çalıştırır; kuyruğa alınan iş sayısını döner"""
+        with self._lock:
+            self._load()
+            policy = self.policies.get(policy_id)
+        if policy is None: return None
+        now = self.clock()
+        queued = self._fire(policy, now, now, jitter=False)
+        self.tick(now)
+        return queued
+
+    # --- Çalışma ---
+
+    def tick(self, now=None):
+        """Zamanı gelen politikaları tetikler, bitmiş işleri toplar, boş yer varsa bekleyen işleri başlatır"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            self._load()
+            due = []
+            for policy in self.policies.values():
+                if not policy.enabled: continue
+                try: fire_time = policy.next_run()
+                except ValueError: continue
+                if fire_time <= now: due.append((policy, fire_time))
+        # Snapshot çözümleme (PBS kataloğu) kilit dışında yapılır
+        for policy, fire_time in due: self._fire(policy, fire_time, now)
+        with self._lock:
+            folders = self._collect(now)
+            self._dispatch(now)
+        for remote, target_folder in folders: self._prune(remote, target_folder, now)
+
+    def _fire(self, policy, fire_time, now, jitter=True):
+        # Kapalıyken kaçırılan çalıştırmalar biriktirilmez; bir kez çalışılır
+        with self._lock:
+            policy.last_run = now
+            self._save()
+        try:
+            snapshots = self.resolve(policy)
+        except Exception as e:
+            self._event(policy.id, f"Snapshot lookup failed: {e}", now)
+            return 0
+        queued = 0
+        with self._lock:
+            for group, snapshot in sorted(snapshots.items()):
+                if not snapshot: continue
+                if policy.skip_unchanged and policy.last_snapshots.get(group) == snapshot:
+                    self._event(policy.id, f"{group}: {snapshot} already backed up, skipped", now)
+                    continue
+                if any(p[1] == policy.id and p[2] == group for p in self.pending) or \
+                   any(r[0] == policy.id and r[1] == group for r in self.running):
+                    continue
+                delay = jitter_delay(policy.id, group, fire_time, policy.jitter) if jitter else 0.0
+                self.pending.append([now + delay, policy.id, group, snapshot])
+                queued += 1
+            self.pending.sort(key=lambda p: p[0])
+            if queued: self.firing.setdefault(policy.id, 0)
+        self._event(policy.id, f"Fired: {queued} of {len(snapshots)} groups queued", now)
+        return queued
+
+    def _dispatch(self, now):
+        while self.pending and len(self.running) < self.max_jobs and self.pending[0][0] <= now:
+            _, policy_id, group, snapshot = self.pending.pop(0)
+            policy = self.policies.get(policy_id)
+            if policy is None: continue
+            try:
+                job = self.submit(policy, snapshot)
+            except Exception as e:
+                self._event(policy_id, f"{group}: submit failed: {e}", now)
+                continue
+            self.running.append([policy_id, group, snapshot, job])
+            self._event(policy_id, f"{group}: job {job.id} started for {snapshot}", now)
+
+    def _collect(self, now):
+        """Biten işleri kaydeder; işleri tamamlanan ve en az biri başarılı politikaların klasörlerini döner"""
+        changed = False
+        for entry in list(self.running):
+            policy_id, group, snapshot, job = entry
+            if job.status not in FINISHED_STATES: continue
+            self.running.remove(entry)
+            policy = self.policies.get(policy_id)
+            self._event(policy_id, f"{group}: job {job.id} {job.status}", now)
+            if policy is not None and job.status == "success":
+                policy.last_snapshots[group] = snapshot
+                self.firing[policy_id] = self.firing.get(policy_id, 0) + 1
+                changed = True
+        folders = []
+        for policy_id, succeeded in list(self.firing.items()):
+            if any(p[1] == policy_id for p in self.pending) or any(r[0] == policy_id for r in self.running): continue
+            del self.firing[policy_id]
+            policy = self.policies.get(policy_id)
+            if policy is None or not succeeded or not policy.retention.enabled: continue
+            folder = (policy.remote, policy.target_folder)
+            if folder not in folders: folders.append(folder)
+        if changed: self._save()
+        return folders
+
+    def folder_rules(self, remote, target_folder):
+        """Klasörü hedefleyen tüm politikaların kuralları VM id'sine göre (çakışmada daha çok tutan kazanır)"""
+        rules = {}
+        with self._lock:
+            self._load()
+            for policy in self.policies.values():
+                if (policy.remote, policy.target_folder) != (remote, target_folder) or not policy.retention.enabled:
+                    continue
+                for group in policy.last_snapshots:
+                    vmid = group.split("/")[-1]
+                    rules[vmid] = rules[vmid].merge(policy.retention) if vmid in rules else policy.retention
+        return rules
+
+    def _prune(self, remote, target_folder, now):
+        rules = self.folder_rules(remote, target_folder)
+        if not rules: return
+        try:
+            result = self.prune(remote, target_folder, rules)
+            self._event("retention", f"{remote}:{target_folder}: {len(result['delete'])} sets deleted, "
+                                     f"{len(result['keep'])} kept", now)
+        except Exception as e:
+            self._event("retention", f"{remote}:{target_folder}: prune failed: {e}", now)
+
+    def start(self):
+        if self._thread is not None: return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pbsync-schedules", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None: self._thread.join(5)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            try: self.tick()
+            except Exception as e: self.log(f"Scheduler tick failed: {e}")
+            # Jitter'lı işler TICK_SECONDS beklemeden zamanında başlasın
+            with self._lock:
+                wait = TICK_SECONDS
+                if self.pending: wait = min(wait, max(1.0, self.pending[0][0] - self.clock()))
+            if self._stop.wait(wait): return
@@ -0,0 +1,339 @@
+"""
+Aranabilir (seekable) arşiv formatı.
+
+tar akışı sabit boyutlu parçalara (çerçeve) bölünür, her çerçeve bağımsız bir gzip üyesi olarak
+sıkıştırılır. Çok üyeli gzip standarttır; arşiv `tar -xzf` ile olduğu gibi açılır.
+Akış sırasında tar başlıkları okunur ve arşivin yanına <arşiv>.idx (gzip JSON) yüklenir:
+    frames: [[sıkıştırılmamış konum, sıkıştırılmış konum, sıkıştırılmış boyut], ...]
+    files:  [[yol, girdi konumu, veri konumu, boyut, tür], ...]
+Girdi konumu, dosyanın (varsa GNU uzun ad / pax kayıtları dahil) ilk tar kaydıdır; seçilen dosyaların
+[girdi, veri sonu) aralıkları art arda eklenince geçerli bir tar oluşur.
+Geri yüklemede sadece gereken çerçeveler `rclone cat --offset --count` ile indirilir.
+
+    python seekable.py ls remote:klasor/100_20240101-000000.tar.gz
+    python seekable.py extract remote:klasor/100_20240101-000000.tar.gz etc/fstab home/user > secim.tar
+"""
+import bisect
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Constants ---
+FRAME_SIZE = int(os.environ.get("PBSYNC_FRAME_MB", "4")) * 1024 * 1024
+FRAME_WORKERS = int(os.environ.get("PBSYNC_FRAME_WORKERS", str(os.cpu_count() or 1)))
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+INDEX_CACHE_MAX = 8
+BLOCK = 512
+SPECIAL_TYPES = (b"L", b"K", b"x", b"g")  # GNU uzun ad / bağlantı, pax başlıkları
+
+def _padded(size):
+    return (size + BLOCK - 1) // BLOCK * BLOCK
+
+def _number(field):
+    """tar sayı alanı: sekizlik metin veya (büyük dosyalarda) base-256"""
+    if field[:1] and field[0] & 0x80:
+        return int.from_bytes(field, "big") & ~(0x80 << 8 * (len(field) - 1))
+    field = field.strip(b"\0 ")
+    return int(field, 8) if field else 0
+
+def normalize_member(path):
+    """tar içindeki yolu karşılaştırma için sadeleştirir: ./etc/fstab -> etc/fstab"""
+    while path.startswith("./"): path = path[2:]
+    return path.strip("/") or "."
+
+class TarIndexer:
+    """
+    tar akışını ardışık parçalar halinde alır ve her girdinin konumunu çıkarır.
+    Veri bloklarına bakılmaz; sadece başlıklar (ve uzun ad / pax kayıtlarının içeriği) okunur.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.done = False
+        self._entry = 0        # bekleyen kaydın mutlak konumu
+        self._want = BLOCK     # bu kayıttan okunacak byte sayısı
+        self._buf = bytearray()
+        self._special = None   # (tür, boyut): uzun ad / pax içeriği bekleniyor
+        self._start = None     # uzun ad / pax kayıtları varsa dosyanın ilk kaydı
+        self._long_name = None
+        self._pax = {}
+
+    def feed(self, data, start):
+        end = start + len(data)
+        while not self.done:
+            at = self._entry + len(self._buf)
+            if at >= end: return
+            piece = data[at - start:at - start + self._want - len(self._buf)]
+            self._buf += piece
+            if len(self._buf) < self._want: return
+            record = bytes(self._buf)
+            self._buf.clear()
+            self._consume(record)
+
+    def _consume(self, record):
+        if self._special is not None:
+            kind, size = self._special
+            self._special = None
+            payload = record[:size]
+            if kind == b"L": self._long_name = payload.rstrip(b"\0")
+            elif kind == b"x": self._pax = self._pax_records(payload)
+            self._next(self._entry + len(record))
+            return
+        if not record.strip(b"\0"):
+            self.done = True  # arşiv sonu (sıfır blok)
+            return
+        name = record[0:100].rstrip(b"\0")
+        prefix = record[345:500].rstrip(b"\0")
+        if record[257:263] == b"ustar\0" and prefix: name = prefix + b"/" + name
+        size = _number(record[124:136])
+        kind = record[156:157]
+        if self._start is None: self._start = self._entry
+        data_offset = self._entry + BLOCK
+        if kind in SPECIAL_TYPES:
+            self._special = (kind, size)
+            self._entry, self._want = data_offset, _padded(size)
+            if self._want == 0: self._consume(b"")
+            return
+        # pax başlığı yol ve (8 GB üstü dosyalarda) boyut bilgisini ezer
+        if b"size" in self._pax: size = int(self._pax[b"size"])
+        path = os.fsdecode(self._pax.get(b"path") or self._long_name or name)
+        self.files.append([normalize_member(path), self._start, data_offset, size, (kind or b"0").decode(errors="replace")])
+        self._start = self._long_name = None
+        self._pax = {}
+        self._next(data_offset + _padded(size))
+
+    def _next(self, offset):
+        self._entry, self._want = offset, BLOCK
+
+    @staticmethod
+    def _pax_records(payload):
+        # "<uzunluk> anahtar=değer\n" kayıtları
+        records, pos = {}, 0
+        while pos < len(payload):
+            space = payload.find(b" ", pos)
+            if space < 0: break
+            try: length = int(payload[pos:space])
+            except ValueError: break
+            if length <= 0: break
+            key, _, value = payload[space + 1:pos + length - 1].partition(b"=")
+            records[key] = value
+            pos += length
+        return records
+
+def compress_frame(data, level):
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip başlığı ile
+    return c.compress(data) + c.flush()
+
+def _read_full(stream, size):
+    parts, got = [], 0
+    while got < size:
+        data = stream.read(size - got)
+        if not data: break
+        parts.append(data)
+        got += len(data)
+    return b"".join(parts)
+
+class SeekableWriter:
+    """Akışı çerçeveler halinde paralel sıkıştırıp sırayla out'a yazar; çerçeve ve dosya indeksini tutar"""
+
+    def __init__(self, level=1, frame_size=FRAME_SIZE, workers=FRAME_WORKERS):
+        self.level = level or 1
+        self.frame_size = frame_size
+        self.workers = max(1, workers)
+        self.indexer = TarIndexer()
+        self.frames = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def write(self, stream, out, cancelled=None):
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pbsync-frame") as pool:
+            while True:
+                if cancelled is not None and cancelled(): raise InterruptedError("Stream cancelled.")
+                data = _read_full(stream, self.frame_size)
+                if not data: break
+                self.indexer.feed(data, self.bytes_in)
+                pending.append((self.bytes_in, pool.submit(compress_frame, data, self.level)))
+                self.bytes_in += len(data)
+                # Sıkıştırılmış çerçeveler sırayla yazılır; bellekte en fazla 2 x worker çerçeve bekler
+                while len(pending) > self.workers * 2: self._flush(pending, out)
+            while pending: self._flush(pending, out)
+        out.flush()
+
+    def _flush(self, pending, out):
+        offset, future = pending.popleft()
+        member = future.result()
+        out.write(member)
+        self.frames.append([offset, self.bytes_out, len(member)])
+        self.bytes_out += len(member)
+
+    def index(self, metadata=None):
+        return {
+            "version": INDEX_VERSION,
+            "frame_size": self.frame_size,
+            "total_size": self.bytes_in,
+            "compressed_size": self.bytes_out,
+            "frames": self.frames,
+            "files": self.indexer.files,
+            **(metadata or {}),
+        }
+
+    def index_bytes(self, metadata=None):
+        return gzip.compress(json.dumps(self.index(metadata), separators=(",", ":")).encode(), 6)
+
+def write_tar(tar_cmd, out, writer, register_process=None, cancelled=None, stdin_data=None, env=None):
+    """tar'ı çalıştırıp çıktısını writer ile çerçeveler; tar 0/1 dışında bir kodla çıkarsa hata fırlatır"""
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(tar_cmd, stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=err, env=env)
+        if register_process is not None: register_process(proc)
+        feeder = None
+        if stdin_data is not None:
+            def feed():
+                try:
+                    with proc.stdin: proc.stdin.write(stdin_data)
+                except BrokenPipeError: pass
+            feeder = threading.Thread(target=feed, name="pbsync-tar-stdin", daemon=True)
+            feeder.start()
+        try:
+            writer.write(proc.stdout, out, cancelled)
+        finally:
+            proc.stdout.close()
+            if feeder is not None: feeder.join()
+            rc = proc.wait()
+        # tar için 1: bazı dosyalar okunurken değişti (uyarı)
+        if rc not in (0, 1):
+            err.seek(0)
+            raise Exception(f"tar exited with {rc}: {err.read().decode(errors='replace').strip()[-500:]}")
+
+# --- Okuma / geri yükleme ---
+
+_INDEXES = OrderedDict()
+_INDEX_LOCK = threading.Lock()
+
+def index_path(archive):
+    return archive + INDEX_SUFFIX
+
+def load_index(archive, env=None, timeout=None):
+    """
+    Arşivin indeksini indirir; arşivler değişmez olduğu için son birkaç indeks bellekte tutulur.
+    timeout aşılırsa rclone öldürülür ve subprocess.TimeoutExpired fırlatılır.
+    """
+    with _INDEX_LOCK:
+        if archive in _INDEXES:
+            _INDEXES.move_to_end(archive)
+            return _INDEXES[archive]
+    res = subprocess.run(["rclone", "cat", index_path(archive)], capture_output=True, env=env, timeout=timeout)
+    if res.returncode != 0:
+        raise FileNotFoundError(res.stderr.decode(errors="replace").strip() or f"No index for {archive}")
+    index = json.loads(gzip.decompress(res.stdout))
+    with _INDEX_LOCK:
+        _INDEXES[archive] = index
+        while len(_INDEXES) > INDEX_CACHE_MAX: _INDEXES.popitem(last=False)
+    return index
+
+def select(index, paths):
+    """İstenen yollar ve (klasörse) altındaki girdiler, arşiv sırasıyla"""
+    wanted = [normalize_member(p) for p in paths if p.strip()]
+    if not wanted or "." in wanted: return list(index["files"])
+    return [f for f in index["files"] if any(f[0] == w or f[0].startswith(w + "/") for w in wanted)]
+
+def _merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]: merged[-1][1] = max(merged[-1][1], end)
+        else: merged.append([start, end])
+    return merged
+
+def _kill_after(proc, timeout, expired):
+    """Okuma timeout saniyede bitmezse rclone'u öldürür; takılan remote worker thread'ini bloklamasın"""
+    if not timeout: return None
+    def kill():
+        expired.set()
+        proc.kill()
+    timer = threading.Timer(timeout, kill)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+def iter_ranges(archive, index, ranges, env=None, timeout=None):
+    """
+    Sıkıştırılmamış akıştaki [başlangıç, bitiş) aralıklarının byte'larını sırayla üretir.
+    Ardışık çerçeveler tek bir `rclone cat --offset --count` isteğiyle indirilir.
+    timeout: tek bir çerçevenin okunması için süre (istemcinin yavaş okuması sayılmaz).
+    """
+    ranges = [r for r in _merge(ranges) if r[1] > r[0]]
+    frames = index["frames"]
+    starts = [f[0] for f in frames]
+    needed = []
+    for start, end in ranges:
+        first = max(bisect.bisect_right(starts, start) - 1, 0)
+        last = bisect.bisect_right(starts, end - 1) - 1
+        for i in range(max(first, needed[-1] + 1 if needed else 0), last + 1): needed.append(i)
+    runs = []
+    for i in needed:
+        if runs and runs[-1][-1] == i - 1: runs[-1].append(i)
+        else: runs.append([i])
+
+    r = 0
+    for run in runs:
+        offset = frames[run[0]][1]
+        count = sum(frames[i][2] for i in run)
+        proc = subprocess.Popen(["rclone", "cat", archive, "--offset", str(offset), "--count", str(count)],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        complete = False
+        expired = threading.Event()
+        try:
+            for i in run:
+                timer = _kill_after(proc, timeout, expired)
+                try: member = _read_full(proc.stdout, frames[i][2])
+                finally:
+                    if timer is not None: timer.cancel()
+                if expired.is_set(): raise Exception(f"Timed out reading frame {i} of {archive} after {timeout}s")
+                if len(member) != frames[i][2]: raise Exception(f"Short read in frame {i} of {archive}")
+                data = zlib.decompress(member, 31)
+                lo = frames[i][0]
+                hi = lo + len(data)
+                while r < len(ranges) and ranges[r][1] <= lo: r += 1
+                j = r
+                while j < len(ranges) and ranges[j][0] < hi:
+                    yield data[max(ranges[j][0], lo) - lo:min(ranges[j][1], hi) - lo]
+                    j += 1
+            complete = True
+        finally:
+            # İstemci yarıda koparsa (üreteç kapatılırsa) rclone'u beklemeden sonlandırıyoruz
+            if not complete: proc.kill()
+            proc.stdout.close()
+            proc.wait()
+            err = proc.stderr.read()
+            proc.stderr.close()
+        if proc.returncode != 0:
+            raise Exception(err.decode(errors="replace").strip() or f"rclone cat failed for {archive}")
+
+def iter_tar(archive, index, entries, env=None, timeout=None):
+    """Seçilen girdilerden geçerli bir tar akışı üretir (orijinal başlıklar aynen kullanılır)"""
+    yield from iter_ranges(archive, index, [(e[1], e[2] + _padded(e[3])) for e in entries], env, timeout)
+    yield bytes(2 * BLOCK)
+
+def iter_file(archive, index, entry, env=None, timeout=None):
+    """Tek bir normal dosyanın içeriği"""
+    yield from iter_ranges(archive, index, [(entry[2], entry[2] + entry[3])], env, timeout)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("ls", "extract"):
+        print("usage: python seekable.py ls <remote:archive.tar.gz>\n"
+              "       python seekable.py extract <remote:archive.tar.gz> [path ...] > selection.tar", file=sys.stderr)
+        sys.exit(2)
+    idx = load_index(sys.argv[2])
+    if sys.argv[1] == "ls":
+        for path, _, _, size, kind in idx["files"]: print(f"{kind} {size:>14} {path}")
+    else:
+        for chunk in iter_tar(sys.argv[2], idx, select(idx, sys.argv[3:])): sys.stdout.buffer.write(chunk)
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import core
+from config import Config
+from layout import LAYOUTS
+
+# --- Constants ---
+SESSION_ROOT = "/mnt/pbsync_sessions"
+SESSION_IDLE_TTL = 300      # saniye; bu süre dokunulmayan oturum kapatılır
+SESSION_MAX_OPEN = 2        # aynı anda açık tutulacak en fazla snapshot
+REAPER_INTERVAL = 30
+SESSION_CLOSE_WAIT = 60     # saniye; kullanımdaki oturum kapatılırken isteklerin bitmesi için beklenen en uzun süre
+
+class MountSession:
+    """
+    Map edilmiş bir snapshot ve onun mount edilmiş partition'ları.
+    Loop cihazı ve aday listesi oturum boyunca bir kez hesaplanır.
+    """
+
+    def __init__(self, snapshot):
+        self.id = uuid.uuid4().hex[:8]
+        self.snapshot = snapshot
+        self.loop_dev = None
+        self.candidates = []
+        self.layout = None  # bkz. layout.py; çalışan mount yöntemleri VM diski bazında hatırlanır
+        self.readiness = core.ReadinessReport()
+        self.mounts = {}  # partition index -> mount dizini
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        # Oturumu kullanan istek sayısı (SessionManager kilidi altında); kullanımdaki oturum reaper / LRU ile kapatılmaz
+        self.users = 0
+        self.close_on_release = False
+
+    def open(self, config: Config):
+        self.loop_dev = core.map_snapshot(config, self.snapshot, report=self.readiness)
+        if not self.loop_dev: return self
+        core.activate_partitions(self.loop_dev, self.readiness)
+        print(f"Session {self.id} ready: {self.readiness.summary()}")
+        self.candidates = core.get_candidates(self.loop_dev)
+        self.layout = LAYOUTS.lookup(config['pbs_repository_path'], self.snapshot, core.DRIVE_NAME, self.loop_dev,
+                                     self.candidates)
+        return self
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def mount(self, index: int):
+        """Partition'ı (gerekirse) mount eder ve mount dizinini döner; başarısızsa None"""
+        with self.lock:
+            self.touch()
+            if index in self.mounts: return self.mounts[index]
+            if index < 0 or index >= len(self.candidates): raise Exception("Invalid partition index")
+
+            target = os.path.join(SESSION_ROOT, self.id, f"p{index}")
+            candidate = self.candidates[index]
+            strategy = core.mount_device(candidate['device'], target, candidate.get('fstype'), self.layout.strategy(index))
+            if not strategy: return None
+            self.layout.remember_mount(index, strategy)
+            self.mounts[index] = target
+            return target
+
+    def close(self):
+        with self.lock:
+            core.release_mapping(self.loop_dev, list(self.mounts.values()))
+            self.mounts = {}
+            try: core.run_host_command(f"rm -rf {os.path.join(SESSION_ROOT, self.id)}", suppress_errors=True)
+            except: pass
+
+class SessionManager:
+    """
+    /explore için açık tutulan snapshot oturumları.
+    Boşta kalma süresi (TTL), LRU üst sınırı ve açık kapatma destekler.
+    acquire() ile alınan oturum release() edilene kadar kullanımdadır (tercihen `with SESSIONS.use(...)`);
+    reaper ve LRU kullanımdaki oturumları atlar, açık kapatma isteklerin bitmesini bekler.
+    """
+
+    def __init__(self, idle_ttl=SESSION_IDLE_TTL, max_sessions=SESSION_MAX_OPEN):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # snapshot -> MountSession
+        self._lock = threading.RLock()
+        self._released = threading.Condition(self._lock)
+        self._reaper = None
+
+    def acquire(self, config: Config, snapshot: str):
+        self.reap_idle()
+        with self._lock:
+            session = self._sessions.get(snapshot)
+            if session:
+                self._sessions.move_to_end(snapshot)
+                session.touch()
+                session.users += 1
+                return session
+
+            # Sadece boştaki oturumlar atılır; hepsi kullanımdaysa sınır geçici olarak aşılır
+            # (boşa çıkanlar sonraki acquire veya reaper ile kapanır)
+            idle = [s for s in self._sessions.values() if not s.users]
+            for oldest in idle[:max(0, len(self._sessions) - self.max_sessions + 1)]:
+                self._sessions.pop(oldest.snapshot)
+                oldest.close()
+
+            session = MountSession(snapshot).open(config)
+            session.users += 1
+            if session.loop_dev: self._sessions[snapshot] = session
+            return session
+
+    def release(self, session):
+        with self._lock:
+            session.users -= 1
+            session.touch()
+            if session.users: return
+            self._released.notify_all()
+            if not session.close_on_release: return
+        session.close()
+
+    @contextmanager
+    def use(self, config: Config, snapshot: str):
+        session = self.acquire(config, snapshot)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def close(self, snapshot: str, wait=SESSION_CLOSE_WAIT):
+        """
+        Oturumu kapatır. Kullanımdaysa isteklerin bitmesi en fazla wait saniye beklenir;
+        süre dolarsa oturum son release() ile kapanır.
+        """
+        with self._lock:
+            session = self._sessions.pop(snapshot, None)
+            if session is None: return False
+            if not self._released.wait_for(lambda: not session.users, timeout=wait):
+                session.close_on_release = True
+                return True
+        session.close()
+        return True
+
+    def close_all(self):
+        with self._lock:
+            snapshots = list(self._sessions)
+        return sum(self.close(snapshot) for snapshot in snapshots)
+
+    def reap_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [s for s in self._sessions.values() if not s.users and now - s.last_used > self.idle_ttl]
+            for session in expired: self._sessions.pop(session.snapshot, None)
+        for session in expired: session.close()
+
+    def list(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "snapshot": s.snapshot,
+                "loop": s.loop_dev,
+                "mounted": sorted(s.mounts.keys()),
+                "users": s.users,
+                "readiness": s.readiness.stages,
+                "idle_seconds": int(now - s.last_used)
+            } for s in self._sessions.values()]
+
+    def start_reaper(self, interval=REAPER_INTERVAL):
+        if self._reaper: return
+        def loop():
+            while True:
+                time.sleep(interval)
+                try: self.reap_idle()
+                except Exception as e: print(f"Session reaper error: {e}")
+        self._reaper = threading.Thread(target=loop, name="pbsync-session-reaper", daemon=True)
+        self._reaper.start()
+
+SESSIONS = SessionManager()
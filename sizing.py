@@ -0,0 +1,111 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# --- Constants ---
+SIZE_WALK_WORKERS = int(os.environ.get("PBSYNC_SIZE_WORKERS", "8"))
+SIZE_CACHE_MAX = 4096
+
+def normalize_path(path):
+    """Mount köküne göre göreli yol; kök için '.'"""
+    return os.path.normpath(path.strip().strip("/")) if path and path.strip().strip("/") else "."
+
+def statvfs_used(root):
+    """Dosya sisteminin kullanılan byte miktarı; tüm volume yedeklerinde anlık tahmin"""
+    st = os.statvfs(root)
+    return (st.f_blocks - st.f_bfree) * st.f_frsize
+
+def _scan_dir(path):
+    size, files, subdirs = 0, 0, []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    else:
+                        size += entry.stat(follow_symlinks=False).st_size
+                        files += 1
+                except OSError: pass
+    except OSError: pass
+    return size, files, subdirs
+
+def walk_size(root, workers=SIZE_WALK_WORKERS, stop=None):
+    """
+    Dizin ağacını birden çok thread ile scandir kullanarak gezer ve toplam dosya boyutunu döner.
+    stop() True dönerse (iptal / zaman aşımı) yarıda kesilir ve None döner.
+    """
+    if not os.path.isdir(root) or os.path.islink(root):
+        try: return os.lstat(root).st_size
+        except OSError: return 0
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pbsync-size") as pool:
+        pending = {pool.submit(_scan_dir, root)}
+        while pending:
+            if stop is not None and stop():
+                for f in pending: f.cancel()
+                return None
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                size, _, subdirs = future.result()
+                total += size
+                for d in subdirs: pending.add(pool.submit(_scan_dir, d))
+    return total
+
+class SizeEstimator:
+    """
+    Snapshot + disk (drive) + partition + yol bazında boyut tahmini ve önbelleği.
+    Snapshot'lar değişmez olduğu için önbellek girdileri geçersiz olmaz, sadece LRU ile sınırlanır.
+    """
+
+    def __init__(self, max_entries=SIZE_CACHE_MAX):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # (snapshot, drive, partition, path) -> bytes
+        self._lock = threading.Lock()
+
+    def cached(self, snapshot, drive_name, partition, path):
+        key = (snapshot, drive_name, partition, normalize_path(path))
+        with self._lock:
+            if key not in self._cache: return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def _store(self, snapshot, drive_name, partition, path, size):
+        with self._lock:
+            self._cache[(snapshot, drive_name, partition, normalize_path(path))] = size
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def record(self, snapshot, drive_name, partition, path, size):
+        """Başka bir taramanın (ör. manifest taraması) hesapladığı boyutu önbelleğe ekler"""
+        self._store(snapshot, drive_name, partition, path, size)
+
+    def estimate(self, snapshot, drive_name, partition, root, paths, strategy="auto", stop=None):
+        """
+        Toplam boyutu ve kullanılan stratejiyi döner: (bytes, "cache"|"statvfs"|"walk").
+        auto: tüm volume için statvfs, seçili yollar için paralel scandir.
+        """
+        paths = [normalize_path(p) for p in paths] or ["."]
+        if strategy in ("auto", "statvfs") and paths == ["."]:
+            cached = self.cached(snapshot, drive_name, partition, ".")
+            if cached is not None: return cached, "cache"
+            # statvfs tahmini önbelleğe yazılmaz; gerçek walk sonucunu ezmesin
+            return statvfs_used(root), "statvfs"
+
+        total, used = 0, "cache"
+        for path in paths:
+            size = self.cached(snapshot, drive_name, partition, path)
+            if size is None:
+                size = walk_size(os.path.join(root, path), stop=stop)
+                if size is None: return None, "walk"
+                self._store(snapshot, drive_name, partition, path, size)
+                used = "walk"
+            total += size
+        return total, used
+
+    def is_cached(self, snapshot, drive_name, partition, paths):
+        return all(self.cached(snapshot, drive_name, partition, p) is not None for p in (paths or ["."]))
+
+SIZES = SizeEstimator()